@@ -0,0 +1,97 @@
+"""
+新房源评分基准测试。
+
+在临时数据库中为每个城市生成历史房源，再随机生成一批新房源，测量 ListingScorer 的评分耗时
+（首次评分包含加载城市历史，之后使用缓存），并检查评分范围和排序结果。
+
+用法:
+    python bench_scoring.py [--history 20000] [--houses 5000] [--seed 42]
+"""
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+
+from bench_subscriptions import random_house
+from scoring import ListingScorer
+
+# 每批新房源的评分耗时预算：一轮检查通常需要数秒，评分应可以忽略不计
+BUDGET_MS = 50.0
+
+
+def build_history(path, rng, rows):
+    conn = sqlite3.connect(path)
+    conn.execute(
+        """CREATE TABLE houses (id INTEGER PRIMARY KEY AUTOINCREMENT, url_key TEXT, area TEXT, city TEXT,
+           price_exc TEXT, price_inc TEXT, available_from TEXT, max_register TEXT, contract_type TEXT,
+           created_at TEXT DEFAULT CURRENT_TIMESTAMP, occupied_at TEXT DEFAULT NULL, rooms TEXT, booking_type TEXT)"""
+    )
+    conn.execute("CREATE INDEX idx_city_occupied_at ON houses (city, occupied_at)")
+    conn.executemany(
+        "INSERT INTO houses (url_key, area, city, price_inc) VALUES (?, ?, ?, ?)",
+        ((h["url_key"], h["area"], h["city"], h["price_inc"])
+         for h in (random_house(rng, f"history-{i}") for i in range(rows))),
+    )
+    conn.commit()
+    return conn
+
+
+def main():
+    parser = argparse.ArgumentParser(description="新房源评分基准测试")
+    parser.add_argument("--history", type=int, default=20000, help="数据库中的历史房源数")
+    parser.add_argument("--houses", type=int, default=5000, help="一批新房源的数量")
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    try:
+        import numpy  # noqa: F401
+    except ImportError:
+        print("✗ 未安装 numpy，无法评分（pip install -r requirements.txt）")
+        sys.exit(1)
+
+    rng = random.Random(args.seed)
+    workdir = tempfile.mkdtemp(prefix="h2s-bench-scoring-")
+    conn = build_history(os.path.join(workdir, "houses.db"), rng, args.history)
+    houses = [random_house(rng, i) for i in range(args.houses)]
+    scorer = ListingScorer()
+
+    started = time.perf_counter()
+    scores = scorer.score(conn, houses)
+    cold_ms = (time.perf_counter() - started) * 1000
+
+    timings = []
+    for _ in range(args.repeat):
+        started = time.perf_counter()
+        scorer.score(conn, houses)
+        timings.append((time.perf_counter() - started) * 1000)
+    warm_ms = sorted(timings)[len(timings) // 2]
+
+    started = time.perf_counter()
+    kept = scorer.select(houses)
+    select_ms = (time.perf_counter() - started) * 1000
+
+    print(f"历史房源: {args.history}，新房源: {args.houses}")
+    print(f"首次评分（含加载城市历史）: {cold_ms:.1f} ms")
+    print(f"评分（使用缓存的城市历史）: {warm_ms:.1f} ms，{warm_ms * 1000 / args.houses:.2f} µs/房源")
+    print(f"排序和截断: {select_ms:.1f} ms")
+    print(f"评分范围: {scores.min():.1f} - {scores.max():.1f}，中位数 {sorted(scores.tolist())[len(scores) // 2]:.1f}")
+
+    ordered = [houses[i]["score"] for i in kept]
+    if len(kept) != len(houses) or ordered != sorted(ordered, reverse=True):
+        print("✗ 排序结果不正确")
+        sys.exit(1)
+    if not (0 <= scores.min() and scores.max() <= 100):
+        print("✗ 评分超出 0-100")
+        sys.exit(1)
+    if warm_ms > BUDGET_MS:
+        print(f"✗ 评分耗时超过预算 {BUDGET_MS:.0f} ms")
+        sys.exit(1)
+    print(f"✓ 评分耗时在预算内（{BUDGET_MS:.0f} ms）")
+
+
+if __name__ == "__main__":
+    main()
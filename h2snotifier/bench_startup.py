@@ -0,0 +1,114 @@
+"""
+启动耗时基准测试。
+
+在临时目录中放一份最小配置，用子进程运行 `main.main(["--dry-run"])`，即单次运行模式下真实的启动路径：
+导入 main、配置日志（setup_logging）、读取并校验配置，然后退出。测量从导入 main 到返回的耗时（不含解释器本身的启动），
+并检查较重的模块（cloudscraper、requests、pytz、dotenv、http.server、asyncio、numpy）在这段启动路径中没有被导入。
+同时输出 `python -X importtime` 统计的 import main 耗时，便于定位是哪个模块变慢。
+超过预算或导入了重模块时以非零状态码退出，可直接用于 CI。
+
+用法:
+    python bench_startup.py [--budget-ms 150] [--runs 5]
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+HEAVY_MODULES = ("cloudscraper", "requests", "pytz", "dotenv", "http.server", "asyncio", "numpy")
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# 单次运行模式的最小配置
+BENCH_CONFIG = {
+    "PUSHPLUS_TOKEN": "",
+    "notifications": {"groups": [{"name": "bench", "cities": ["24", "25", "29"]}]},
+    "monitoring_settings": {"enabled": False},
+}
+
+# 在子进程中执行：结果写到标准错误，避免与写到标准输出的日志混在一起
+_STARTUP_CODE = f"""
+import sys, time
+started = time.perf_counter()
+import main
+code = main.main(["--dry-run"])
+elapsed_ms = (time.perf_counter() - started) * 1000
+heavy = ",".join(m for m in {HEAVY_MODULES!r} if m in sys.modules)
+print(f"BENCH {{elapsed_ms:.3f}} {{code or 0}} {{heavy}}", file=sys.stderr)
+"""
+
+
+def _env():
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [HERE, env.get("PYTHONPATH")]))
+    return env
+
+
+def measure_startup(workdir):
+    """:return: (启动耗时毫秒, main 的返回码, 启动路径中导入的重模块列表)"""
+    result = subprocess.run(
+        [sys.executable, "-c", _STARTUP_CODE], cwd=workdir, env=_env(), capture_output=True, text=True, check=True
+    )
+    for line in result.stderr.splitlines():
+        if line.startswith("BENCH "):
+            _, elapsed, code, heavy = (line + " ").split(" ", 3)
+            return float(elapsed), int(code), [m for m in heavy.strip().split(",") if m]
+    raise RuntimeError(f"未找到基准测试输出: {result.stderr[-500:]}")
+
+
+def measure_import_us(workdir, module="main"):
+    """返回导入 module 的累计耗时（微秒），取 -X importtime 输出中该模块的 cumulative 值"""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=workdir,
+        env=_env(),
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    for line in result.stderr.splitlines():
+        # 格式: import time: self [us] | cumulative | imported package
+        parts = line.split("|")
+        if len(parts) == 3 and parts[2].strip() == module:
+            return int(parts[1].strip())
+    raise RuntimeError(f"未在 importtime 输出中找到模块 {module}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="main.py 启动耗时基准测试")
+    parser.add_argument("--budget-ms", type=float, default=150.0, help="启动耗时预算（毫秒）")
+    parser.add_argument("--runs", type=int, default=5, help="测量次数，取中位数")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="h2s-bench-startup-")
+    with open(os.path.join(workdir, "config.json"), "w", encoding="utf-8") as f:
+        json.dump(BENCH_CONFIG, f)
+
+    runs = [measure_startup(workdir) for _ in range(args.runs)]
+    samples = sorted(elapsed for elapsed, _, _ in runs)
+    median_ms = samples[len(samples) // 2]
+    imports = sorted(measure_import_us(workdir) / 1000 for _ in range(args.runs))
+    print(f"启动 (main --dry-run): 中位数 {median_ms:.1f} ms (最小 {samples[0]:.1f} ms, 最大 {samples[-1]:.1f} ms), "
+          f"预算 {args.budget_ms:.1f} ms")
+    print(f"其中 import main: 中位数 {imports[len(imports) // 2]:.1f} ms")
+
+    failed = False
+    if any(code for _, code, _ in runs):
+        print("✗ 读取配置失败")
+        failed = True
+    heavy = sorted({m for _, _, loaded in runs for m in loaded})
+    if heavy:
+        print(f"✗ 启动时导入了重模块: {', '.join(heavy)}")
+        failed = True
+    if median_ms > args.budget_ms:
+        print("✗ 启动耗时超出预算")
+        failed = True
+    if not failed:
+        print("✓ 启动耗时在预算内")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""
+订阅索引基准测试。
+
+随机生成订阅者和房源，比较 SubscriptionIndex 与逐个检查 Subscription.matches() 的耗时，
+并校验两者的匹配结果完全一致。
+
+用法:
+    python bench_subscriptions.py [--subscribers 10000] [--houses 1000] [--seed 42]
+"""
+import argparse
+import random
+import sys
+import time
+
+from scrape import CITY_IDS, CONTRACT_TYPES, MAX_REGISTER_TYPES, ROOM_TYPES
+from subscriptions import Subscription, SubscriptionIndex
+
+CITIES = list(CITY_IDS)
+ROOMS = list(ROOM_TYPES.values())
+CONTRACTS = list(CONTRACT_TYPES.values())
+REGISTERS = list(MAX_REGISTER_TYPES.values())
+
+
+def maybe(rng, value, probability=0.5):
+    return value if rng.random() < probability else None
+
+
+def random_subscription(rng, i):
+    low = rng.randrange(400, 1200, 50)
+    start = f"2026-{rng.randint(1, 12):02d}-01"
+    return Subscription(
+        name=f"sub-{i}",
+        cities=rng.sample(CITIES, rng.randint(1, 3)),
+        min_price=maybe(rng, low, 0.3),
+        max_price=maybe(rng, low + rng.randrange(200, 1000, 50), 0.8),
+        min_area=maybe(rng, rng.randrange(15, 60, 5), 0.4),
+        rooms=maybe(rng, rng.sample(ROOMS, rng.randint(1, 3)), 0.3),
+        contract_types=maybe(rng, rng.sample(CONTRACTS, rng.randint(1, 3)), 0.2),
+        max_register=maybe(rng, rng.sample(REGISTERS, rng.randint(1, 3)), 0.2),
+        available_from=maybe(rng, start, 0.2),
+        available_to=maybe(rng, f"2026-{rng.randint(6, 12):02d}-28", 0.2),
+        only_direct_booking=rng.random() < 0.7,
+    )
+
+
+def random_house(rng, i):
+    return {
+        "url_key": f"house-{i}",
+        "city": rng.choice(CITIES),
+        "price_inc": f"{rng.uniform(450, 2000):.2f}",
+        "area": f"{rng.uniform(15, 90):.1f}",
+        "rooms": rng.choice(ROOMS),
+        "contract_type": rng.choice(CONTRACTS),
+        "max_register": rng.choice(REGISTERS),
+        "available_from": f"2026-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}",
+        "direct_booking": rng.random() < 0.6,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="订阅索引基准测试")
+    parser.add_argument("--subscribers", type=int, default=10000)
+    parser.add_argument("--houses", type=int, default=1000)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    subscriptions = [random_subscription(rng, i) for i in range(args.subscribers)]
+    houses = [random_house(rng, i) for i in range(args.houses)]
+
+    started = time.perf_counter()
+    index = SubscriptionIndex(subscriptions)
+    build_ms = (time.perf_counter() - started) * 1000
+
+    started = time.perf_counter()
+    indexed = [index.match(h) for h in houses]
+    index_us = (time.perf_counter() - started) * 1e6 / len(houses)
+
+    started = time.perf_counter()
+    linear = [[s for s in subscriptions if s.matches(h)] for h in houses]
+    linear_us = (time.perf_counter() - started) * 1e6 / len(houses)
+
+    mismatches = sum(
+        1 for a, b in zip(indexed, linear) if sorted(map(id, a)) != sorted(map(id, b))
+    )
+    matches = sum(len(m) for m in indexed)
+
+    print(f"订阅者: {args.subscribers}, 房源: {args.houses}, 平均每个房源匹配 {matches / len(houses):.1f} 个订阅者")
+    print(f"建立索引: {build_ms:.1f} ms")
+    print(f"索引匹配: {index_us:.1f} µs/房源")
+    print(f"逐个匹配: {linear_us:.1f} µs/房源 ({linear_us / index_us:.1f}x)")
+    if mismatches:
+        print(f"✗ {mismatches} 个房源的匹配结果与逐个匹配不一致")
+        sys.exit(1)
+    print("✓ 匹配结果与逐个匹配一致")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,17 +1,8 @@
 import sqlite3
 import os
 import logging
-import sys
 
-# 配置日志记录，同时输出到控制台和文件
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s - %(levelname)s - %(message)s",
-    handlers=[
-        logging.FileHandler("house_sync.log"),
-        logging.StreamHandler(sys.stdout)
-    ]
-)
+from logging_config import setup_logging
 
 
 def delete_database_file():
@@ -62,6 +53,7 @@ def clear_table_data():
 
 
 if __name__ == "__main__":
+    setup_logging()
     print("数据库清理工具")
     print("-" * 30)
     print("请选择操作:")
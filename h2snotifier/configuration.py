@@ -0,0 +1,407 @@
+import json
+import logging
+import os
+import time
+from datetime import datetime
+
+from scrape import make_query, CITY_IDS
+from subscriptions import Subscription, SubscriptionIndex
+
+CONFIG_PATH = "config.json"
+
+# 同时进行的打包请求数，过高可能触发 Cloudflare 限制
+DEFAULT_FETCH_CONCURRENCY = 4
+
+
+def read_config(config_path=CONFIG_PATH):
+    try:
+        logging.info(f"正在读取配置文件: {config_path}")
+        with open(config_path) as f:
+            config = json.load(f)
+            if not isinstance(config, dict):
+                # 交给 validate_config 报告结构错误
+                return config
+            # 优先从环境变量读取 PUSHPLUS_TOKEN
+            pushplus_token_env = os.environ.get("PUSHPLUS_TOKEN")
+            if pushplus_token_env:
+                config["PUSHPLUS_TOKEN"] = pushplus_token_env
+                logging.info("已从环境变量加载 PUSHPLUS_TOKEN")
+            notifications = config.get("notifications")
+            groups = notifications.get("groups") if isinstance(notifications, dict) else None
+            logging.info(f"成功读取配置文件，包含 {len(groups) if isinstance(groups, list) else 0} 个监控组")
+            return config
+    except FileNotFoundError:
+        logging.error(f"配置文件未找到: {config_path}")
+        return None
+    except json.JSONDecodeError:
+        logging.error(f"配置文件格式错误: {config_path}")
+        return None
+    except Exception as e:
+        logging.error(f"读取配置文件时发生错误: {str(e)}", exc_info=True) # 增强错误日志
+        return None
+
+
+def _is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def _check(errors, condition, message):
+    if not condition:
+        errors.append(message)
+
+
+def validate_config(config):
+    """
+    校验配置结构和取值范围。
+    :return: 错误信息列表，为空表示配置有效。
+    """
+    errors = []
+    if not isinstance(config, dict):
+        return ["配置文件顶层必须是对象"]
+
+    _check(errors, isinstance(config.get("only_direct_booking", True), bool), "only_direct_booking 必须是布尔值")
+    _check(errors, _is_number(config.get("max_price", 0)), "max_price 必须是数字")
+    _check(errors, isinstance(config.get("api_url", ""), str), "api_url 必须是字符串")
+    concurrency = config.get("fetch_concurrency", DEFAULT_FETCH_CONCURRENCY)
+    _check(errors, isinstance(concurrency, int) and 1 <= concurrency <= 32, "fetch_concurrency 必须是 1-32 的整数")
+
+    notifications = config.get("notifications", {})
+    if not isinstance(notifications, dict):
+        errors.append("notifications 必须是对象")
+        notifications = {}
+    groups = notifications.get("groups")
+    if not isinstance(groups, list):
+        errors.append("notifications.groups 必须是列表")
+        groups = []
+    for i, gp in enumerate(groups):
+        where = f"notifications.groups[{i}]"
+        if not isinstance(gp, dict):
+            errors.append(f"{where} 必须是对象")
+            continue
+        cities = gp.get("cities", [])
+        if not isinstance(cities, list) or not all(isinstance(c, (str, int)) for c in cities):
+            errors.append(f"{where}.cities 必须是城市ID列表")
+        else:
+            unknown = [str(c) for c in cities if str(c) not in CITY_IDS]
+            if unknown:
+                logging.warning(f"{where} 包含未知的城市ID: {unknown}")
+        _check(errors, isinstance(gp.get("only_direct_booking", True), bool), f"{where}.only_direct_booking 必须是布尔值")
+        _check(errors, _is_number(gp.get("max_price", 0)), f"{where}.max_price 必须是数字")
+        filters = gp.get("filters", {})
+        if not isinstance(filters, dict):
+            errors.append(f"{where}.filters 必须是对象")
+            continue
+        for key in ("min_price", "max_price", "min_area"):
+            _check(errors, key not in filters or _is_number(filters[key]), f"{where}.filters.{key} 必须是数字")
+        for key in ("rooms", "contract_type", "max_register"):
+            _check(errors, key not in filters or (isinstance(filters[key], list) and all(isinstance(v, str) for v in filters[key])),
+                   f"{where}.filters.{key} 必须是字符串列表")
+        for key in ("available_from", "available_to"):
+            _check(errors, key not in filters or isinstance(filters[key], str), f"{where}.filters.{key} 必须是日期字符串")
+
+    monitoring = config.get("monitoring_settings", {})
+    if not isinstance(monitoring, dict):
+        errors.append("monitoring_settings 必须是对象")
+        monitoring = {}
+    _check(errors, isinstance(monitoring.get("enabled", False), bool), "monitoring_settings.enabled 必须是布尔值")
+    _check(errors, isinstance(monitoring.get("timezone", ""), str), "monitoring_settings.timezone 必须是字符串")
+    workdays = monitoring.get("workdays", [])
+    _check(errors, isinstance(workdays, list) and all(isinstance(d, int) and 0 <= d <= 6 for d in workdays),
+           "monitoring_settings.workdays 必须是 0-6 的整数列表")
+    for key in ("start_hour", "end_hour"):
+        value = monitoring.get(key, 0)
+        _check(errors, isinstance(value, int) and 0 <= value <= 24, f"monitoring_settings.{key} 必须是 0-24 的整数")
+    for key in ("interval_minutes", "off_hours_interval_minutes"):
+        value = monitoring.get(key, 1)
+        _check(errors, _is_number(value) and value > 0, f"monitoring_settings.{key} 必须是正数")
+    jitter = monitoring.get("interval_jitter_percent", 0.0)
+    _check(errors, _is_number(jitter) and 0 <= jitter < 1, "monitoring_settings.interval_jitter_percent 必须在 [0, 1) 之间")
+
+    retention = config.get("retention", {})
+    if not isinstance(retention, dict):
+        errors.append("retention 必须是对象")
+        retention = {}
+    _check(errors, isinstance(retention.get("enabled", True), bool), "retention.enabled 必须是布尔值")
+    for key in ("archive_after_days", "batch_size", "vacuum_pages", "min_interval_hours"):
+        value = retention.get(key, 1)
+        _check(errors, _is_number(value) and value > 0, f"retention.{key} 必须是正数")
+
+    snapshot = config.get("snapshot", {})
+    if not isinstance(snapshot, dict):
+        errors.append("snapshot 必须是对象")
+        snapshot = {}
+    _check(errors, isinstance(snapshot.get("enabled", True), bool), "snapshot.enabled 必须是布尔值")
+    _check(errors, isinstance(snapshot.get("path", ""), str), "snapshot.path 必须是字符串")
+    value = snapshot.get("max_age_minutes", 1)
+    _check(errors, _is_number(value) and value > 0, "snapshot.max_age_minutes 必须是正数")
+
+    coordination = config.get("coordination", {})
+    if not isinstance(coordination, dict):
+        errors.append("coordination 必须是对象")
+        coordination = {}
+    _check(errors, coordination.get("mode", "single") in ("single", "leader", "shard"),
+           "coordination.mode 必须是 single、leader 或 shard")
+    _check(errors, coordination.get("backend", "sqlite") in ("sqlite", "lockfile"),
+           "coordination.backend 必须是 sqlite 或 lockfile")
+    _check(errors, isinstance(coordination.get("path", ""), str), "coordination.path 必须是字符串")
+    _check(errors, coordination.get("replica_id") is None or isinstance(coordination["replica_id"], str),
+           "coordination.replica_id 必须是字符串")
+    value = coordination.get("lease_seconds", 30)
+    # 等待期间每 5 秒续期一次，租约至少要覆盖几次续期
+    _check(errors, _is_number(value) and value >= 15, "coordination.lease_seconds 必须不小于 15")
+    value = coordination.get("claim_retention_days", 1)
+    _check(errors, _is_number(value) and value > 0, "coordination.claim_retention_days 必须是正数")
+
+    profiling = config.get("profiling", {})
+    if not isinstance(profiling, dict):
+        errors.append("profiling 必须是对象")
+        profiling = {}
+    _check(errors, isinstance(profiling.get("directory", ""), str), "profiling.directory 必须是字符串")
+    _check(errors, profiling.get("mode", "cprofile") in ("cprofile", "sample"), "profiling.mode 必须是 cprofile 或 sample")
+    for key in ("tracemalloc", "http"):
+        _check(errors, isinstance(profiling.get(key, False), bool), f"profiling.{key} 必须是布尔值")
+    value = profiling.get("cycles", 0)
+    _check(errors, isinstance(value, int) and value >= 0, "profiling.cycles 必须是非负整数")
+    for key in ("signal_cycles", "tracemalloc_frames", "top", "keep"):
+        value = profiling.get(key, 1)
+        _check(errors, isinstance(value, int) and value > 0, f"profiling.{key} 必须是正整数")
+    value = profiling.get("sample_interval_ms", 1)
+    _check(errors, _is_number(value) and value > 0, "profiling.sample_interval_ms 必须是正数")
+
+    scoring = config.get("scoring", {})
+    if not isinstance(scoring, dict):
+        errors.append("scoring 必须是对象")
+        scoring = {}
+    _check(errors, isinstance(scoring.get("enabled", True), bool), "scoring.enabled 必须是布尔值")
+    weights = scoring.get("weights", {})
+    _check(errors, isinstance(weights, dict) and all(_is_number(v) and v >= 0 for v in weights.values()),
+           "scoring.weights 必须是 评分项 -> 非负数 的映射")
+    for key in ("history_days", "min_history", "history_refresh_minutes", "availability_horizon_days"):
+        value = scoring.get(key, 1)
+        _check(errors, _is_number(value) and value > 0, f"scoring.{key} 必须是正数")
+    value = scoring.get("max_per_city")
+    _check(errors, value is None or (isinstance(value, int) and value > 0), "scoring.max_per_city 必须是正整数或 null")
+    value = scoring.get("min_score", 0)
+    _check(errors, _is_number(value) and 0 <= value <= 100, "scoring.min_score 必须在 0-100 之间")
+
+    rate_limits = config.get("rate_limits", {})
+    if not isinstance(rate_limits, dict):
+        errors.append("rate_limits 必须是对象")
+        rate_limits = {}
+    hot_cities = rate_limits.get("hot_cities", [])
+    _check(errors, isinstance(hot_cities, list) and all(isinstance(c, (str, int)) for c in hot_cities),
+           "rate_limits.hot_cities 必须是城市ID列表")
+    buckets = rate_limits.get("buckets", {})
+    if not isinstance(buckets, dict) or not all(isinstance(v, dict) for v in buckets.values()):
+        errors.append("rate_limits.buckets 必须是 桶名 -> 参数对象 的映射")
+        buckets = {}
+    for name, options in buckets.items():
+        value = options.get("rate_per_minute", 0)
+        _check(errors, _is_number(value) and value >= 0, f"rate_limits.buckets.{name}.rate_per_minute 必须是非负数")
+        value = options.get("burst", 1)
+        _check(errors, isinstance(value, int) and value >= 1, f"rate_limits.buckets.{name}.burst 必须是正整数")
+
+    notifiers = config.get("notifiers", {})
+    _check(errors, isinstance(notifiers, dict) and all(isinstance(v, dict) for v in notifiers.values()),
+           "notifiers 必须是 后端名称 -> 参数对象 的映射")
+    return errors
+
+
+def _fingerprint(*parts):
+    return json.dumps(parts, sort_keys=True, ensure_ascii=False, default=str)
+
+
+class Schedule:
+    """持续监控的时间表：根据当前时间给出工作时间或非工作时间的检查间隔"""
+
+    def __init__(self, monitoring_settings):
+        import pytz
+
+        tz_str = monitoring_settings.get("timezone", "Europe/Amsterdam")
+        try:
+            self.tz = pytz.timezone(tz_str)
+        except pytz.exceptions.UnknownTimeZoneError:
+            logging.error(f"无效的时区配置: {tz_str}. 将使用 UTC.")
+            self.tz = pytz.utc
+
+        self.workdays = monitoring_settings.get("workdays", [0, 1, 2, 3, 4]) # Mon-Fri
+        self.start_hour = monitoring_settings.get("start_hour", 9)
+        self.end_hour = monitoring_settings.get("end_hour", 17)
+        self.interval_minutes = monitoring_settings.get("interval_minutes", 5)
+        self.off_hours_interval_minutes = monitoring_settings.get("off_hours_interval_minutes", 30) # 读取非工作时间间隔
+        self.interval_jitter_percent = monitoring_settings.get("interval_jitter_percent", 0.0)
+
+    def now(self):
+        return datetime.now(self.tz)
+
+    def is_work_time(self, now_local):
+        return now_local.weekday() in self.workdays and self.start_hour <= now_local.hour < self.end_hour
+
+    def interval_for(self, now_local):
+        """:return: (基础间隔秒数, 说明文字)"""
+        if self.is_work_time(now_local):
+            return self.interval_minutes * 60, f"{self.interval_minutes} 分钟 (工作时间)"
+        return self.off_hours_interval_minutes * 60, f"{self.off_hours_interval_minutes} 分钟 (非工作时间)"
+
+    def describe(self):
+        return (f"时区={self.tz}, 工作日={self.workdays}, 时间={self.start_hour:02d}:00-{self.end_hour:02d}:00, "
+                f"工作时间间隔={self.interval_minutes}分钟, 非工作时间间隔={self.off_hours_interval_minutes}分钟, "
+                f"抖动={self.interval_jitter_percent*100}%")
+
+
+class CompiledConfig:
+    """
+    原始配置加上由它推导出的运行时状态（订阅索引、查询计划、时间表等）。
+    fingerprints 记录每部分的来源配置，重新加载时未变化的部分直接复用。
+    """
+
+    def __init__(self, raw):
+        self.raw = raw
+        self.fingerprints = {}
+        self.only_direct_booking = raw.get("only_direct_booking", True)
+        self.max_price = raw.get("max_price", 1000)
+        self.pushplus_token = None
+        self.subscriptions = []
+        self.index = None
+        self.queries = []
+        self.cities = set()
+        self.api_url = raw.get("api_url")
+        self.fetch_concurrency = raw.get("fetch_concurrency", DEFAULT_FETCH_CONCURRENCY)
+        # 热门城市的抓取和推送在限流器中优先
+        self.hot_cities = frozenset(str(c) for c in raw.get("rate_limits", {}).get("hot_cities", []))
+        self.monitoring_enabled = raw.get("monitoring_settings", {}).get("enabled", False)
+        self.schedule = None
+
+
+def _resolve_max_price(raw):
+    # 优先从环境变量读取 MAX_PRICE，然后从 config 文件读取，最后使用默认值
+    max_price_str = os.environ.get("MAX_PRICE")
+    if max_price_str:
+        try:
+            max_price = int(max_price_str)
+            logging.info(f"已从环境变量加载 MAX_PRICE: {max_price} 欧元")
+            return max_price
+        except (ValueError, TypeError):
+            max_price = raw.get("max_price", 1000)
+            logging.warning(f"环境变量 MAX_PRICE ('{max_price_str}') 不是有效整数, 将使用配置文件或默认值: {max_price} 欧元")
+            return max_price
+    return raw.get("max_price", 1000)
+
+
+def _resolve_pushplus_token(raw):
+    token = raw.get("PUSHPLUS_TOKEN") # 读取 PUSHPLUS_TOKEN
+    if not token or "你的PushPlusToken" in token:
+        logging.warning("PUSHPLUS_TOKEN 未设置或使用了示例/默认值，PushPlus 推送将不可用")
+        return None
+    return token
+
+
+def compile_config(raw, previous=None):
+    """
+    从原始配置生成 CompiledConfig。传入 previous 时，来源配置未变化的部分直接复用上一次的结果。
+    """
+    compiled = CompiledConfig(raw)
+    compiled.max_price = _resolve_max_price(raw)
+    compiled.pushplus_token = _resolve_pushplus_token(raw)
+    logging.info(f"配置设置：只推送可直接预订的房源: {compiled.only_direct_booking}, 房源价格上限: {compiled.max_price} 欧元")
+
+    groups = raw.get("notifications", {}).get("groups", [])
+    fp = _fingerprint(groups, compiled.only_direct_booking, compiled.max_price)
+    compiled.fingerprints["groups"] = fp
+    if previous is not None and previous.fingerprints.get("groups") == fp:
+        compiled.subscriptions = previous.subscriptions
+        compiled.index = previous.index
+        compiled.queries = previous.queries
+        compiled.cities = previous.cities
+    else:
+        # 每个监控组是一个订阅者，可以单独覆盖 only_direct_booking 和 max_price，并在 "filters" 中设置更细的条件
+        for gp in groups:
+            cities = [str(c) for c in gp.get("cities", [])]
+            if not cities:
+                logging.warning(f"监控组 {gp.get('name', '未命名组')} 未配置城市，跳过")
+                continue
+            subscription = Subscription.from_config(
+                gp, only_direct_booking=compiled.only_direct_booking, max_price=compiled.max_price
+            )
+            compiled.subscriptions.append(subscription)
+            # 总是抓取两种预订方式的房源：快照中需要抽签房源才能识别抽签/直接预订之间的变化，
+            # only_direct_booking 只在订阅匹配（SubscriptionIndex.direct_only）时生效
+            compiled.queries.append(make_query(cities, only_direct_booking=False))
+            compiled.cities.update(cities)
+            city_str = ', '.join([f"{city}({CITY_IDS.get(city, '未知')})" for city in cities])
+            logging.info(f"监控组 {subscription.name}: {city_str}")
+        compiled.index = SubscriptionIndex(compiled.subscriptions)
+
+    monitoring = raw.get("monitoring_settings", {})
+    fp = _fingerprint(monitoring)
+    compiled.fingerprints["schedule"] = fp
+    if previous is not None and previous.fingerprints.get("schedule") == fp:
+        compiled.schedule = previous.schedule
+    elif compiled.monitoring_enabled:
+        compiled.schedule = Schedule(monitoring)
+
+    compiled.fingerprints["notifiers"] = _fingerprint(raw.get("notifiers", {}), compiled.pushplus_token)
+    compiled.fingerprints["rate_limits"] = _fingerprint(raw.get("rate_limits", {}))
+    return compiled
+
+
+class ConfigWatcher:
+    """
+    通过轮询 mtime 监视配置文件，文件变化且校验通过后在两轮检查之间原子地替换当前配置。
+    校验失败时保留旧配置继续运行。
+    """
+
+    def __init__(self, path=CONFIG_PATH):
+        self.path = path
+        self.current = None
+        self._stamp = None
+
+    def _stat(self):
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return None
+        return st.st_mtime_ns, st.st_size
+
+    def _load(self):
+        """读取、校验并编译配置；任何失败都只记录日志并返回 None，热加载时继续使用旧配置"""
+        try:
+            raw = read_config(self.path)
+            if raw is None:
+                return None
+            errors = validate_config(raw)
+            if errors:
+                for error in errors:
+                    logging.error(f"配置校验失败: {error}")
+                return None
+            return compile_config(raw, previous=self.current)
+        except Exception as e:
+            logging.error(f"加载配置时发生错误: {e}", exc_info=True)
+            return None
+
+    def load(self):
+        """首次加载配置，失败时返回 None"""
+        self._stamp = self._stat()
+        self.current = self._load()
+        return self.current
+
+    def poll(self):
+        """
+        检查配置文件是否变化，变化且有效时替换当前配置。
+        :return: 本次是否替换了配置。
+        """
+        stamp = self._stat()
+        if stamp is None or stamp == self._stamp:
+            return False
+        self._stamp = stamp
+        started = time.perf_counter()
+        compiled = self._load()
+        if compiled is None:
+            logging.error("新配置无效，继续使用当前配置")
+            return False
+        previous, self.current = self.current, compiled
+        changed = [k for k, v in compiled.fingerprints.items() if previous is None or previous.fingerprints.get(k) != v]
+        if previous is not None and compiled.monitoring_enabled != previous.monitoring_enabled:
+            logging.warning("monitoring_settings.enabled 的变化需要重启程序才能生效")
+        logging.info(f"配置已重新加载，变化部分: {', '.join(changed) or '无'}，耗时 {(time.perf_counter() - started) * 1e6:.0f} µs")
+        return True
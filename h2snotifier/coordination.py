@@ -0,0 +1,367 @@
+"""
+多副本部署的协调层。每个副本仍然使用自己的 houses.db，副本之间通过一个共享的协调存储配合：
+
+- leader 模式：副本竞争名为 "leader" 的租约，只有持有租约的副本抓取和推送，其余副本待命；
+- shard 模式：副本定期写入心跳，按一致性哈希把城市分配给存活的副本，每个副本只抓取自己负责的城市。
+
+租约和心跳在等待下一轮检查期间也会续期，持有者宕机后租约在 lease_seconds 内过期，
+其他副本在下一次续期时接管，接管后立即开始一轮检查。
+所有副本在推送前都要在共享存储中“认领”房源（INSERT OR IGNORE），认领失败的房源不会推送，
+因此切换期间即使两个副本同时抓取同一城市，或接管的副本本地数据库较旧，也不会重复推送。
+房源下架时释放认领，之后重新上架仍会推送。
+
+协调存储有两种后端：
+- sqlite：共享的 SQLite 文件（例如挂载到所有容器的卷），适合多容器/多主机；
+- lockfile：目录 + fcntl 文件锁，只适用于同一主机上的多个进程，可用于本地测试。
+
+副本之间依赖各自的系统时钟判断租约是否过期，需要保持时钟同步（NTP）。
+"""
+import bisect
+import hashlib
+import json
+import logging
+import os
+import socket
+import sqlite3
+import time
+from contextlib import contextmanager
+
+MODES = ("single", "leader", "shard")
+
+DEFAULT_SETTINGS = {
+    "mode": "single",              # single: 不协调，单副本部署
+    "backend": "sqlite",
+    "path": "coordination.db",     # sqlite 后端为文件路径，lockfile 后端为目录
+    "replica_id": None,            # 默认使用环境变量 H2S_REPLICA_ID 或 主机名-进程号
+    "lease_seconds": 30,           # 租约和心跳的有效期，决定故障切换时间
+    "claim_retention_days": 30,    # 超过该时间的认领记录会被清理
+}
+
+LEADER_LEASE = "leader"
+
+
+def default_replica_id():
+    return os.environ.get("H2S_REPLICA_ID") or f"{socket.gethostname()}-{os.getpid()}"
+
+
+def _hash(value):
+    return int.from_bytes(hashlib.md5(value.encode("utf-8")).digest()[:8], "big")
+
+
+class HashRing:
+    """一致性哈希环：每个副本对应 vnodes 个虚拟节点，副本增减时只有约 1/N 的城市改变归属"""
+
+    def __init__(self, members, vnodes=64):
+        self.members = sorted(members)
+        points = sorted((_hash(f"{member}#{i}"), member) for member in self.members for i in range(vnodes))
+        self._keys = [p[0] for p in points]
+        self._owners = [p[1] for p in points]
+
+    def owner(self, key):
+        if not self._keys:
+            return None
+        i = bisect.bisect(self._keys, _hash(str(key))) % len(self._keys)
+        return self._owners[i]
+
+
+class SqliteLeaseBackend:
+    """
+    共享 SQLite 文件中的租约、心跳和认领表。读改写都在 BEGIN IMMEDIATE 事务中完成。
+    使用默认的回滚日志而不是 WAL，WAL 在网络文件系统上不可用。
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._conn = None
+
+    def _connect(self):
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            self._conn.executescript(
+                """CREATE TABLE IF NOT EXISTS leases
+                         (name TEXT PRIMARY KEY, holder TEXT NOT NULL, expires_at REAL NOT NULL, epoch INTEGER NOT NULL);
+                   CREATE TABLE IF NOT EXISTS members
+                         (replica TEXT PRIMARY KEY, expires_at REAL NOT NULL);
+                   CREATE TABLE IF NOT EXISTS claims
+                         (url_key TEXT PRIMARY KEY, replica TEXT NOT NULL, claimed_at REAL NOT NULL);
+                   CREATE INDEX IF NOT EXISTS idx_claims_claimed_at ON claims (claimed_at);"""
+            )
+        return self._conn
+
+    @contextmanager
+    def _transaction(self):
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    def acquire(self, name, holder, ttl, now):
+        """获取或续期租约，返回 (是否持有, epoch)；租约易主时 epoch 加一"""
+        with self._transaction() as conn:
+            row = conn.execute("SELECT holder, expires_at, epoch FROM leases WHERE name = ?", (name,)).fetchone()
+            if row is None:
+                conn.execute("INSERT INTO leases VALUES (?, ?, ?, 1)", (name, holder, now + ttl))
+                return True, 1
+            current, expires_at, epoch = row
+            if current != holder and expires_at > now:
+                return False, epoch
+            if current != holder:
+                epoch += 1
+            conn.execute("UPDATE leases SET holder = ?, expires_at = ?, epoch = ? WHERE name = ?",
+                         (holder, now + ttl, epoch, name))
+            return True, epoch
+
+    def release(self, name, holder):
+        with self._transaction() as conn:
+            conn.execute("UPDATE leases SET expires_at = 0 WHERE name = ? AND holder = ?", (name, holder))
+
+    def heartbeat(self, replica, ttl, now):
+        """写入心跳并返回存活的副本列表"""
+        with self._transaction() as conn:
+            conn.execute("INSERT OR REPLACE INTO members VALUES (?, ?)", (replica, now + ttl))
+            conn.execute("DELETE FROM members WHERE expires_at <= ?", (now,))
+            return [row[0] for row in conn.execute("SELECT replica FROM members")]
+
+    def leave(self, replica):
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM members WHERE replica = ?", (replica,))
+
+    def claim(self, url_keys, replica, now):
+        """认领房源，返回本副本认领成功的 url_key 集合"""
+        won = set()
+        with self._transaction() as conn:
+            for url_key in url_keys:
+                cursor = conn.execute("INSERT OR IGNORE INTO claims VALUES (?, ?, ?)", (url_key, replica, now))
+                if cursor.rowcount:
+                    won.add(url_key)
+        return won
+
+    def release_claims(self, url_keys):
+        keys = list(url_keys)
+        with self._transaction() as conn:
+            for i in range(0, len(keys), 500):
+                chunk = keys[i:i + 500]
+                conn.execute(f"DELETE FROM claims WHERE url_key IN ({','.join('?' * len(chunk))})", chunk)
+
+    def prune_claims(self, before):
+        with self._transaction() as conn:
+            return conn.execute("DELETE FROM claims WHERE claimed_at < ?", (before,)).rowcount
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+
+class LockFileBackend:
+    """
+    本地替代后端：租约和心跳保存在目录下的 state.json 中，读改写期间持有 fcntl 文件锁；
+    每个认领是 claims/ 下的一个文件，用 O_CREAT | O_EXCL 保证只有一个进程创建成功。
+    只适用于同一主机上的多个进程。
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self._claims = os.path.join(directory, "claims")
+        os.makedirs(self._claims, exist_ok=True)
+
+    @contextmanager
+    def _locked_state(self):
+        import fcntl
+
+        with open(os.path.join(self.directory, ".lock"), "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                path = os.path.join(self.directory, "state.json")
+                try:
+                    with open(path) as f:
+                        state = json.load(f)
+                except (OSError, ValueError):
+                    state = {}
+                state.setdefault("leases", {})
+                state.setdefault("members", {})
+                before = json.dumps(state, sort_keys=True)
+                yield state
+                if json.dumps(state, sort_keys=True) != before:
+                    tmp = f"{path}.tmp"
+                    with open(tmp, "w") as f:
+                        json.dump(state, f)
+                    os.replace(tmp, path)
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def acquire(self, name, holder, ttl, now):
+        with self._locked_state() as state:
+            lease = state["leases"].get(name)
+            if lease is None:
+                state["leases"][name] = {"holder": holder, "expires_at": now + ttl, "epoch": 1}
+                return True, 1
+            if lease["holder"] != holder and lease["expires_at"] > now:
+                return False, lease["epoch"]
+            if lease["holder"] != holder:
+                lease["epoch"] += 1
+            lease["holder"] = holder
+            lease["expires_at"] = now + ttl
+            return True, lease["epoch"]
+
+    def release(self, name, holder):
+        with self._locked_state() as state:
+            lease = state["leases"].get(name)
+            if lease is not None and lease["holder"] == holder:
+                lease["expires_at"] = 0
+
+    def heartbeat(self, replica, ttl, now):
+        with self._locked_state() as state:
+            members = state["members"]
+            members[replica] = now + ttl
+            for member, expires_at in list(members.items()):
+                if expires_at <= now:
+                    del members[member]
+            return list(members)
+
+    def leave(self, replica):
+        with self._locked_state() as state:
+            state["members"].pop(replica, None)
+
+    def _claim_path(self, url_key):
+        return os.path.join(self._claims, hashlib.sha1(url_key.encode("utf-8")).hexdigest())
+
+    def claim(self, url_keys, replica, now):
+        won = set()
+        for url_key in url_keys:
+            try:
+                fd = os.open(self._claim_path(url_key), os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except FileExistsError:
+                continue
+            with os.fdopen(fd, "w") as f:
+                f.write(f"{replica}\n{url_key}\n")
+            won.add(url_key)
+        return won
+
+    def release_claims(self, url_keys):
+        for url_key in url_keys:
+            try:
+                os.remove(self._claim_path(url_key))
+            except FileNotFoundError:
+                pass
+
+    def prune_claims(self, before):
+        removed = 0
+        for entry in os.scandir(self._claims):
+            if entry.stat().st_mtime < before:
+                try:
+                    os.remove(entry.path)
+                    removed += 1
+                except FileNotFoundError:
+                    pass
+        return removed
+
+    def close(self):
+        pass
+
+
+BACKENDS = {
+    "sqlite": SqliteLeaseBackend,
+    "lockfile": LockFileBackend,
+}
+
+
+class Coordinator:
+    """
+    决定本副本本轮负责哪些城市，并在推送前认领房源。
+    所有方法都是阻塞调用，运行时在数据库线程中调用它们。
+    """
+
+    def __init__(self, backend, mode, replica_id=None, lease_seconds=30, claim_retention_days=30):
+        if mode not in ("leader", "shard"):
+            raise ValueError(f"不支持的协调模式: {mode}")
+        self.backend = backend
+        self.mode = mode
+        self.replica_id = replica_id or default_replica_id()
+        self.lease_seconds = lease_seconds
+        self.claim_retention_days = claim_retention_days
+        self.epoch = None
+        self.members = []
+        self._last_prune = 0.0
+
+    def assignment(self, cities):
+        """
+        续期租约/心跳，返回本副本应抓取的城市集合。协调存储不可用时返回空集合：
+        宁可暂停抓取，也不在无法去重时推送。
+        """
+        cities = {str(c) for c in cities}
+        now = time.time()
+        try:
+            if self.mode == "leader":
+                is_leader, epoch = self.backend.acquire(LEADER_LEASE, self.replica_id, self.lease_seconds, now)
+                if is_leader and epoch != self.epoch:
+                    logging.info(f"副本 {self.replica_id} 成为主副本 (epoch {epoch})")
+                elif not is_leader and self.epoch is not None:
+                    logging.warning(f"副本 {self.replica_id} 失去主副本租约")
+                self.epoch = epoch if is_leader else None
+                assigned = cities if is_leader else set()
+            else:
+                members = sorted(self.backend.heartbeat(self.replica_id, self.lease_seconds, now))
+                if members != self.members:
+                    logging.info(f"存活副本变化: {self.members} -> {members}")
+                    self.members = members
+                ring = HashRing(members)
+                assigned = {c for c in cities if ring.owner(c) == self.replica_id}
+            if now - self._last_prune > 3600:
+                self._last_prune = now
+                pruned = self.backend.prune_claims(now - self.claim_retention_days * 86400)
+                if pruned:
+                    logging.info(f"清理了 {pruned} 条过期的推送认领记录")
+            return assigned
+        except (OSError, sqlite3.Error) as e:
+            logging.error(f"协调存储不可用，本副本暂停抓取: {e}")
+            self.epoch = None
+            return set()
+
+    def claim(self, url_keys):
+        """认领即将推送的房源，返回认领成功的 url_key 集合；协调存储不可用时不推送"""
+        try:
+            return self.backend.claim(list(url_keys), self.replica_id, time.time())
+        except (OSError, sqlite3.Error) as e:
+            logging.error(f"认领房源失败，跳过推送以避免重复: {e}")
+            return set()
+
+    def release(self, url_keys):
+        """房源下架时释放认领，重新上架时可以再次推送"""
+        try:
+            self.backend.release_claims(url_keys)
+        except (OSError, sqlite3.Error) as e:
+            logging.warning(f"释放认领失败: {e}")
+
+    def leave(self):
+        """正常退出时释放租约和心跳，其他副本可以立即接管"""
+        try:
+            if self.mode == "leader" and self.epoch is not None:
+                self.backend.release(LEADER_LEASE, self.replica_id)
+            elif self.mode == "shard":
+                self.backend.leave(self.replica_id)
+        except (OSError, sqlite3.Error) as e:
+            logging.warning(f"退出协调失败: {e}")
+        finally:
+            self.backend.close()
+
+
+def build_coordinator(settings):
+    """按 config.json 中的 "coordination" 设置创建 Coordinator；single 模式返回 None"""
+    settings = {**DEFAULT_SETTINGS, **(settings or {})}
+    if settings["mode"] == "single":
+        return None
+    backend = BACKENDS[settings["backend"]](settings["path"])
+    coordinator = Coordinator(
+        backend,
+        settings["mode"],
+        replica_id=settings["replica_id"],
+        lease_seconds=settings["lease_seconds"],
+        claim_retention_days=settings["claim_retention_days"],
+    )
+    logging.info(f"多副本协调已启用：模式 {coordinator.mode}，后端 {settings['backend']}，副本 {coordinator.replica_id}")
+    return coordinator
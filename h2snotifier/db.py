@@ -1,7 +1,5 @@
 import sqlite3
 import logging
-import sys
-from datetime import datetime
 from contextlib import contextmanager
 
 # Define column names for the houses table
@@ -15,29 +13,32 @@ house_columns = [
     "max_register",
     "contract_type",
     "rooms",
+    "booking_type",
 ]
 # Non-mass assignables: 'created_at', 'occupied_at'
 
-# Configure logging to output to both file and console
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s - %(levelname)s - %(message)s",
-    handlers=[
-        logging.FileHandler("house_sync.log"),
-        logging.StreamHandler(sys.stdout)
-    ]
-)
+DB_PATH = "houses.db"
 
 # 全局连接池
 _connection = None
 
+
+def open_connection(path=None):
+    """
+    打开一个新的数据库连接，默认使用 DB_PATH。使用 WAL 模式并设置忙等待超时，
+    这样后台维护任务（如 retention）使用独立连接时不会阻塞监控主流程。
+    """
+    conn = sqlite3.connect(path or DB_PATH, timeout=30)
+    conn.execute("PRAGMA journal_mode=WAL")
+    return conn
+
 # Function to create a database connection
 def create_connection():
     global _connection
     if _connection is not None:
         return _connection
     try:
-        _connection = sqlite3.connect("houses.db")
+        _connection = open_connection()
         logging.info("Database connection created")
         return _connection
     except sqlite3.Error as e:
@@ -83,62 +84,83 @@ def create_table():
                           contract_type TEXT,
                           created_at TEXT DEFAULT CURRENT_TIMESTAMP,
                           occupied_at TEXT DEFAULT NULL,
-                          rooms TEXT)"""
+                          rooms TEXT,
+                          booking_type TEXT)"""
             )
+            # 旧版数据库没有 booking_type 字段，补上
+            existing_columns = {row[1] for row in c.execute("PRAGMA table_info(houses)")}
+            if "booking_type" not in existing_columns:
+                c.execute("ALTER TABLE houses ADD COLUMN booking_type TEXT")
             c.execute("""CREATE INDEX IF NOT EXISTS idx_url_key ON houses (url_key)""")
+            c.execute("""CREATE INDEX IF NOT EXISTS idx_city_occupied_at ON houses (city, occupied_at)""")
             c.execute(
                 """CREATE INDEX IF NOT EXISTS idx_occupied_at ON houses (occupied_at)"""
             )
+            # view_db.py 按 (created_at, id) 游标分页，按城市、状态、价格筛选时使用以下索引
+            c.execute("""CREATE INDEX IF NOT EXISTS idx_created_id ON houses (created_at, id)""")
+            c.execute("""CREATE INDEX IF NOT EXISTS idx_city_created_id ON houses (city, created_at, id)""")
+            c.execute(
+                """CREATE INDEX IF NOT EXISTS idx_available_created_id ON houses (created_at, id)
+                   WHERE occupied_at IS NULL"""
+            )
+            c.execute("""CREATE INDEX IF NOT EXISTS idx_price_real ON houses (CAST(price_inc AS REAL))""")
             conn.commit()
+            create_summary_table(conn)
             logging.info("Table 'houses' created if not exists")
         except sqlite3.Error as e:
             logging.error(f"Error creating table: {e}")
 
 
-# Function to sync houses and update occupied_at
-def sync_houses(city_id, houses):
-    with get_connection() as conn:
-        if conn is None:
-            return []
 
-        c = conn.cursor()
-        new_houses = []
-        try:
-            # Get the existing houses in the database for the given city_id
-            c.execute("""SELECT url_key FROM houses WHERE city = ? and occupied_at is null """, (city_id,))
-            existing_houses = set(row[0] for row in c.fetchall())
-
-            # Extract the url_keys from the new houses
-            new_houses_url_keys = {house["url_key"] for house in houses}
-
-            # Houses to be updated (those in the database but not in the new houses)
-            to_be_updated = existing_houses - new_houses_url_keys
-            if to_be_updated:
-                update_query = f"""UPDATE houses SET occupied_at = ? WHERE occupied_at is null and url_key IN ({','.join(['?'] * len(to_be_updated))})"""
-                c.execute(
-                    update_query, (datetime.now().isoformat(),) + tuple(to_be_updated)
-                )
-
-            # Insert new houses into the database
-            to_be_inserted = [
-                tuple(house[column] for column in house_columns)
-                for house in houses
-                if house["url_key"] not in existing_houses
-            ]
-
-            new_houses = []
-            for house in houses:
-                if house["url_key"] not in existing_houses:
-                    new_houses.append(house)
-            if to_be_inserted:
-                # print(list(to_be_inserted[0]))
-                insert_query = f"""INSERT INTO houses ({','.join(house_columns)}) VALUES ({','.join(['?'] * len(house_columns))})"""
-                c.executemany(insert_query, to_be_inserted)
-                conn.commit()
-
-                logging.info(f"{len(new_houses)} new houses inserted into the database")
+# houses 表按 (城市, 状态) 的行数，由触发器在每次插入、删除和修改 occupied_at 时维护，
+# 查看统计时不必对 houses 做 COUNT(*) 全表扫描
+SUMMARY_TABLE = "house_counts"
+
+_STATUS = "CASE WHEN {row}.occupied_at IS NULL THEN 'available' ELSE 'occupied' END"
 
-        except sqlite3.Error as e:
-            logging.error(f"Error syncing houses: {e}")
 
-        return new_houses
+def _count_change(row, delta):
+    return (f"INSERT INTO {SUMMARY_TABLE} (city, status, count) VALUES ({row}.city, {_STATUS.format(row=row)}, {delta}) "
+            f"ON CONFLICT (city, status) DO UPDATE SET count = count + ({delta});")
+
+
+def create_summary_table(conn):
+    """
+    创建行数汇总表和维护它的触发器。第一次创建时在同一个事务中按现有数据回填，之后只由触发器增量更新。
+    """
+    exists = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (SUMMARY_TABLE,)
+    ).fetchone()
+    if exists:
+        return
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        conn.execute(
+            f"""CREATE TABLE IF NOT EXISTS {SUMMARY_TABLE}
+                     (city TEXT,
+                      status TEXT,
+                      count INTEGER NOT NULL,
+                      PRIMARY KEY (city, status)) WITHOUT ROWID"""
+        )
+        conn.execute(
+            f"""INSERT INTO {SUMMARY_TABLE} (city, status, count)
+                SELECT city, {_STATUS.format(row='houses')}, COUNT(*) FROM houses GROUP BY 1, 2"""
+        )
+        conn.execute(
+            f"""CREATE TRIGGER IF NOT EXISTS house_counts_insert AFTER INSERT ON houses
+                BEGIN {_count_change('NEW', 1)} END"""
+        )
+        conn.execute(
+            f"""CREATE TRIGGER IF NOT EXISTS house_counts_delete AFTER DELETE ON houses
+                BEGIN {_count_change('OLD', -1)} END"""
+        )
+        conn.execute(
+            f"""CREATE TRIGGER IF NOT EXISTS house_counts_update AFTER UPDATE OF city, occupied_at ON houses
+                WHEN OLD.city IS NOT NEW.city OR (OLD.occupied_at IS NULL) != (NEW.occupied_at IS NULL)
+                BEGIN {_count_change('OLD', -1)} {_count_change('NEW', 1)} END"""
+        )
+        conn.commit()
+    except sqlite3.Error:
+        conn.rollback()
+        raise
+    logging.info(f"已创建行数汇总表 {SUMMARY_TABLE}")
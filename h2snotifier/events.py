@@ -0,0 +1,247 @@
+import hashlib
+import json
+import logging
+import sqlite3
+from collections import namedtuple
+from datetime import datetime
+
+from db import get_connection, house_columns
+from retention import ARCHIVE_TABLE
+
+# 事件类型
+ADDED = "added"
+REMOVED = "removed"
+PRICE_CHANGED = "price_changed"
+BOOKING_TYPE_CHANGED = "booking_type_changed"
+RELISTED = "relisted"
+
+EVENT_TYPES = (ADDED, REMOVED, PRICE_CHANGED, BOOKING_TYPE_CHANGED, RELISTED)
+
+Event = namedtuple("Event", ["id", "created_at", "type", "city", "url_key", "data"])
+
+
+def create_events_table(conn):
+    """创建只追加的事件表，禁止修改已写入的事件"""
+    conn.execute(
+        """CREATE TABLE IF NOT EXISTS events
+                 (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                  created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+                  type TEXT NOT NULL,
+                  city TEXT,
+                  url_key TEXT,
+                  data TEXT)"""
+    )
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_events_type ON events (type, id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_events_city ON events (city, id)")
+    conn.execute(
+        """CREATE TRIGGER IF NOT EXISTS events_append_only BEFORE UPDATE ON events
+           BEGIN SELECT RAISE(ABORT, 'events is append-only'); END"""
+    )
+    conn.commit()
+
+
+def _row_to_event(row):
+    return Event(row[0], row[1], row[2], row[3], row[4], json.loads(row[5]) if row[5] else {})
+
+
+def iter_events(since_id=0, types=None, city=None, batch_size=500):
+    """
+    按 id 顺序逐批读取事件，内存占用与事件总数无关。
+    :param since_id: 只返回 id 大于该值的事件，可用于断点续读。
+    :param types: 只返回这些类型的事件。
+    :param city: 只返回该城市的事件。
+    """
+    last_id = since_id
+    while True:
+        with get_connection() as conn:
+            if conn is None:
+                return
+            sql = "SELECT id, created_at, type, city, url_key, data FROM events WHERE id > ?"
+            params = [last_id]
+            if types:
+                sql += f" AND type IN ({','.join('?' * len(types))})"
+                params.extend(types)
+            if city is not None:
+                sql += " AND city = ?"
+                params.append(str(city))
+            sql += " ORDER BY id LIMIT ?"
+            params.append(batch_size)
+            rows = conn.execute(sql, params).fetchall()
+        if not rows:
+            return
+        for row in rows:
+            yield _row_to_event(row)
+        last_id = rows[-1][0]
+
+
+def _price(value):
+    try:
+        return float(str(value).replace(",", "."))
+    except (TypeError, ValueError):
+        return None
+
+
+def listings_fingerprint(houses):
+    """房源集合的指纹（url_key、价格、预订方式），集合不变时指纹不变"""
+    digest = hashlib.sha1()
+    for url_key, price, booking in sorted(houses):
+        digest.update(f"{url_key}\t{price}\t{booking}\n".encode("utf-8"))
+    return digest.digest()
+
+
+class DiffEngine:
+    """
+    对比每个城市本轮抓取到的房源和上一轮的快照，生成类型化的变化事件，
+    在同一个事务中更新 houses 表并把事件追加到 events 表。
+    快照保存在内存中，只有第一次处理某个城市时才加载：优先使用 warm（snapshot.Snapshot），否则从数据库加载。
+    """
+
+    def __init__(self, warm=None):
+        # city -> {url_key: (price_inc, booking_type)}
+        self.snapshots = {}
+        # city -> listings_fingerprint()，与上一轮相同的城市直接跳过
+        self.fingerprints = {}
+        self.warm = warm
+        self._subscribers = []
+        with get_connection() as conn:
+            if conn is not None:
+                create_events_table(conn)
+
+    def subscribe(self, callback, types=None):
+        """
+        订阅事件；每个城市处理完成、事件写入数据库后，callback(events) 会收到该城市匹配的事件列表。
+        """
+        self._subscribers.append((callback, set(types) if types else None))
+
+    def _load_snapshot(self, conn, city_id):
+        if self.warm is not None:
+            listings = self.warm.listings(city_id)
+            if listings is not None:
+                fingerprint = self.warm.fingerprint(city_id)
+                if fingerprint is not None:
+                    self.fingerprints[city_id] = fingerprint
+                return listings
+        rows = conn.execute(
+            "SELECT url_key, price_inc, booking_type FROM houses WHERE city = ? AND occupied_at IS NULL",
+            (city_id,),
+        ).fetchall()
+        return {url_key: (price_inc, booking_type) for url_key, price_inc, booking_type in rows}
+
+    def _previously_listed(self, conn, city_id, url_keys):
+        """在已下架的历史记录（包括已移入归档表的旧记录）中查找这些 url_key，用于识别重新上架"""
+        found = set()
+        keys = list(url_keys)
+        has_archive = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (ARCHIVE_TABLE,)
+        ).fetchone() is not None
+        # 每批 400 个：加上归档表的条件共约 800 个参数，低于旧版 SQLite 999 个参数的上限
+        for i in range(0, len(keys), 400):
+            chunk = keys[i:i + 400]
+            placeholders = ",".join("?" * len(chunk))
+            sql = f"SELECT url_key FROM houses WHERE city = ? AND occupied_at IS NOT NULL AND url_key IN ({placeholders})"
+            params = [city_id, *chunk]
+            if has_archive:
+                sql += f" UNION SELECT url_key FROM {ARCHIVE_TABLE} WHERE city = ? AND url_key IN ({placeholders})"
+                params += [city_id, *chunk]
+            found.update(row[0] for row in conn.execute(sql, params))
+        return found
+
+    def apply(self, city_id, houses):
+        """
+        处理一个城市本轮的完整房源列表。
+        :return: 本次产生的事件列表（已持久化，带 id）。
+        """
+        fingerprint = listings_fingerprint((h["url_key"], h["price_inc"], h.get("booking_type")) for h in houses)
+        with get_connection() as conn:
+            if conn is None:
+                return []
+            try:
+                if city_id not in self.snapshots:
+                    self.snapshots[city_id] = self._load_snapshot(conn, city_id)
+                if self.fingerprints.get(city_id) == fingerprint:
+                    return []
+                previous = self.snapshots[city_id]
+                current = {house["url_key"]: house for house in houses}
+                now = datetime.now().isoformat()
+
+                pending = []  # (type, url_key, data)
+                appeared = [key for key in current if key not in previous]
+                relisted = self._previously_listed(conn, city_id, appeared) if appeared else set()
+                for key in appeared:
+                    pending.append((RELISTED if key in relisted else ADDED, key, {"house": current[key]}))
+
+                for key in previous.keys() - current.keys():
+                    old_price, old_booking = previous[key]
+                    pending.append((REMOVED, key, {"price_inc": old_price, "booking_type": old_booking}))
+
+                changed = []
+                for key in previous.keys() & current.keys():
+                    old_price, old_booking = previous[key]
+                    house = current[key]
+                    new_booking = house.get("booking_type")
+                    price_changed = _price(old_price) != _price(house["price_inc"])
+                    booking_changed = old_booking is not None and old_booking != new_booking
+                    if price_changed:
+                        pending.append((PRICE_CHANGED, key, {"old": old_price, "new": house["price_inc"], "house": house}))
+                    if booking_changed:
+                        pending.append((BOOKING_TYPE_CHANGED, key, {"old": old_booking, "new": new_booking, "house": house}))
+                    # 旧版数据没有 booking_type 时只补写，不产生事件
+                    if price_changed or booking_changed or (old_booking is None and new_booking):
+                        changed.append(house)
+
+                removed = [key for t, key, _ in pending if t == REMOVED]
+                if removed:
+                    conn.executemany(
+                        "UPDATE houses SET occupied_at = ? WHERE city = ? AND occupied_at IS NULL AND url_key = ?",
+                        [(now, city_id, key) for key in removed],
+                    )
+                if appeared:
+                    insert_query = f"""INSERT INTO houses ({','.join(house_columns)}) VALUES ({','.join(['?'] * len(house_columns))})"""
+                    conn.executemany(
+                        insert_query,
+                        [tuple(current[key].get(column) for column in house_columns) for key in appeared],
+                    )
+                if changed:
+                    conn.executemany(
+                        "UPDATE houses SET price_inc = ?, price_exc = ?, booking_type = ? "
+                        "WHERE city = ? AND occupied_at IS NULL AND url_key = ?",
+                        [(h["price_inc"], h["price_exc"], h.get("booking_type"), city_id, h["url_key"]) for h in changed],
+                    )
+
+                events = []
+                for event_type, key, data in pending:
+                    cursor = conn.execute(
+                        "INSERT INTO events (created_at, type, city, url_key, data) VALUES (?, ?, ?, ?, ?)",
+                        (now, event_type, city_id, key, json.dumps(data, ensure_ascii=False)),
+                    )
+                    events.append(Event(cursor.lastrowid, now, event_type, city_id, key, data))
+                conn.commit()
+            except sqlite3.Error as e:
+                conn.rollback()
+                logging.error(f"Error syncing houses: {e}")
+                # 快照可能与数据库不一致，下次重新加载
+                self.snapshots.pop(city_id, None)
+                self.fingerprints.pop(city_id, None)
+                return []
+
+        self.snapshots[city_id] = {
+            key: (house["price_inc"], house.get("booking_type")) for key, house in current.items()
+        }
+        self.fingerprints[city_id] = fingerprint
+        if appeared:
+            logging.info(f"{len(appeared)} new houses inserted into the database")
+
+        for callback, types in self._subscribers:
+            selected = [e for e in events if types is None or e.type in types]
+            if selected:
+                try:
+                    callback(selected)
+                except Exception as e:
+                    logging.error(f"事件订阅者处理失败: {e}", exc_info=True)
+        return events
+
+    def close(self):
+        """释放加载时使用的快照文件"""
+        if self.warm is not None:
+            self.warm.close()
+            self.warm = None
@@ -0,0 +1,149 @@
+"""
+压力测试：启动本地模拟接口（mock_upstream.py），用临时数据库运行若干轮完整的检查流程
+（抓取 -> 快照对比 -> 订阅匹配 -> 推送），每轮之间模拟房源上架、下架和调价，
+最后输出每轮耗时的分位数、吞吐量和事件数量。不会访问真实接口，也不会发送真实推送。
+
+用法:
+    python loadgen.py --cycles 20 --listings-per-city 500 --groups 50 --latency-ms 80 --error-rate 0.02
+    python loadgen.py --url http://127.0.0.1:8081/graphql/   # 使用已单独启动的模拟接口
+    python loadgen.py --rate-per-minute 120 --burst 5        # 对模拟接口启用限流，观察限流等待
+"""
+import argparse
+import asyncio
+import os
+import random
+import tempfile
+import time
+
+import db
+import ratelimit
+from mock_upstream import add_mock_arguments, start_mock_server, upstream_from_args
+
+
+class CountingDelivery:
+    """代替 DeliveryCore，只统计消息数量，不发送推送"""
+
+    def __init__(self):
+        self.messages = 0
+
+    def __bool__(self):
+        return True
+
+    async def deliver(self, messages):
+        self.messages += len(messages)
+        return {"loadgen": len(messages)}
+
+    def close(self):
+        pass
+
+
+def build_config(cities, groups, api_url, seed=0):
+    """生成 groups 个监控组，每组随机覆盖几个城市并带有不同的筛选条件"""
+    rng = random.Random(seed)
+    raw_groups = []
+    for i in range(groups):
+        filters = {"max_price": rng.choice([800, 1000, 1200, 1500, 2000])}
+        if rng.random() < 0.5:
+            filters["min_area"] = rng.choice([20, 30, 40])
+        raw_groups.append({
+            "name": f"loadgen-{i}",
+            "cities": rng.sample(cities, min(len(cities), rng.randint(1, 4))),
+            "only_direct_booking": rng.random() < 0.5,
+            "filters": filters,
+        })
+    return {
+        "api_url": api_url,
+        "only_direct_booking": True,
+        "max_price": 2000,
+        "notifications": {"groups": raw_groups},
+        "monitoring_settings": {"enabled": False},
+    }
+
+
+def percentile(values, p):
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))]
+
+
+async def run(args):
+    from configuration import compile_config
+    from runtime import MonitorRuntime
+
+    upstream = None
+    server = None
+    url = args.url
+    if url is None:
+        upstream = upstream_from_args(args)
+        server, url = start_mock_server(upstream)
+    cities = args.cities.split(",")
+    # 默认不限流，只测量检查流程本身的耗时
+    ratelimit.configure({"buckets": {"host": {"rate_per_minute": args.rate_per_minute, "burst": args.burst}}})
+
+    workdir = tempfile.mkdtemp(prefix="h2s-loadgen-")
+    db.DB_PATH = os.path.join(workdir, "houses.db")
+    delivery = CountingDelivery()
+    runtime = MonitorRuntime(delivery, fetch_concurrency=args.fetch_concurrency)
+    # 快照也写到临时目录，不读取或覆盖当前目录下正式运行用的 snapshot.bin
+    await runtime.start({"path": os.path.join(workdir, "snapshot.bin")})
+    try:
+        config = compile_config(build_config(cities, args.groups, url, args.seed))
+        durations = []
+        churned = {"added": 0, "removed": 0, "price_changed": 0, "booking_flipped": 0}
+        started = time.perf_counter()
+        for cycle in range(args.cycles):
+            if cycle and upstream is not None:
+                for key, n in upstream.listings.churn(
+                    args.add_rate, args.remove_rate, args.price_change_rate, args.booking_flip_rate
+                ).items():
+                    churned[key] += n
+            cycle_started = time.perf_counter()
+            await runtime.run_cycle(config)
+            durations.append(time.perf_counter() - cycle_started)
+            print(f"第 {cycle + 1}/{args.cycles} 轮: {durations[-1]:.3f} 秒")
+        elapsed = time.perf_counter() - started
+        listings = runtime.metrics["listings"]
+    finally:
+        await runtime.stop()
+        if server is not None:
+            server.shutdown()
+
+    print("-" * 40)
+    print(f"监控组: {args.groups}，城市: {len(cities)}，当前在架房源（已抓取）: {listings}，并发请求: {args.fetch_concurrency}")
+    print(f"每轮耗时: p50 {percentile(durations, 50):.3f} 秒, p95 {percentile(durations, 95):.3f} 秒, "
+          f"最大 {max(durations):.3f} 秒")
+    print(f"吞吐量: {listings * args.cycles / elapsed:.0f} 房源/秒（按每轮在架房源估算）")
+    print(f"事件: {runtime.metrics['events_total']}")
+    print(f"推送消息: {delivery.messages}")
+    if args.rate_per_minute:
+        print(f"限流器:\n{ratelimit.metrics_text()}", end="")
+    if upstream is not None:
+        print(f"模拟变化: {churned}")
+        print(f"模拟接口: {upstream.stats}")
+    print(f"临时数据库: {db.DB_PATH}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="使用本地模拟接口对完整检查流程做压力测试")
+    parser.add_argument("--url", default=None, help="已运行的模拟接口地址；不指定时在进程内启动")
+    parser.add_argument("--cycles", type=int, default=10)
+    parser.add_argument("--fetch-concurrency", type=int, default=4, help="同时进行的打包请求数")
+    parser.add_argument("--groups", type=int, default=20, help="生成的监控组数量")
+    parser.add_argument("--add-rate", type=float, default=0.05, help="每轮新增房源比例")
+    parser.add_argument("--remove-rate", type=float, default=0.05, help="每轮下架房源比例")
+    parser.add_argument("--price-change-rate", type=float, default=0.02)
+    parser.add_argument("--booking-flip-rate", type=float, default=0.01)
+    parser.add_argument("--rate-per-minute", type=float, default=0, help="模拟接口的限流速率，0 表示不限流")
+    parser.add_argument("--burst", type=int, default=10, help="限流器允许的突发请求数")
+    parser.add_argument("--log-level", default="WARNING")
+    add_mock_arguments(parser)
+    args = parser.parse_args()
+
+    from logging_config import setup_logging, stop_logging
+
+    setup_logging(level=args.log_level, log_file=os.path.join(tempfile.gettempdir(), "h2s-loadgen.log"))
+    try:
+        asyncio.run(run(args))
+    finally:
+        stop_logging()
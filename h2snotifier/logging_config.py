@@ -0,0 +1,216 @@
+import atexit
+import copy
+import gzip
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import shutil
+import sys
+import time
+from datetime import datetime, timezone
+
+LOG_FILE = "house_sync.log"
+LOG_FORMAT = "%(asctime)s - %(levelname)s - %(message)s"
+
+# 日志文件轮转：超过大小或超过时间间隔都会轮转，旧文件以 gzip 压缩保存
+LOG_MAX_BYTES = 10 * 1024 * 1024
+LOG_ROTATE_INTERVAL_SECONDS = 24 * 60 * 60
+LOG_BACKUP_COUNT = 7
+
+# 日志队列上限，磁盘写入跟不上时丢弃新日志而不是阻塞主流程
+LOG_QUEUE_SIZE = 10000
+
+# 逐房源事件的采样：每个事件名在每个窗口内最多输出 SAMPLE_BURST 条
+SAMPLE_WINDOW_SECONDS = 60
+SAMPLE_BURST = 20
+
+# LogRecord 自带的属性，JSON 输出时不作为业务字段
+_RESERVED_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime"}
+
+_configured = False
+_listener = None
+_exception_formatter = logging.Formatter()
+
+
+class JsonFormatter(logging.Formatter):
+    """把日志记录格式化为单行 JSON，事件名放在 event 字段，业务字段平铺在顶层"""
+
+    def format(self, record):
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "event": getattr(record, "event", "log"),
+            "msg": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RESERVED_ATTRS and key not in ("event", "sample"):
+                entry[key] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class CompressingRotatingFileHandler(logging.handlers.RotatingFileHandler):
+    """
+    按大小或时间轮转的文件 handler，轮转出的旧文件用 gzip 压缩。
+    上次轮转的时间记录在 <日志文件>.rollover 的修改时间中，进程重启（如定时任务模式每次只运行一轮）后仍按原时间轮转。
+    """
+
+    def __init__(self, filename, max_bytes=LOG_MAX_BYTES, interval=LOG_ROTATE_INTERVAL_SECONDS,
+                 backup_count=LOG_BACKUP_COUNT, encoding="utf-8"):
+        super().__init__(filename, maxBytes=max_bytes, backupCount=backup_count, encoding=encoding)
+        self.interval = interval
+        self.marker = self.baseFilename + ".rollover"
+        self.rollover_at = self._last_rollover() + interval
+        self.namer = lambda name: name + ".gz"
+        self.rotator = self._compress
+
+    def _last_rollover(self):
+        try:
+            return os.path.getmtime(self.marker)
+        except OSError:
+            self._touch_marker()
+            return time.time()
+
+    def _touch_marker(self):
+        with open(self.marker, "a"):
+            pass
+        os.utime(self.marker)
+
+    @staticmethod
+    def _compress(source, dest):
+        with open(source, "rb") as src, gzip.open(dest, "wb") as dst:
+            shutil.copyfileobj(src, dst)
+        os.remove(source)
+
+    def shouldRollover(self, record):
+        if self.interval and time.time() >= self.rollover_at:
+            if os.path.exists(self.baseFilename) and os.path.getsize(self.baseFilename) > 0:
+                return True
+            # 日志文件为空，不必轮转出一个空的压缩文件，只重新计时
+            self._touch_marker()
+            self.rollover_at = time.time() + self.interval
+        return super().shouldRollover(record)
+
+    def doRollover(self):
+        super().doRollover()
+        self._touch_marker()
+        self.rollover_at = time.time() + self.interval
+
+
+class SamplingFilter(logging.Filter):
+    """
+    对带 sample=True 的逐房源事件限流：同一事件名在每个窗口内最多放行 burst 条，
+    多余的丢弃并计数，下一个窗口放行的第一条记录带上 suppressed 字段。
+    """
+
+    def __init__(self, window=SAMPLE_WINDOW_SECONDS, burst=SAMPLE_BURST):
+        super().__init__()
+        self.window = window
+        self.burst = burst
+        self._windows = {}
+
+    def filter(self, record):
+        if not getattr(record, "sample", False):
+            return True
+        event = getattr(record, "event", record.msg)
+        now = record.created
+        started, passed, suppressed = self._windows.get(event, (now, 0, 0))
+        if now - started >= self.window:
+            if suppressed:
+                record.suppressed = suppressed
+            started, passed, suppressed = now, 0, 0
+        if passed >= self.burst:
+            self._windows[event] = (started, passed, suppressed + 1)
+            return False
+        self._windows[event] = (started, passed + 1, suppressed)
+        return True
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """队列满时直接丢弃日志并计数，保证记录日志不会阻塞调用方"""
+
+    dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def prepare(self, record):
+        """
+        默认实现会把异常堆栈拼进 msg 并清空 exc_info，JSON 日志就没有 exc 字段；
+        这里只合并消息参数，把堆栈格式化到 exc_text 中交给后台线程的 formatter 输出。
+        """
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = record.exc_text or _exception_formatter.formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+def log_event(event, msg="", level=logging.INFO, sample=False, logger=None, exc_info=False, **fields):
+    """
+    记录一条结构化事件。
+    :param event: 稳定的事件名，例如 'scrape.done'、'house.parse_failed'。
+    :param msg: 给人看的说明文字。
+    :param level: 日志级别。
+    :param sample: 是否为逐房源的高频事件，是则经过采样限流。
+    :param exc_info: 在 except 块中传入 True 以记录异常堆栈（JSON 日志中的 exc 字段）。
+    :param fields: 业务字段，例如 city、url_key、stage、duration。
+    """
+    logger = logger or logging.getLogger()
+    if not logger.isEnabledFor(level):
+        return
+    extra = dict(fields)
+    extra["event"] = event
+    extra["sample"] = sample
+    logger.log(level, msg or event, exc_info=exc_info, extra=extra)
+
+
+def setup_logging(level=None, log_file=LOG_FILE):
+    """
+    配置全局日志：调用方只把日志放入队列，由后台 QueueListener 线程写入
+    控制台（可读文本）和日志文件（JSON 行，按大小/时间轮转并压缩）。
+    只在程序入口调用一次，重复调用不会重复添加 handler。
+    """
+    global _configured, _listener
+    if _configured:
+        return
+    if level is None:
+        level = os.environ.get("LOG_LEVEL", "INFO").upper()
+
+    file_handler = CompressingRotatingFileHandler(log_file)
+    file_handler.setFormatter(JsonFormatter())
+    console_handler = logging.StreamHandler(sys.stdout)
+    console_handler.setFormatter(logging.Formatter(LOG_FORMAT))
+
+    queue_handler = DroppingQueueHandler(queue.Queue(LOG_QUEUE_SIZE))
+    queue_handler.addFilter(SamplingFilter())
+
+    root = logging.getLogger()
+    root.setLevel(level)
+    root.addHandler(queue_handler)
+
+    _listener = logging.handlers.QueueListener(
+        queue_handler.queue, file_handler, console_handler, respect_handler_level=True
+    )
+    _listener.start()
+    atexit.register(stop_logging)
+    _configured = True
+
+
+def stop_logging():
+    """停止后台日志线程并把队列中剩余的日志写完"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
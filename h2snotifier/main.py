@@ -1,206 +1,171 @@
 import logging
-import sys
-from db import create_table, sync_houses, close_connection
-from scrape import scrape, house_to_msg, CITY_IDS
-from pushplus import send_pushplus_msg
-import json
+from logging_config import setup_logging
+from configuration import ConfigWatcher, CONFIG_PATH
 import time
-from datetime import datetime, timezone
-import pytz
 import random # 导入 random 模块
-from web_server import start_web_server
 
-# 配置日志记录，同时输出到控制台和文件
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s - %(levelname)s - %(message)s",
-    handlers=[
-        logging.FileHandler("house_sync.log"),
-        logging.StreamHandler(sys.stdout)
-    ]
-)
+# 注意：cloudscraper/requests/pytz/asyncio 等较重的模块均为延迟导入，
+# 单次运行模式（cron、容器任务）下启动开销主要来自这里，新增依赖时请保持延迟导入。
+
+# 等待下一轮检查期间检查配置文件变化的间隔（秒）
+CONFIG_POLL_SECONDS = 5
+
+
+def _sleep_interval(base_interval_seconds, schedule, jitter_ratio):
+    jitter_range = base_interval_seconds * schedule.interval_jitter_percent
+    return max(1, base_interval_seconds + jitter_range * jitter_ratio)
+
+
+async def run(watcher):
+    """
+    在一个事件循环中运行：抓取、数据库写入、推送任务由 runtime.MonitorRuntime 管理，
+    持续监控模式下健康检查/指标服务也是同一个事件循环中的任务。
+    """
+    import asyncio
+    import ratelimit
+    from coordination import build_coordinator
+    from notifiers import DeliveryCore, build_notifiers
+    from profiling import CycleProfiler
+    from runtime import MonitorRuntime
+
+    config = watcher.current
+    ratelimit.configure(config.raw.get("rate_limits"))
+    profiler = CycleProfiler(config.raw.get("profiling"))
+    profiler.install_signal_handlers(asyncio.get_running_loop())
+    runtime = MonitorRuntime(DeliveryCore(build_notifiers(config.raw, config.pushplus_token)),
+                             fetch_concurrency=config.fetch_concurrency,
+                             coordinator=build_coordinator(config.raw.get("coordination")),
+                             profiler=profiler)
+    server = None
+    retention = None
+    await runtime.start(config.raw.get("snapshot"))
+    try:
+        if not config.monitoring_enabled:
+            logging.info("单次运行模式")
+            assigned = await runtime.assignment(config.cities)
+            if assigned is None or assigned:
+                await runtime.run_cycle(config, assigned)
+                await runtime.save_snapshot()
+            else:
+                logging.info("本副本没有分配到城市（其他副本正在运行），跳过本次检查")
+            return
 
-# SERVERCHAN_SCKEY = None
+        logging.info("持续监控模式已启用")
+        from web_server import start_web_server
+        from retention import RetentionWorker
+
+        # 健康检查服务只在持续监控模式下需要
+        server = await start_web_server({**runtime.routes(), **profiler.routes()})
+        retention = RetentionWorker()
+        schedule = config.schedule
+        logging.info(f"监控参数：{schedule.describe()}")
+
+        # 快速重启时沿用快照中记录的下次检查时间，避免每次重启都立即多请求一轮
+        next_due = runtime.restored_schedule.get("next_due")
+        if next_due:
+            max_wait, _ = schedule.interval_for(schedule.now())
+            resume_wait = min(next_due - time.time(), max_wait)
+            if resume_wait > 0:
+                logging.info(f"按快照中的调度时间，等待 {resume_wait:.2f} 秒后开始第一轮检查")
+                await asyncio.sleep(resume_wait)
+
+        while True:
+            now_local = schedule.now()
+            current_base_interval_seconds, current_interval_description = schedule.interval_for(now_local)
+
+            # 多副本部署时先续期租约/心跳，确定本轮负责的城市；待命的副本只保持心跳
+            assigned = await runtime.assignment(watcher.current.cities)
+            if assigned is None or assigned:
+                logging.info(f"当前时间 {now_local.strftime('%Y-%m-%d %H:%M:%S %Z%z')} - {current_interval_description}. 开始执行检查流程...")
+                await runtime.run_cycle(watcher.current, assigned)
+            else:
+                logging.info("本副本处于待命状态，跳过本轮检查")
+
+            # 非工作时间在后台线程中归档旧房源并整理数据库
+            retention.maybe_run(config.raw.get("retention"), schedule.is_work_time(schedule.now()))
+
+            # 计算抖动和休眠时间；抖动比例在本次等待中保持不变，配置变化时按新的间隔重新计算
+            jitter_ratio = random.uniform(-1, 1)
+            wait_started = time.monotonic()
+            current_sleep_interval = _sleep_interval(current_base_interval_seconds, schedule, jitter_ratio)
+            logging.info(f"等待 {current_sleep_interval:.2f} 秒 (下次检查基于 {current_interval_description}, +/- {schedule.interval_jitter_percent*100}% 抖动) 后再次检查...")
+            await runtime.save_snapshot({"next_due": time.time() + current_sleep_interval})
+            while True:
+                remaining = wait_started + current_sleep_interval - time.monotonic()
+                if remaining <= 0:
+                    break
+                await asyncio.sleep(min(remaining, CONFIG_POLL_SECONDS))
+
+                # 等待期间续期租约/心跳；接管了新的城市（如主副本宕机）时立即开始下一轮检查
+                if assigned is not None:
+                    now_assigned = await runtime.assignment(watcher.current.cities)
+                    if now_assigned - assigned:
+                        logging.info(f"接管城市 {sorted(now_assigned - assigned)}，立即开始检查")
+                        break
+                    assigned = now_assigned
+
+                # 在两轮检查之间热加载配置，数据库连接和推送连接池保持不变
+                previous = config
+                if not watcher.poll():
+                    continue
+                config = watcher.current
+                if config.fingerprints["rate_limits"] != previous.fingerprints["rate_limits"]:
+                    ratelimit.configure(config.raw.get("rate_limits"))
+                if config.fingerprints["notifiers"] != previous.fingerprints["notifiers"]:
+                    runtime.delivery.close()
+                    runtime.delivery = DeliveryCore(build_notifiers(config.raw, config.pushplus_token))
+                if config.fetch_concurrency != previous.fetch_concurrency:
+                    logging.warning("fetch_concurrency 的变化需要重启后生效")
+                if config.raw.get("coordination") != previous.raw.get("coordination"):
+                    logging.warning("coordination 的变化需要重启后生效")
+                if config.raw.get("profiling") != previous.raw.get("profiling"):
+                    logging.warning("profiling 的变化需要重启后生效")
+                if config.schedule is not None and config.schedule is not schedule:
+                    schedule = config.schedule
+                    logging.info(f"监控参数已更新：{schedule.describe()}")
+                    current_base_interval_seconds, current_interval_description = schedule.interval_for(schedule.now())
+                    current_sleep_interval = _sleep_interval(current_base_interval_seconds, schedule, jitter_ratio)
+    finally:
+        if server is not None:
+            server.close()
+        if retention is not None:
+            retention.stop()
+        runtime.delivery.close()
+        logging.info("关闭数据库连接")
+        await runtime.stop()
 
 
-import os
+def main(argv=None):
+    import argparse
 
-def read_config(config_path="config.json"):
-    try:
-        logging.info(f"正在读取配置文件: {config_path}")
-        with open(config_path) as f:
-            config = json.load(f)
-            # 优先从环境变量读取 PUSHPLUS_TOKEN
-            pushplus_token_env = os.environ.get("PUSHPLUS_TOKEN")
-            if pushplus_token_env:
-                config["PUSHPLUS_TOKEN"] = pushplus_token_env
-                logging.info("已从环境变量加载 PUSHPLUS_TOKEN")
-            logging.info(f"成功读取配置文件，包含 {len(config['notifications']['groups'])} 个监控组")
-            return config
-    except FileNotFoundError:
-        logging.error(f"配置文件未找到: {config_path}")
-        return None
-    except json.JSONDecodeError:
-        logging.error(f"配置文件格式错误: {config_path}")
-        return None
-    except Exception as e:
-        logging.error(f"读取配置文件时发生错误: {str(e)}", exc_info=True) # 增强错误日志
-        return None
-
-
-def process_notifications(config, pushplus_token_to_use):
-    logging.info("开始处理房源通知...")
-    only_direct_booking = config.get("only_direct_booking", True)
-    logging.info(f"配置设置：只抓取可直接预订的房源: {only_direct_booking}")
-    
-    # 优先从环境变量读取 MAX_PRICE，然后从 config 文件读取，最后使用默认值
-    max_price_str = os.environ.get("MAX_PRICE")
-    if max_price_str:
-        try:
-            max_price = int(max_price_str)
-            logging.info(f"已从环境变量加载 MAX_PRICE: {max_price} 欧元")
-        except (ValueError, TypeError):
-            max_price = config.get("max_price", 1000)
-            logging.warning(f"环境变量 MAX_PRICE ('{max_price_str}') 不是有效整数, 将使用配置文件或默认值: {max_price} 欧元")
-    else:
-        max_price = config.get("max_price", 1000)
-    
-    logging.info(f"配置设置：房源价格上限: {max_price} 欧元")
-
-    total_new_houses_cycle = 0
-    filtered_by_price_cycle = 0
-
-    for gp in config.get("notifications", {}).get("groups", []):
-        logging.info(f"处理监控组: {gp.get('name', '未命名组')}")
-        cities = gp.get("cities", [])
-        if not cities:
-            logging.warning(f"监控组 {gp.get('name', '未命名组')} 未配置城市，跳过")
-            continue
-        city_str = ', '.join([f"{city}({CITY_IDS.get(city, '未知')})" for city in cities])
-        logging.info(f"开始爬取城市: {city_str}")
-
-        houses_in_cities = scrape(cities=cities, only_direct_booking=only_direct_booking)
-        if not houses_in_cities:
-            logging.warning("未获取到任何房源数据，可能是爬取失败")
-            continue
-
-        logging.info(f"爬取完成，获取到 {len(houses_in_cities)} 个城市的数据")
-
-        for city_id, houses in houses_in_cities.items():
-            logging.info(f"开始处理城市 {city_id} 的 {len(houses)} 个房源")
-            new_houses = sync_houses(city_id=city_id, houses=houses)
-            total_new_houses_cycle += len(new_houses)
-
-            if new_houses:
-                logging.info(f"城市 {city_id} 有 {len(new_houses)} 个新房源，准备推送通知")
-                for h in new_houses:
-                    try:
-                        price_str = h.get('price_inc', '0').replace(',', '.')
-                        price = float(price_str)
-                        if price > max_price:
-                            logging.info(f"房源 {h.get('url_key', 'N/A')} 价格为 {price} 欧元，超过上限 {max_price} 欧元，不推送")
-                            filtered_by_price_cycle += 1
-                            continue
-
-                        booking_status = "可直接预订" if h.get('direct_booking') else "需要抽签"
-                        title = f"新房源({booking_status}): {h.get('url_key', 'N/A')}"
-                        content = house_to_msg(h)
-                        logging.info(f"推送新房源通知: {h.get('url_key', 'N/A')} ({booking_status}), 价格: {price} 欧元")
-                        if pushplus_token_to_use:
-                            res = send_pushplus_msg(pushplus_token_to_use, title, content) # 修正参数顺序
-                            logging.info(f"PushPlus 推送结果: {res}")
-                        else:
-                            logging.warning("由于未设置有效的 PUSHPLUS_TOKEN，跳过推送")
-                    except Exception as error:
-                        logging.error(f"推送失败: {h.get('url_key', 'N/A')}", exc_info=True)
-    logging.info(f"本轮处理完成：新增房源 {total_new_houses_cycle} 个，因价格过滤 {filtered_by_price_cycle} 个。")
-
-
-from web_server import start_web_server
-
-def main():
+    parser = argparse.ArgumentParser(description="Holland2Stay 房源监控")
+    parser.add_argument("--dry-run", action="store_true", help="只配置日志、读取并校验配置后退出，不抓取也不推送")
+    args = parser.parse_args(argv)
+
+    setup_logging()
     try:
-        start_web_server()
         logging.info("程序开始执行")
-        create_table()
 
-        config = read_config("config.json")
-        if not config:
+        watcher = ConfigWatcher(CONFIG_PATH)
+        if not watcher.load():
             logging.error("无法读取配置，程序终止")
+            return 1
+        if args.dry_run:
+            logging.info("配置有效（--dry-run），程序退出")
             return
 
-        pushplus_token_from_config = config.get("PUSHPLUS_TOKEN") # 读取 PUSHPLUS_TOKEN
-        if not pushplus_token_from_config or "你的PushPlusToken" in pushplus_token_from_config:
-            logging.warning("PUSHPLUS_TOKEN 未设置或使用了示例/默认值，推送功能将不可用")
-            pushplus_token_to_use = None
-        else:
-            pushplus_token_to_use = pushplus_token_from_config
-
-        monitoring_settings = config.get("monitoring_settings", {})
-        monitoring_enabled = monitoring_settings.get("enabled", False)
-
-        if monitoring_enabled:
-            logging.info("持续监控模式已启用")
-            tz_str = monitoring_settings.get("timezone", "Europe/Amsterdam")
-            try:
-                monitor_tz = pytz.timezone(tz_str)
-            except pytz.exceptions.UnknownTimeZoneError:
-                logging.error(f"无效的时区配置: {tz_str}. 将使用 UTC.")
-                monitor_tz = pytz.utc
-
-            workdays = monitoring_settings.get("workdays", [0, 1, 2, 3, 4]) # Mon-Fri
-            start_hour = monitoring_settings.get("start_hour", 9)
-            end_hour = monitoring_settings.get("end_hour", 17)
-            interval_minutes = monitoring_settings.get("interval_minutes", 5)
-            base_interval_seconds = interval_minutes * 60
-            interval_jitter_percent = monitoring_settings.get("interval_jitter_percent", 0.0)
-            off_hours_interval_minutes = monitoring_settings.get("off_hours_interval_minutes", 30) # 读取非工作时间间隔
-            off_hours_interval_seconds = off_hours_interval_minutes * 60
-
-            logging.info(f"监控参数：时区={monitor_tz}, 工作日={workdays}, 时间={start_hour:02d}:00-{end_hour:02d}:00, 工作时间间隔={interval_minutes}分钟, 非工作时间间隔={off_hours_interval_minutes}分钟, 抖动={interval_jitter_percent*100}%")
-
-            while True:
-                now_local = datetime.now(monitor_tz)
-                current_weekday = now_local.weekday()
-                current_hour = now_local.hour
-
-                is_work_time = current_weekday in workdays and start_hour <= current_hour < end_hour
-                current_base_interval_seconds = 0
-                current_interval_description = ""
-
-                if is_work_time:
-                    # logging.info(f"当前时间 {now_local.strftime('%Y-%m-%d %H:%M:%S %Z%z')} 在监控时段内。使用工作时间间隔。") # 日志移到下方统一处理
-                    current_base_interval_seconds = base_interval_seconds
-                    current_interval_description = f"{interval_minutes} 分钟 (工作时间)"
-                else:
-                    # logging.info(f"当前时间 {now_local.strftime('%Y-%m-%d %H:%M:%S %Z%z')} 不在监控时段内。使用非工作时间间隔。") # 日志移到下方统一处理
-                    current_base_interval_seconds = off_hours_interval_seconds
-                    current_interval_description = f"{off_hours_interval_minutes} 分钟 (非工作时间)"
-
-                logging.info(f"当前时间 {now_local.strftime('%Y-%m-%d %H:%M:%S %Z%z')} - {current_interval_description}. 开始执行检查流程...")
-                process_notifications(config, pushplus_token_to_use)
-
-                # 计算抖动和休眠时间
-                jitter_range = current_base_interval_seconds * interval_jitter_percent
-                random_jitter = random.uniform(-jitter_range, jitter_range)
-                current_sleep_interval = current_base_interval_seconds + random_jitter
-                current_sleep_interval = max(1, current_sleep_interval)
-
-                # current_interval_minutes_display = current_base_interval_seconds / 60 # 已在 current_interval_description 中体现
-                logging.info(f"等待 {current_sleep_interval:.2f} 秒 (下次检查基于 {current_interval_description}, +/- {interval_jitter_percent*100}% 抖动) 后再次检查...")
-                time.sleep(current_sleep_interval)
-        else:
-            logging.info("单次运行模式")
-            process_notifications(config, pushplus_token_to_use) # 传递 PUSHPLUS_TOKEN
+        # asyncio 和 notifiers 导入较慢，放在读取配置之后再导入
+        import asyncio
 
+        asyncio.run(run(watcher))
     except KeyboardInterrupt:
         logging.info("程序被用户中断")
     except Exception as e:
         logging.error(f"程序执行过程中发生错误: {str(e)}", exc_info=True)
-    finally:
-        logging.info("关闭数据库连接")
-        close_connection()
+        return 1
 
 
 if __name__ == "__main__":
-    main()
+    import sys
+
+    sys.exit(main())
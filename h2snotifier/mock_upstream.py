@@ -0,0 +1,258 @@
+"""
+本地模拟的 Holland2Stay GraphQL 接口，用于压力测试，不访问 api.holland2stay.com。
+
+实现了 scrape.py 发出的 GetCategories 查询（包括单个查询和用别名打包的批量查询）：
+按城市和预订方式筛选、按 available_startdate 排序、分页，并可注入延迟、错误和 Cloudflare 风格的质询响应。
+同一个种子生成的房源数据完全相同。
+
+用法:
+    python mock_upstream.py --port 8081 --listings-per-city 200 --latency-ms 50 --error-rate 0.01
+    H2S_API_URL=http://127.0.0.1:8081/graphql/ python main.py
+"""
+import argparse
+import json
+import random
+import re
+import threading
+import time
+from datetime import date, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from scrape import BOOKING_TYPES, CITY_IDS, CONTRACT_TYPES, MAX_REGISTER_TYPES, ROOM_TYPES
+
+# 匹配 "alias: products(" 或旧版单查询中的 "products("
+_PRODUCTS_FIELD = re.compile(r"(?:(\w+)\s*:\s*)?products\s*\(")
+
+CHALLENGE_PAGE = b"""<!DOCTYPE html><html><head><title>Just a moment...</title></head>
+<body><div id="challenge-running">Checking your browser before accessing api.holland2stay.com.</div>
+<script src="/cdn-cgi/challenge-platform/h/b/orchestrate/jsch/v1"></script></body></html>"""
+
+
+class MockListings:
+    """按城市保存的模拟房源，支持按固定种子生成以及模拟上架、下架、调价"""
+
+    def __init__(self, cities, listings_per_city, seed=0):
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.cities = [str(c) for c in cities]
+        self.by_city = {c: {} for c in self.cities}
+        self._next_id = 0
+        for city in self.cities:
+            for _ in range(listings_per_city):
+                self._add(city)
+
+    def _add(self, city):
+        self._next_id += 1
+        rng = self.rng
+        url_key = f"mock-{city}-{self._next_id}"
+        rent = round(rng.uniform(450, 1600), 2)
+        start = date(2026, 1, 1) + timedelta(days=rng.randint(0, 365))
+        self.by_city[city][url_key] = {
+            "name": f"Mock residence {self._next_id}",
+            "sku": f"SKU{self._next_id}",
+            "city": int(city),
+            "url_key": url_key,
+            "available_to_book": int(rng.choice(list(BOOKING_TYPES))),
+            "available_startdate": start.isoformat(),
+            "living_area": f"{rng.uniform(15, 90):.1f}".replace(".", ","),
+            "no_of_rooms": int(rng.choice(list(ROOM_TYPES))),
+            "maximum_number_of_persons": int(rng.choice(list(MAX_REGISTER_TYPES))),
+            "type_of_contract": int(rng.choice(list(CONTRACT_TYPES))),
+            "basic_rent": rent,
+            "price_range": {"maximum_price": {"final_price": {"value": round(rent * 1.1, 2), "currency": "EUR"}}},
+            "media_gallery": [
+                {"url": f"https://mock.local/media/catalog/product/cache/abc/{url_key}-{i}.jpg"} for i in range(3)
+            ],
+        }
+
+    def churn(self, add_rate=0.05, remove_rate=0.05, price_change_rate=0.02, booking_flip_rate=0.01):
+        """
+        模拟一段时间内的房源变化，比例均相对于每个城市当前的房源数。
+        :return: 各类变化的数量。
+        """
+        stats = {"added": 0, "removed": 0, "price_changed": 0, "booking_flipped": 0}
+        with self.lock:
+            rng = self.rng
+            for city, listings in self.by_city.items():
+                n = len(listings)
+                for key in rng.sample(list(listings), min(n, int(n * remove_rate))):
+                    del listings[key]
+                    stats["removed"] += 1
+                for key in rng.sample(list(listings), min(len(listings), int(n * price_change_rate))):
+                    price = listings[key]["price_range"]["maximum_price"]["final_price"]
+                    price["value"] = round(price["value"] * rng.uniform(0.9, 1.1), 2)
+                    stats["price_changed"] += 1
+                for key in rng.sample(list(listings), min(len(listings), int(n * booking_flip_rate))):
+                    listings[key]["available_to_book"] = 179 if listings[key]["available_to_book"] == 336 else 336
+                    stats["booking_flipped"] += 1
+                for _ in range(max(1, int(n * add_rate)) if add_rate else 0):
+                    self._add(city)
+                    stats["added"] += 1
+        return stats
+
+    def query(self, filters, page_size, current_page):
+        """按 GraphQL 筛选条件返回一页 products 结果"""
+        cities = [str(c) for c in filters.get("city", {}).get("in", self.cities)]
+        booking = {int(b) for b in filters.get("available_to_book", {}).get("in", BOOKING_TYPES)}
+        with self.lock:
+            items = [
+                item
+                for city in cities
+                for item in self.by_city.get(city, {}).values()
+                if item["available_to_book"] in booking
+            ]
+            items.sort(key=lambda item: item["available_startdate"])
+            total = len(items)
+            start = (current_page - 1) * page_size
+            page = json.loads(json.dumps(items[start:start + page_size]))
+        return {
+            "items": page,
+            "page_info": {"total_pages": max(1, -(-total // page_size)), "__typename": "SearchResultPageInfo"},
+            "total_count": total,
+            "__typename": "Products",
+        }
+
+
+class MockUpstream:
+    """模拟服务的运行状态：房源数据、注入的故障参数和请求统计"""
+
+    def __init__(self, listings, latency_ms=0.0, latency_jitter_ms=0.0, error_rate=0.0,
+                 challenge_rate=0.0, max_aliases=50, seed=0):
+        self.listings = listings
+        self.latency_ms = latency_ms
+        self.latency_jitter_ms = latency_jitter_ms
+        self.error_rate = error_rate
+        self.challenge_rate = challenge_rate
+        self.max_aliases = max_aliases
+        self.rng = random.Random(seed)
+        self.stats_lock = threading.Lock()
+        self.stats = {"requests": 0, "queries": 0, "errors": 0, "challenges": 0}
+
+    def _count(self, key, n=1):
+        with self.stats_lock:
+            self.stats[key] += n
+
+    def handle(self, body):
+        """
+        处理一个 GraphQL 请求体。
+        :return: (状态码, 响应头字典, 响应体字节)
+        """
+        self._count("requests")
+        with self.stats_lock:
+            roll = self.rng.random()
+            delay = max(0.0, self.latency_ms + self.rng.uniform(-1, 1) * self.latency_jitter_ms) / 1000
+        time.sleep(delay)
+
+        if roll < self.challenge_rate:
+            self._count("challenges")
+            return 403, {"Content-Type": "text/html", "cf-mitigated": "challenge"}, CHALLENGE_PAGE
+        if roll < self.challenge_rate + self.error_rate:
+            self._count("errors")
+            return 502, {"Content-Type": "text/html"}, b"<html><body>502 Bad Gateway</body></html>"
+
+        try:
+            request = json.loads(body)
+            document = request["query"]
+            variables = request.get("variables", {})
+        except (ValueError, KeyError, TypeError):
+            return 400, {"Content-Type": "application/json"}, json.dumps(
+                {"errors": [{"message": "Invalid GraphQL request"}]}).encode()
+
+        data = {}
+        aliases = [m.group(1) for m in _PRODUCTS_FIELD.finditer(document)]
+        if len(aliases) > self.max_aliases:
+            return 413, {"Content-Type": "application/json"}, json.dumps(
+                {"errors": [{"message": f"Too many aliased fields: {len(aliases)}"}]}).encode()
+        for alias in aliases:
+            if alias is None:
+                # 旧版单查询 generate_payload()
+                data["products"] = self.listings.query(
+                    variables.get("filters", {}), variables.get("pageSize", 30), variables.get("currentPage", 1)
+                )
+            else:
+                data[alias] = self.listings.query(
+                    variables.get(f"filters_{alias}", {}),
+                    variables.get(f"size_{alias}", 30),
+                    variables.get(f"page_{alias}", 1),
+                )
+        self._count("queries", len(aliases))
+        return 200, {"Content-Type": "application/json"}, json.dumps({"data": data}).encode()
+
+
+def make_handler(upstream):
+    class MockGraphQLHandler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length", 0))
+            status, headers, body = upstream.handle(self.rfile.read(length))
+            self.send_response(status)
+            for key, value in headers.items():
+                self.send_header(key, value)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            with upstream.stats_lock:
+                body = json.dumps(upstream.stats).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    return MockGraphQLHandler
+
+
+def start_mock_server(upstream, host="127.0.0.1", port=0):
+    """
+    在后台线程中启动模拟服务。
+    :return: (server, GraphQL 接口地址)；port=0 时自动选择空闲端口。
+    """
+    server = ThreadingHTTPServer((host, port), make_handler(upstream))
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, name="mock-upstream", daemon=True)
+    thread.start()
+    return server, f"http://{host}:{server.server_address[1]}/graphql/"
+
+
+def add_mock_arguments(parser):
+    parser.add_argument("--cities", default=",".join(CITY_IDS), help="逗号分隔的城市ID")
+    parser.add_argument("--listings-per-city", type=int, default=100)
+    parser.add_argument("--latency-ms", type=float, default=50.0, help="每个请求的平均延迟")
+    parser.add_argument("--latency-jitter-ms", type=float, default=20.0)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="返回 502 的比例")
+    parser.add_argument("--challenge-rate", type=float, default=0.0, help="返回 Cloudflare 质询页的比例")
+    parser.add_argument("--max-aliases", type=int, default=50, help="单个请求允许的最大别名数，超过返回 413")
+    parser.add_argument("--seed", type=int, default=0)
+
+
+def upstream_from_args(args):
+    listings = MockListings(args.cities.split(","), args.listings_per_city, seed=args.seed)
+    return MockUpstream(
+        listings,
+        latency_ms=args.latency_ms,
+        latency_jitter_ms=args.latency_jitter_ms,
+        error_rate=args.error_rate,
+        challenge_rate=args.challenge_rate,
+        max_aliases=args.max_aliases,
+        seed=args.seed,
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="本地模拟的 Holland2Stay GraphQL 接口")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    add_mock_arguments(parser)
+    args = parser.parse_args()
+
+    server, url = start_mock_server(upstream_from_args(args), args.host, args.port)
+    print(f"模拟接口已启动: {url}  (GET 任意路径查看请求统计)")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
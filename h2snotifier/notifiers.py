@@ -0,0 +1,403 @@
+import abc
+import asyncio
+import logging
+import os
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+import profiling
+import ratelimit
+from logging_config import log_event
+from pushplus import send_pushplus_msg
+
+# 一条待推送的消息；house 为原始房源字典，供需要结构化数据的后端（如 webhook）使用；
+# priority 为限流器中的优先级通道（ratelimit.HIGH / NORMAL / LOW）
+Message = namedtuple("Message", ["title", "content", "house", "priority"], defaults=[ratelimit.NORMAL])
+
+
+class NotifierError(Exception):
+    """
+    推送失败，投递核心会按后端的重试策略重试。
+    批次只发出了一部分时，remaining 为尚未送达的消息，重试时只发送这些消息。
+    """
+
+    def __init__(self, message, remaining=None):
+        super().__init__(message)
+        self.remaining = remaining
+
+
+class Notifier(abc.ABC):
+    """
+    推送后端的基类。子类必须实现 send_batch()（未实现时创建实例就会报错），其余的连接池、限流、批量和重试
+    由 DeliveryCore 统一处理。send_batch() 在后端专属的线程池中执行，可以直接使用阻塞 I/O。
+    """
+
+    name = "base"
+    # 每分钟最多发送的请求数（一个批次算一次）和允许的突发请求数，config.json 的 rate_limits 中可以覆盖
+    rate_per_minute = 60
+    burst = 1
+    # 一个请求最多合并的消息数
+    max_batch = 1
+    max_retries = 3
+    retry_backoff_seconds = 1.0
+    pool_size = 4
+
+    def __init__(self, rate_per_minute=None, max_batch=None, max_retries=None, burst=None):
+        if rate_per_minute is not None:
+            self.rate_per_minute = rate_per_minute
+        if burst is not None:
+            self.burst = burst
+        if max_batch is not None:
+            self.max_batch = max_batch
+        if max_retries is not None:
+            self.max_retries = max_retries
+        self.session = None
+        self._limiter = None
+
+    @property
+    def limiter(self):
+        """该后端的令牌桶（ratelimit 中名为 notify:<name> 的桶）"""
+        if self._limiter is None:
+            self._limiter = ratelimit.bucket(f"notify:{self.name}", self.rate_per_minute, self.burst)
+        return self._limiter
+
+    def open(self):
+        """创建可复用的 HTTP 连接池"""
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def close(self):
+        if self.session is not None:
+            self.session.close()
+            self.session = None
+
+    def send(self, messages):
+        """按批次中最高的优先级等待限流器，然后发送"""
+        self.limiter.acquire(min(m.priority for m in messages))
+        return self.send_batch(messages)
+
+    @abc.abstractmethod
+    def send_batch(self, messages):
+        """发送一批消息，失败时抛出 NotifierError"""
+
+    @staticmethod
+    def merge(messages):
+        """把一批消息合并为一个标题和正文"""
+        if len(messages) == 1:
+            return messages[0].title, messages[0].content
+        title = f"{len(messages)} 个新房源: " + ", ".join(m.title for m in messages[:3])
+        content = "\n\n".join(m.content for m in messages)
+        return title, content
+
+
+class PushPlusNotifier(Notifier):
+    name = "pushplus"
+    rate_per_minute = 20
+    max_batch = 5
+
+    def __init__(self, token, topic="", **kwargs):
+        super().__init__(**kwargs)
+        self.token = token
+        self.topic = topic
+        # 只有用户在配置中给出的值才覆盖 ratelimit.DEFAULT_LIMITS["pushplus"]，类属性中的默认值不传给限流器
+        self._configured_limits = (kwargs.get("rate_per_minute"), kwargs.get("burst"))
+
+    @property
+    def limiter(self):
+        # 同一个 token 的所有请求共用一个桶，与直接调用 send_pushplus_msg() 的请求一起限流
+        if self._limiter is None:
+            self._limiter = ratelimit.token_bucket(self.token, *self._configured_limits)
+        return self._limiter
+
+    def send(self, messages):
+        # send_pushplus_msg() 自己会等待限流器
+        return self.send_batch(messages)
+
+    def send_batch(self, messages):
+        title, content = self.merge(messages)
+        res = send_pushplus_msg(self.token, title, content, topic=self.topic, session=self.session,
+                                limiter=self.limiter, lane=min(m.priority for m in messages))
+        if not res or res.get("code") != 200:
+            raise NotifierError(f"PushPlus 推送失败: {res}")
+        return res
+
+
+class TelegramNotifier(Notifier):
+    name = "telegram"
+    rate_per_minute = 20
+    max_batch = 5
+    # Telegram 单条消息的长度上限
+    max_length = 4096
+
+    def __init__(self, api_key, chat_id, **kwargs):
+        super().__init__(**kwargs)
+        self.api_key = api_key
+        self.chat_id = chat_id
+
+    def split(self, messages):
+        """
+        把一批消息按房源合并成若干条不超过 max_length 的文本，不截断房源；单个房源本身超长时才按长度切开。
+        """
+        parts = []
+        current = ""
+        for message in messages:
+            content = message.content
+            while len(content) > self.max_length:
+                if current:
+                    parts.append(current)
+                    current = ""
+                parts.append(content[:self.max_length])
+                content = content[self.max_length:]
+            if current and len(current) + 2 + len(content) > self.max_length:
+                parts.append(current)
+                current = ""
+            current = f"{current}\n\n{content}" if current else content
+        if current:
+            parts.append(current)
+        return parts
+
+    def send_batch(self, messages):
+        priority = min(m.priority for m in messages)
+        parts = self.split(messages)
+        results = []
+        for i, text in enumerate(parts):
+            if i:
+                # 第一条已在 send() 中取得令牌，拆出的其余消息各自再取一个
+                self.limiter.acquire(priority)
+            try:
+                response = self.session.post(
+                    f"https://api.telegram.org/bot{self.api_key}/sendMessage",
+                    json={"chat_id": self.chat_id, "text": text, "disable_web_page_preview": False},
+                    timeout=15,
+                )
+                if response.status_code != 200:
+                    raise NotifierError(f"Telegram 推送失败，状态码: {response.status_code}, {response.text[:200]}")
+            except Exception as error:
+                if not i:
+                    raise
+                # 前面拆出的消息已经送达，重试时只发送剩下的部分，避免重复推送
+                remaining = [Message("", part, None, priority) for part in parts[i:]]
+                raise NotifierError(f"Telegram 推送了 {i}/{len(parts)} 条后失败: {error}", remaining=remaining) from error
+            results.append(response.json())
+        return results
+
+
+class WebhookNotifier(Notifier):
+    """把一批消息以 JSON 形式 POST 到任意 URL"""
+
+    name = "webhook"
+    rate_per_minute = 60
+    max_batch = 20
+
+    def __init__(self, url, headers=None, **kwargs):
+        super().__init__(**kwargs)
+        self.url = url
+        self.headers = headers or {}
+
+    def send_batch(self, messages):
+        payload = {
+            "messages": [
+                {"title": m.title, "content": m.content, "house": m.house}
+                for m in messages
+            ]
+        }
+        response = self.session.post(self.url, json=payload, headers=self.headers, timeout=15)
+        if response.status_code >= 300:
+            raise NotifierError(f"Webhook 推送失败，状态码: {response.status_code}")
+        return response.status_code
+
+
+class SmtpNotifier(Notifier):
+    """通过 SMTP 发送邮件，连接在多个批次之间复用，断开时自动重连"""
+
+    name = "smtp"
+    rate_per_minute = 10
+    max_batch = 20
+    pool_size = 1
+
+    def __init__(self, host, port=587, username=None, password=None, sender=None, to=(), use_tls=True, **kwargs):
+        super().__init__(**kwargs)
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.sender = sender or username
+        self.to = list(to)
+        self.use_tls = use_tls
+        self._smtp = None
+
+    def open(self):
+        pass
+
+    def _connect(self):
+        import smtplib
+
+        smtp = smtplib.SMTP(self.host, self.port, timeout=30)
+        if self.use_tls:
+            smtp.starttls()
+        if self.username:
+            smtp.login(self.username, self.password)
+        return smtp
+
+    def close(self):
+        if self._smtp is not None:
+            try:
+                self._smtp.quit()
+            except Exception:
+                pass
+            self._smtp = None
+
+    def send_batch(self, messages):
+        import smtplib
+        from email.message import EmailMessage
+
+        title, content = self.merge(messages)
+        email = EmailMessage()
+        email["Subject"] = title
+        email["From"] = self.sender
+        email["To"] = ", ".join(self.to)
+        email.set_content(content)
+        try:
+            if self._smtp is None:
+                self._smtp = self._connect()
+            self._smtp.send_message(email)
+        except (smtplib.SMTPException, OSError) as e:
+            self.close()
+            raise NotifierError(f"SMTP 发送失败: {e}") from e
+
+
+NOTIFIER_TYPES = {
+    "pushplus": PushPlusNotifier,
+    "telegram": TelegramNotifier,
+    "webhook": WebhookNotifier,
+    "smtp": SmtpNotifier,
+}
+
+
+class DeliveryCore:
+    """
+    共享的异步投递核心。每个后端有自己的线程池（连接池）、令牌桶（见 ratelimit）、批量大小和重试策略，
+    同一批消息会并行投递到所有后端，一个后端变慢或失败不会影响其他后端。
+    限流等待发生在后端的线程池中；消息按优先级和评分排序后再分批，高优先级的批次先提交、先取得令牌。
+    """
+
+    def __init__(self, notifiers):
+        self.notifiers = list(notifiers)
+        self._executors = {}
+        for notifier in self.notifiers:
+            notifier.open()
+            self._executors[notifier.name] = profiling.instrument(ThreadPoolExecutor(
+                max_workers=notifier.pool_size, thread_name_prefix=f"notify-{notifier.name}"
+            ))
+
+    def __bool__(self):
+        return bool(self.notifiers)
+
+    async def _send_with_retry(self, notifier, batch):
+        loop = asyncio.get_running_loop()
+        executor = self._executors[notifier.name]
+        pending = batch
+        for attempt in range(notifier.max_retries + 1):
+            started = time.perf_counter()
+            try:
+                await loop.run_in_executor(executor, notifier.send, pending)
+                log_event("notify.sent", f"{notifier.name} 推送成功 ({len(batch)} 条)", sample=True,
+                          backend=notifier.name, messages=len(batch), attempt=attempt, stage="notify",
+                          url_keys=[m.house.get("url_key") for m in batch if m.house],
+                          duration=round(time.perf_counter() - started, 3))
+                return len(batch)
+            except Exception as error:
+                log_event("notify.failed", f"{notifier.name} 推送失败: {error}", level=logging.WARNING,
+                          backend=notifier.name, messages=len(batch), attempt=attempt, stage="notify",
+                          error=repr(error), duration=round(time.perf_counter() - started, 3), exc_info=True)
+                # 部分送达时只重试未送达的部分
+                pending = getattr(error, "remaining", None) or pending
+                if attempt < notifier.max_retries:
+                    await asyncio.sleep(notifier.retry_backoff_seconds * (2 ** attempt))
+        log_event("notify.gave_up", f"{notifier.name} 重试 {notifier.max_retries} 次后仍失败，放弃",
+                  level=logging.ERROR, backend=notifier.name, messages=len(batch), stage="notify")
+        return 0
+
+    async def _deliver_to(self, notifier, messages):
+        batches = [messages[i:i + notifier.max_batch] for i in range(0, len(messages), notifier.max_batch)]
+        sent = await asyncio.gather(*(self._send_with_retry(notifier, b) for b in batches))
+        return sum(sent)
+
+    async def deliver(self, messages):
+        """
+        把消息并行投递到所有后端。
+        :return: 后端名称 -> 成功投递的消息数。
+        """
+        if not messages or not self.notifiers:
+            return {}
+        # 高优先级在前，同一优先级内评分高的在前（见 scoring.py）
+        messages = sorted(messages, key=lambda m: (m.priority, -(m.house or {}).get("score", 0)))
+        results = await asyncio.gather(*(self._deliver_to(n, messages) for n in self.notifiers))
+        return {n.name: sent for n, sent in zip(self.notifiers, results)}
+
+    def deliver_sync(self, messages):
+        """在同步代码中投递消息"""
+        return asyncio.run(self.deliver(messages))
+
+    def close(self):
+        for notifier in self.notifiers:
+            notifier.close()
+        for executor in self._executors.values():
+            executor.shutdown(wait=False)
+
+
+def _env_or_dotenv(key):
+    """优先读取环境变量，其次读取 .env 文件（python-dotenv 为可选依赖）"""
+    value = os.environ.get(key)
+    if value:
+        return value
+    try:
+        from dotenv import dotenv_values
+    except ImportError:
+        return None
+    return dotenv_values(".env").get(key)
+
+
+def build_notifiers(config, pushplus_token=None):
+    """
+    根据配置创建推送后端列表。
+    config["notifiers"] 中每个键对应一个后端类型，值为该后端的参数，设置 "enabled": false 可关闭。
+    PushPlus 在提供了有效 token 时默认启用；Telegram 的 api_key/chat_id 可来自环境变量或 .env。
+    """
+    settings = dict(config.get("notifiers", {}))
+    if pushplus_token and "pushplus" not in settings:
+        settings["pushplus"] = {}
+    if "telegram" not in settings and _env_or_dotenv("TELEGRAM_API_KEY"):
+        settings["telegram"] = {}
+
+    notifiers = []
+    for name, options in settings.items():
+        options = dict(options or {})
+        if not options.pop("enabled", True):
+            continue
+        if name not in NOTIFIER_TYPES:
+            logging.warning(f"未知的推送后端类型: {name}，跳过")
+            continue
+        if name == "pushplus":
+            options.setdefault("token", pushplus_token)
+            if not options["token"]:
+                logging.warning("PushPlus 未配置有效的 token，跳过")
+                continue
+        elif name == "telegram":
+            options.setdefault("api_key", _env_or_dotenv("TELEGRAM_API_KEY"))
+            options.setdefault("chat_id", _env_or_dotenv("TELEGRAM_CHAT_ID") or _env_or_dotenv("DEBUGGING_CHAT_ID"))
+            if not options["api_key"] or not options["chat_id"]:
+                logging.warning("Telegram 未配置 api_key 或 chat_id，跳过")
+                continue
+        try:
+            notifiers.append(NOTIFIER_TYPES[name](**options))
+        except TypeError as e:
+            logging.error(f"推送后端 {name} 的配置无效: {e}")
+    logging.info(f"已启用推送后端: {', '.join(n.name for n in notifiers) or '无'}")
+    return notifiers
@@ -0,0 +1,356 @@
+"""
+检查流程的性能剖析：在不重启、不挂调试器的情况下定位某一轮检查变慢的原因。
+
+- 剖析接下来的 N 轮检查，结果写入剖析目录:
+    cprofile  确定性剖析，覆盖事件循环线程和经 instrument() 包装的线程池（抓取、数据库写入、推送），
+              输出 .pstats（可用 snakeviz、flameprof 等工具查看）和按累计耗时排序的 .txt 摘要；
+              Python 3.12+ 不能在多个线程中同时启用 cProfile，此时只剖析事件循环线程（会记录一次警告）
+    sample    采样剖析，定期采集所有线程的调用栈，输出折叠栈 .folded（可直接用 flamegraph.pl / speedscope 生成火焰图）
+- tracemalloc：每轮检查结束时与上一轮对比内存分配，输出 -memory.txt；开销较大，需要显式开启
+
+触发方式：环境变量 H2S_PROFILE_CYCLES=N（启动后剖析前 N 轮）、config.json 的 "profiling"、
+SIGUSR1 信号（剖析接下来的 signal_cycles 轮）、SIGUSR2 信号（开关 tracemalloc），
+以及健康检查服务的 /profiles 接口（需要在配置中启用 http）。
+"""
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+DEFAULT_SETTINGS = {
+    "directory": "profiles",
+    "mode": "cprofile",      # cprofile / sample
+    "cycles": 0,             # 启动后剖析前几轮检查
+    "signal_cycles": 3,      # 每次收到 SIGUSR1 或请求 /profiles/start 时剖析的轮数
+    "sample_interval_ms": 5,
+    "tracemalloc": False,
+    "tracemalloc_frames": 10,
+    "top": 40,               # 摘要中输出的条目数
+    "keep": 50,              # 剖析目录中最多保留的文件数，超出时删除最旧的
+    "http": False,           # 是否在健康检查服务中注册 /profiles 接口
+}
+MODES = ("cprofile", "sample")
+
+# 当前正在进行的剖析会话，instrument() 包装的函数据此决定是否剖析
+_active = None
+# 是否已经提示过线程池任务无法被剖析
+_thread_fallback_warned = False
+
+
+class _CProfileSession:
+    """每个线程一个 cProfile.Profile，结束时合并"""
+
+    suffix = ".pstats"
+
+    def __init__(self, settings):
+        import cProfile
+
+        self._cprofile = cProfile
+        self._lock = threading.Lock()
+        self._profiles = []
+        self._local = threading.local()
+        self._main = self._profile()
+        self._main.enable()
+
+    def _profile(self):
+        profile = self._cprofile.Profile()
+        with self._lock:
+            self._profiles.append(profile)
+        return profile
+
+    def call(self, func, *args, **kwargs):
+        profile = getattr(self._local, "profile", None)
+        if profile is None:
+            profile = self._local.profile = self._profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # Python 3.12+ 不允许多个线程同时启用剖析器，此时只剖析事件循环线程
+            _warn_thread_fallback()
+            return func(*args, **kwargs)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            profile.disable()
+
+    def stop(self, path, top):
+        import io
+        import pstats
+
+        self._main.disable()
+        with self._lock:
+            profiles = [p for p in self._profiles if p.getstats()]
+        stats = pstats.Stats(*profiles)
+        stats.dump_stats(path)
+        summary = io.StringIO()
+        stats.stream = summary
+        stats.sort_stats("cumulative").print_stats(top)
+        with open(os.path.splitext(path)[0] + ".txt", "w", encoding="utf-8") as f:
+            f.write(summary.getvalue())
+
+
+def _warn_thread_fallback():
+    global _thread_fallback_warned
+    if _thread_fallback_warned:
+        return
+    _thread_fallback_warned = True
+    logging.warning(
+        f"当前 Python 版本 ({sys.version.split()[0]}) 不允许多个线程同时启用 cProfile，"
+        "线程池中的任务（抓取、数据库写入、推送）不会出现在剖析结果中；需要剖析这些线程时请使用 sample 模式"
+    )
+
+
+class _SamplingSession:
+    """后台线程定期采集所有线程的调用栈，输出折叠栈格式"""
+
+    suffix = ".folded"
+
+    def __init__(self, settings):
+        self.interval = settings["sample_interval_ms"] / 1000
+        self.stacks = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="profiler-sampler", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                stack.append(names.get(ident, str(ident)))
+                self.stacks[";".join(reversed(stack))] += 1
+            self.samples += 1
+
+    def call(self, func, *args, **kwargs):
+        return func(*args, **kwargs)
+
+    def stop(self, path, top):
+        self._stop.set()
+        self._thread.join()
+        with open(path, "w", encoding="utf-8") as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+
+_SESSIONS = {"cprofile": _CProfileSession, "sample": _SamplingSession}
+
+
+class _InstrumentedExecutor:
+    """包装线程池：剖析进行中时，提交的任务在所在线程中被剖析"""
+
+    def __init__(self, executor):
+        self._executor = executor
+
+    def submit(self, fn, *args, **kwargs):
+        return self._executor.submit(_call, fn, *args, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self._executor, name)
+
+
+def _call(fn, *args, **kwargs):
+    session = _active
+    if session is None:
+        return fn(*args, **kwargs)
+    return session.call(fn, *args, **kwargs)
+
+
+def instrument(executor):
+    """包装线程池，使其中执行的任务也能被 cprofile 模式剖析；未在剖析时几乎没有开销"""
+    return _InstrumentedExecutor(executor)
+
+
+class CycleProfiler:
+    """
+    按检查轮次剖析。MonitorRuntime 在每轮开始和结束时调用 begin_cycle() / end_cycle()，
+    request() 可以从信号处理函数或健康检查服务中调用。
+    """
+
+    def __init__(self, settings=None):
+        self.settings = {**DEFAULT_SETTINGS, **(settings or {})}
+        self.directory = self.settings["directory"]
+        self._lock = threading.Lock()
+        self._pending = self.settings["cycles"]
+        env_cycles = os.environ.get("H2S_PROFILE_CYCLES")
+        if env_cycles:
+            try:
+                self._pending = max(self._pending, int(env_cycles))
+            except ValueError:
+                logging.warning(f"环境变量 H2S_PROFILE_CYCLES ('{env_cycles}') 不是有效整数，忽略")
+        self._session = None
+        self._cycle_started = None
+        self._cycles = 0
+        self._memory_baseline = None
+        self.last_artifacts = []
+        if self.settings["tracemalloc"]:
+            self.set_tracemalloc(True)
+
+    def request(self, cycles=None):
+        """剖析接下来的 cycles 轮检查（默认 signal_cycles 轮）"""
+        cycles = cycles or self.settings["signal_cycles"]
+        with self._lock:
+            self._pending = max(self._pending, cycles)
+        logging.info(f"将剖析接下来的 {cycles} 轮检查，结果写入 {os.path.abspath(self.directory)}")
+
+    def set_tracemalloc(self, enabled):
+        import tracemalloc
+
+        if enabled and not tracemalloc.is_tracing():
+            tracemalloc.start(self.settings["tracemalloc_frames"])
+            self._memory_baseline = None
+            logging.info("已开启 tracemalloc，每轮检查结束时记录内存分配变化")
+        elif not enabled and tracemalloc.is_tracing():
+            tracemalloc.stop()
+            self._memory_baseline = None
+            logging.info("已关闭 tracemalloc")
+
+    def toggle_tracemalloc(self):
+        import tracemalloc
+
+        self.set_tracemalloc(not tracemalloc.is_tracing())
+
+    def begin_cycle(self):
+        global _active
+        with self._lock:
+            if self._pending <= 0 or self._session is not None:
+                return
+            self._pending -= 1
+        mode = self.settings["mode"] if self.settings["mode"] in MODES else "cprofile"
+        self._session = _SESSIONS[mode](self.settings)
+        self._cycle_started = time.strftime("%Y%m%d-%H%M%S")
+        _active = self._session
+
+    def end_cycle(self, duration=None):
+        """结束本轮的剖析并写入结果；写入失败只记录警告"""
+        import tracemalloc
+
+        global _active
+        session, self._session = self._session, None
+        _active = None
+        if session is None and not tracemalloc.is_tracing():
+            return []
+        self._cycles += 1
+        # 同一秒内可能结束多轮检查，文件名中加上进程内的轮次序号
+        stamp = f"{self._cycle_started or time.strftime('%Y%m%d-%H%M%S')}-{self._cycles}"
+        self._cycle_started = None
+        artifacts = []
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            if session is not None:
+                path = os.path.join(self.directory, f"cycle-{stamp}{session.suffix}")
+                session.stop(path, self.settings["top"])
+                artifacts.append(path)
+            memory = self._memory_report(stamp)
+            if memory:
+                artifacts.append(memory)
+            self._prune()
+        except OSError as e:
+            logging.warning(f"写入剖析结果失败: {e}")
+            return []
+        if artifacts:
+            took = f"（本轮耗时 {duration:.2f} 秒）" if duration is not None else ""
+            logging.info(f"剖析结果已写入{took}: {', '.join(artifacts)}")
+        self.last_artifacts = artifacts
+        return artifacts
+
+    def _memory_report(self, stamp):
+        import tracemalloc
+
+        if not tracemalloc.is_tracing():
+            return None
+        snapshot = tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap*>"),
+        ))
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        top = self.settings["top"]
+        lines = [f"当前已分配 {current / 1024:.1f} KiB，本轮峰值 {peak / 1024:.1f} KiB", ""]
+        if self._memory_baseline is not None:
+            lines.append(f"与上一轮相比增长最多的 {top} 处分配:")
+            lines.extend(str(stat) for stat in snapshot.compare_to(self._memory_baseline, "lineno")[:top])
+        else:
+            lines.append(f"分配最多的 {top} 处（第一份快照，下一轮起输出与上一轮的差异）:")
+            lines.extend(str(stat) for stat in snapshot.statistics("lineno")[:top])
+        self._memory_baseline = snapshot
+        path = os.path.join(self.directory, f"cycle-{stamp}-memory.txt")
+        with open(path, "w", encoding="utf-8") as f:
+            f.write("\n".join(lines) + "\n")
+        return path
+
+    def _prune(self):
+        files = sorted(self.artifacts(), key=lambda item: item["mtime"])
+        for item in files[:max(0, len(files) - self.settings["keep"])]:
+            try:
+                os.remove(os.path.join(self.directory, item["name"]))
+            except OSError:
+                pass
+
+    def artifacts(self):
+        """剖析目录中的文件，按修改时间从新到旧排列"""
+        try:
+            entries = list(os.scandir(self.directory))
+        except OSError:
+            return []
+        items = [{"name": e.name, "bytes": e.stat().st_size, "mtime": e.stat().st_mtime}
+                 for e in entries if e.is_file() and e.name.startswith("cycle-")]
+        return sorted(items, key=lambda item: item["mtime"], reverse=True)
+
+    def status(self):
+        import tracemalloc
+
+        return {
+            "mode": self.settings["mode"],
+            "directory": os.path.abspath(self.directory),
+            "pending_cycles": self._pending,
+            "profiling": self._session is not None,
+            "tracemalloc": tracemalloc.is_tracing(),
+            "artifacts": self.artifacts(),
+        }
+
+    def install_signal_handlers(self, loop):
+        """SIGUSR1 剖析接下来的 signal_cycles 轮检查，SIGUSR2 开关 tracemalloc；不支持信号的平台上忽略"""
+        import signal
+
+        try:
+            loop.add_signal_handler(signal.SIGUSR1, self.request)
+            loop.add_signal_handler(signal.SIGUSR2, self.toggle_tracemalloc)
+        except (AttributeError, NotImplementedError, RuntimeError):
+            logging.debug("当前平台不支持剖析信号")
+
+    def routes(self):
+        """健康检查服务的路由，见 web_server.start_web_server()"""
+        if not self.settings["http"]:
+            return {}
+
+        def index():
+            return "application/json", json.dumps(self.status(), ensure_ascii=False, indent=2)
+
+        def start():
+            self.request()
+            return index()
+
+        def download(name):
+            # 只允许下载剖析目录中由本模块生成的文件
+            if name != os.path.basename(name) or not name.startswith("cycle-"):
+                return 404, "text/plain", "not found"
+            try:
+                with open(os.path.join(self.directory, name), "rb") as f:
+                    data = f.read()
+            except OSError:
+                return 404, "text/plain", "not found"
+            text = name.endswith((".txt", ".folded"))
+            return ("text/plain; charset=utf-8" if text else "application/octet-stream"), data
+
+        return {"/profiles": index, "/profiles/start": start, "/profiles/": download}
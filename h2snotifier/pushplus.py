@@ -1,8 +1,10 @@
-import requests
 import logging
 
+import ratelimit
 
-def send_pushplus_msg(token, title, content, template='html', topic='', channel='', webhook=''):
+
+def send_pushplus_msg(token, title, content, template='html', topic='', channel='', webhook='', session=None,
+                      limiter=None, lane=ratelimit.NORMAL):
     """
     发送 PushPlus 消息。
     :param token: PushPlus 的 token。
@@ -12,12 +14,17 @@ def send_pushplus_msg(token, title, content, template='html', topic='', channel=
     :param topic: 群组编码，不填仅发送给自己。
     :param channel: 发送渠道，默认为空。可选值: 'wechat', 'webhook', 'cp', 'mail', 'sms'。
     :param webhook: webhook编码，仅在channel='webhook'时有效。
+    :param session: 可选的 requests.Session，传入时复用其连接池。
+    :param limiter: 令牌桶，默认使用该 token 的共享令牌桶（见 ratelimit.token_bucket）。
+    :param lane: 限流器中的优先级通道。
     :return: PushPlus API 的响应。
     """
     if not token:
         logging.warning("PushPlus Token 未提供，跳过推送")
         return None
 
+    import requests  # 延迟导入，避免拖慢启动
+
     url = "http://www.pushplus.plus/send"
     payload = {
         "token": token,
@@ -32,11 +39,13 @@ def send_pushplus_msg(token, title, content, template='html', topic='', channel=
         'Content-Type': 'application/json'
     }
 
+    (limiter or ratelimit.token_bucket(token)).acquire(lane)
     try:
-        response = requests.post(url, json=payload, headers=headers)
+        response = (session or requests).post(url, json=payload, headers=headers, timeout=15)
         response.raise_for_status()  # 如果请求失败 (状态码 4xx 或 5xx), 则抛出 HTTPError 异常
-        logging.info(f"PushPlus 消息发送成功: {response.json()}")
-        return response.json()
+        result = response.json()
+        logging.debug(f"PushPlus 消息发送成功: {result}")
+        return result
     except requests.exceptions.RequestException as e:
         logging.error(f"发送 PushPlus 消息失败: {e}")
         return None
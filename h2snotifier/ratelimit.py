@@ -0,0 +1,211 @@
+"""
+集中的出站请求限流：每个上游主机、每个 PushPlus token、每个推送后端各有一个命名的令牌桶。
+scrape.py 和 pushplus.py 的每个出站请求发送前都要从对应的桶中取得一个令牌。
+
+令牌桶按 rate_per_minute 匀速补充令牌，最多积累 burst 个，允许短时间的突发；
+等待中的请求按优先级通道排队，同一通道内先到先得：
+
+    high    热门城市的抓取和推送
+    normal  其他城市的抓取、新上架房源的推送
+    low     重新上架房源的推送
+
+acquire() 会阻塞调用线程，只应在抓取/推送的线程池中调用，不要在事件循环中直接调用。
+"""
+import hashlib
+import heapq
+import itertools
+import logging
+import threading
+import time
+from urllib.parse import urlsplit
+
+from logging_config import log_event
+
+HIGH, NORMAL, LOW = 0, 1, 2
+LANES = ("high", "normal", "low")
+
+# 按桶名前缀（冒号之前的部分）给出的默认值；rate_per_minute 为 0 表示不限流
+DEFAULT_LIMITS = {
+    "host": {"rate_per_minute": 60, "burst": 10},
+    "pushplus": {"rate_per_minute": 20, "burst": 3},
+    "notify": {"rate_per_minute": 60, "burst": 1},
+}
+
+# 等待超过该时间时记录一条日志
+SLOW_WAIT_SECONDS = 1.0
+
+
+class TokenBucket:
+    """线程安全的令牌桶，等待者按 (通道, 到达顺序) 排队"""
+
+    def __init__(self, name, rate_per_minute, burst):
+        self.name = name
+        self._cond = threading.Condition()
+        self._waiters = []
+        self._seq = itertools.count()
+        self.rate = 0.0
+        self.burst = 1
+        self._tokens = 0.0
+        self._updated = time.monotonic()
+        self.configure(rate_per_minute, burst)
+        self._tokens = float(self.burst)
+        # 每个通道: [已取得的令牌数, 累计等待秒数, 最长等待秒数]
+        self.stats = [[0, 0.0, 0.0] for _ in LANES]
+
+    def configure(self, rate_per_minute, burst):
+        """修改补充速率和容量，已积累的令牌保留（不超过新的容量）"""
+        with self._cond:
+            self._refill(time.monotonic())
+            self.rate = max(rate_per_minute, 0) / 60.0
+            self.burst = max(int(burst), 1)
+            self._tokens = min(self._tokens, self.burst)
+            self._cond.notify_all()
+
+    def _refill(self, now):
+        if self.rate > 0:
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self, lane=NORMAL):
+        """
+        阻塞直到取得一个令牌。
+        :param lane: 优先级通道，HIGH / NORMAL / LOW。
+        :return: 等待的秒数。
+        """
+        started = time.monotonic()
+        ticket = (lane, next(self._seq))
+        with self._cond:
+            heapq.heappush(self._waiters, ticket)
+            try:
+                while True:
+                    now = time.monotonic()
+                    self._refill(now)
+                    if self._waiters[0] == ticket:
+                        if self.rate <= 0:
+                            break
+                        if self._tokens >= 1:
+                            self._tokens -= 1
+                            break
+                        # 排在最前面：等到下一个令牌补充完成
+                        self._cond.wait((1 - self._tokens) / self.rate)
+                    else:
+                        # 前面还有更高优先级或更早到达的请求，等它们取得令牌后被唤醒
+                        self._cond.wait()
+            finally:
+                if self._waiters[0] == ticket:
+                    heapq.heappop(self._waiters)
+                else:
+                    self._waiters.remove(ticket)
+                    heapq.heapify(self._waiters)
+                self._cond.notify_all()
+            waited = time.monotonic() - started
+            stats = self.stats[lane]
+            stats[0] += 1
+            stats[1] += waited
+            stats[2] = max(stats[2], waited)
+        if waited >= SLOW_WAIT_SECONDS:
+            log_event("ratelimit.wait", f"限流器 {self.name} 等待 {waited:.2f} 秒", level=logging.DEBUG,
+                      sample=True, bucket=self.name, lane=LANES[lane], duration=round(waited, 3))
+        return waited
+
+    def snapshot(self):
+        """:return: (当前令牌数, 等待中的请求数)"""
+        with self._cond:
+            self._refill(time.monotonic())
+            return self._tokens, len(self._waiters)
+
+
+class RateLimits:
+    """
+    令牌桶注册表。配置格式（config.json 中 "rate_limits" 的 "buckets"）:
+    桶名 -> {"rate_per_minute": ..., "burst": ...}，桶名可以是完整名称（如 "host:api.holland2stay.com"），
+    也可以是前缀（如 "host"、"pushplus"、"notify"），完整名称优先。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._buckets = {}
+        self._defaults = {}
+        self._settings = {}
+
+    def _limits(self, name):
+        kind = name.split(":", 1)[0]
+        limits = dict(DEFAULT_LIMITS.get(kind, DEFAULT_LIMITS["host"]))
+        limits.update(self._defaults.get(name, {}))
+        limits.update(self._settings.get(kind, {}))
+        limits.update(self._settings.get(name, {}))
+        return limits["rate_per_minute"], limits["burst"]
+
+    def configure(self, buckets):
+        """应用新的桶配置，已有的桶原地更新，令牌和统计保留"""
+        with self._lock:
+            self._settings = {name: dict(options) for name, options in (buckets or {}).items()}
+            for name, bucket in self._buckets.items():
+                bucket.configure(*self._limits(name))
+
+    def bucket(self, name, rate_per_minute=None, burst=None):
+        """
+        获取（不存在时创建）命名的令牌桶。
+        :param rate_per_minute: 调用方给出的默认速率，配置文件中的设置优先。
+        :param burst: 调用方给出的默认容量，配置文件中的设置优先。
+        """
+        defaults = {key: value for key, value in (("rate_per_minute", rate_per_minute), ("burst", burst))
+                    if value is not None}
+        with self._lock:
+            bucket = self._buckets.get(name)
+            if bucket is None:
+                self._defaults[name] = defaults
+                bucket = self._buckets[name] = TokenBucket(name, *self._limits(name))
+            elif defaults and defaults != self._defaults.get(name):
+                # 例如热加载后重建的推送后端带来了新的 rate_per_minute
+                self._defaults[name] = defaults
+                bucket.configure(*self._limits(name))
+            return bucket
+
+    def metrics_text(self):
+        """Prometheus 文本格式的限流指标"""
+        lines = []
+        with self._lock:
+            buckets = sorted(self._buckets.items())
+        for name, bucket in buckets:
+            tokens, waiting = bucket.snapshot()
+            lines.append(f'h2s_ratelimit_tokens{{bucket="{name}"}} {tokens:.2f}')
+            lines.append(f'h2s_ratelimit_waiting{{bucket="{name}"}} {waiting}')
+            for lane, (acquired, waited, longest) in zip(LANES, bucket.stats):
+                if not acquired:
+                    continue
+                labels = f'bucket="{name}",lane="{lane}"'
+                lines.append(f"h2s_ratelimit_acquired_total{{{labels}}} {acquired}")
+                lines.append(f"h2s_ratelimit_wait_seconds_total{{{labels}}} {waited:.3f}")
+                lines.append(f"h2s_ratelimit_wait_seconds_max{{{labels}}} {longest:.3f}")
+        return "\n".join(lines) + "\n" if lines else ""
+
+
+_default_limits = RateLimits()
+
+
+def configure(settings):
+    """应用 config.json 中的 "rate_limits" 设置"""
+    _default_limits.configure((settings or {}).get("buckets"))
+
+
+def bucket(name, rate_per_minute=None, burst=None):
+    return _default_limits.bucket(name, rate_per_minute, burst)
+
+
+def host_bucket(url):
+    """上游主机的令牌桶，例如 host:api.holland2stay.com"""
+    return bucket(f"host:{urlsplit(url).netloc}")
+
+
+def token_bucket(token, rate_per_minute=None, burst=None):
+    """
+    PushPlus token 的令牌桶。桶名使用完整 token 的 sha1 前 8 位：不同 token 不会共用一个桶，
+    指标和日志中也不会出现 token 本身。
+    """
+    digest = hashlib.sha1(str(token).encode("utf-8")).hexdigest()[:8]
+    return bucket(f"pushplus:{digest}", rate_per_minute, burst)
+
+
+def metrics_text():
+    return _default_limits.metrics_text()
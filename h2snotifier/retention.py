@@ -0,0 +1,250 @@
+import argparse
+import logging
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime, timedelta
+
+import db
+from db import open_connection
+from logging_config import setup_logging
+
+ARCHIVE_TABLE = "houses_archive"
+
+DEFAULT_SETTINGS = {
+    "enabled": True,
+    "archive_after_days": 30,   # 占用超过多少天的房源移入归档表
+    "batch_size": 500,          # 每个事务归档的行数，批次之间释放写锁
+    "batch_pause_seconds": 0.05,
+    "vacuum_pages": 2000,       # 每次增量 VACUUM 释放的最大页数
+    "min_interval_hours": 24,   # 两次维护之间的最短间隔
+}
+
+
+def create_archive_table(conn):
+    """创建归档表，结构与 houses 相同并多一个 archived_at 字段"""
+    conn.execute(
+        f"""CREATE TABLE IF NOT EXISTS {ARCHIVE_TABLE}
+                 (id INTEGER PRIMARY KEY,
+                  url_key TEXT,
+                  area TEXT,
+                  city TEXT,
+                  price_exc TEXT,
+                  price_inc TEXT,
+                  available_from TEXT,
+                  max_register TEXT,
+                  contract_type TEXT,
+                  created_at TEXT,
+                  occupied_at TEXT,
+                  rooms TEXT,
+                  booking_type TEXT,
+                  archived_at TEXT DEFAULT CURRENT_TIMESTAMP)"""
+    )
+    existing_columns = {row[1] for row in conn.execute(f"PRAGMA table_info({ARCHIVE_TABLE})")}
+    if "booking_type" not in existing_columns:
+        conn.execute(f"ALTER TABLE {ARCHIVE_TABLE} ADD COLUMN booking_type TEXT")
+    conn.execute(f"CREATE INDEX IF NOT EXISTS idx_archive_url_key ON {ARCHIVE_TABLE} (url_key)")
+    conn.commit()
+
+
+def archive_occupied(conn, older_than_days, batch_size=500, batch_pause_seconds=0.05, should_stop=None):
+    """
+    把 occupied_at 早于 older_than_days 天前的房源分批移入归档表。
+    每批在一个短事务中完成 INSERT + DELETE，批次之间暂停以便主流程获得写锁。
+    :return: 归档的行数。
+    """
+    create_archive_table(conn)
+    cutoff = (datetime.now() - timedelta(days=older_than_days)).isoformat()
+    columns = "id, url_key, area, city, price_exc, price_inc, available_from, max_register, contract_type, created_at, occupied_at, rooms, booking_type"
+    archived = 0
+    while should_stop is None or not should_stop():
+        ids = [row[0] for row in conn.execute(
+            "SELECT id FROM houses WHERE occupied_at IS NOT NULL AND occupied_at < ? LIMIT ?",
+            (cutoff, batch_size),
+        )]
+        if not ids:
+            break
+        placeholders = ",".join("?" * len(ids))
+        with conn:
+            conn.execute(
+                f"INSERT OR REPLACE INTO {ARCHIVE_TABLE} ({columns}) SELECT {columns} FROM houses WHERE id IN ({placeholders})",
+                ids,
+            )
+            conn.execute(f"DELETE FROM houses WHERE id IN ({placeholders})", ids)
+        archived += len(ids)
+        time.sleep(batch_pause_seconds)
+    return archived
+
+
+def ensure_incremental_vacuum(conn):
+    """
+    开启 auto_vacuum=INCREMENTAL。已有数据库需要做一次完整 VACUUM 才能生效，只在第一次执行。
+    完整 VACUUM 在重建整个数据库期间一直持有写锁，只能在监控停止时通过 retention.py --run --full-vacuum 手动执行。
+    :return: 是否执行了完整 VACUUM。
+    """
+    mode = conn.execute("PRAGMA auto_vacuum").fetchone()[0]
+    if mode == 2:
+        return False
+    conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+    conn.execute("VACUUM")
+    return True
+
+
+def checkpoint(conn):
+    """把 WAL 写回主数据库并截断 -wal 文件；有其他连接正在读时只写回能写回的部分"""
+    busy, log_pages, checkpointed = conn.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchone()
+    if busy:
+        logging.info(f"WAL 检查点未能截断（其他连接正在使用），已写回 {checkpointed}/{log_pages} 页")
+
+
+def incremental_vacuum(conn, pages):
+    """释放最多 pages 个空闲页"""
+    conn.execute(f"PRAGMA incremental_vacuum({int(pages)})").fetchall()
+
+
+ANALYSIS_LIMIT = 400  # ANALYZE 每个索引最多扫描的行数，统计信息为近似值
+
+
+def analyze(conn):
+    """
+    增量更新查询计划统计信息：限制每个索引扫描的行数，只重新分析统计信息可能已过时的表，
+    不对整个数据库做完整 ANALYZE。还没有统计信息的数据库先做一次（同样受行数限制的）ANALYZE。
+    """
+    conn.execute(f"PRAGMA analysis_limit={ANALYSIS_LIMIT}")
+    has_stats = conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'sqlite_stat1'").fetchone() is not None
+    if has_stats:
+        # 0x10002：检查所有表而不只是本连接用过的表（SQLite 3.46+，旧版本忽略该位）
+        conn.execute("PRAGMA optimize=0x10002")
+    else:
+        conn.execute("ANALYZE")
+    conn.commit()
+
+
+def db_stats(conn, path=None):
+    """返回数据库大小、页碎片和各表行数统计"""
+    path = path or db.DB_PATH
+    page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+    page_count = conn.execute("PRAGMA page_count").fetchone()[0]
+    freelist_count = conn.execute("PRAGMA freelist_count").fetchone()[0]
+    live = conn.execute("SELECT COUNT(*) FROM houses WHERE occupied_at IS NULL").fetchone()[0]
+    occupied = conn.execute("SELECT COUNT(*) FROM houses WHERE occupied_at IS NOT NULL").fetchone()[0]
+    try:
+        archived = conn.execute(f"SELECT COUNT(*) FROM {ARCHIVE_TABLE}").fetchone()[0]
+    except sqlite3.OperationalError:
+        archived = 0
+    return {
+        "file_bytes": sum(os.path.getsize(p) for p in (path, path + "-wal") if os.path.exists(p)),
+        "page_size": page_size,
+        "page_count": page_count,
+        "freelist_count": freelist_count,
+        "fragmentation": round(freelist_count / page_count, 4) if page_count else 0.0,
+        "auto_vacuum": conn.execute("PRAGMA auto_vacuum").fetchone()[0],
+        "live_rows": live,
+        "occupied_rows": occupied,
+        "archived_rows": archived,
+    }
+
+
+def run_maintenance(settings=None, path=None, should_stop=None, full_vacuum=False):
+    """
+    执行一次完整的维护：归档、增量 VACUUM、ANALYZE、WAL 检查点，并返回维护前后的统计信息。
+    :param full_vacuum: auto_vacuum 还不是 INCREMENTAL 时是否执行完整 VACUUM；后台维护不执行，只记录提示。
+    """
+    settings = {**DEFAULT_SETTINGS, **(settings or {})}
+    conn = open_connection(path)
+    try:
+        started = time.perf_counter()
+        before = db_stats(conn, path)
+        archived = archive_occupied(
+            conn,
+            settings["archive_after_days"],
+            batch_size=settings["batch_size"],
+            batch_pause_seconds=settings["batch_pause_seconds"],
+            should_stop=should_stop,
+        )
+        if full_vacuum:
+            full_vacuum = ensure_incremental_vacuum(conn)
+        if conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2:
+            if not full_vacuum:
+                incremental_vacuum(conn, settings["vacuum_pages"])
+        else:
+            logging.info("auto_vacuum 不是 INCREMENTAL，跳过增量 VACUUM；停止监控后运行 retention.py --run --full-vacuum 开启")
+        analyze(conn)
+        checkpoint(conn)
+        after = db_stats(conn, path)
+        logging.info(
+            f"数据库维护完成：归档 {archived} 条，文件 {before['file_bytes']} -> {after['file_bytes']} 字节，"
+            f"碎片率 {before['fragmentation']:.2%} -> {after['fragmentation']:.2%}，"
+            f"耗时 {time.perf_counter() - started:.2f} 秒"
+        )
+        return {"archived": archived, "full_vacuum": full_vacuum, "before": before, "after": after}
+    finally:
+        conn.close()
+
+
+class RetentionWorker:
+    """
+    在后台线程中执行数据库维护，只在非工作时间触发，且两次维护之间至少间隔 min_interval_hours。
+    使用独立的数据库连接，不会阻塞监控主流程。
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self.last_run = None
+        self.last_result = None
+        self._thread = None
+        self._stop = threading.Event()
+
+    def maybe_run(self, settings, is_work_time):
+        """在每轮检查后调用；满足条件时启动后台维护，返回是否启动"""
+        settings = {**DEFAULT_SETTINGS, **(settings or {})}
+        if not settings["enabled"] or is_work_time:
+            return False
+        if self._thread is not None and self._thread.is_alive():
+            return False
+        if self.last_run is not None and time.time() - self.last_run < settings["min_interval_hours"] * 3600:
+            return False
+        self.last_run = time.time()
+        self._thread = threading.Thread(target=self._run, args=(settings,), name="retention", daemon=True)
+        self._thread.start()
+        return True
+
+    def _run(self, settings):
+        try:
+            self.last_result = run_maintenance(settings, self.path, should_stop=self._stop.is_set)
+        except sqlite3.Error as e:
+            logging.error(f"数据库维护失败: {e}")
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=10)
+
+
+def print_stats(stats):
+    print("数据库统计")
+    print("-" * 30)
+    print(f"文件大小: {stats['file_bytes'] / 1024:.1f} KB")
+    print(f"页大小: {stats['page_size']}，总页数: {stats['page_count']}，空闲页: {stats['freelist_count']}")
+    print(f"碎片率: {stats['fragmentation']:.2%}")
+    print(f"auto_vacuum: {['NONE', 'FULL', 'INCREMENTAL'][stats['auto_vacuum']]}")
+    print(f"可用房源: {stats['live_rows']}，已占用: {stats['occupied_rows']}，已归档: {stats['archived_rows']}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="houses.db 归档与维护工具")
+    parser.add_argument("--run", action="store_true", help="立即执行一次归档和维护")
+    parser.add_argument("--days", type=int, default=DEFAULT_SETTINGS["archive_after_days"], help="归档占用超过多少天的房源")
+    parser.add_argument("--full-vacuum", action="store_true",
+                        help="与 --run 一起使用：执行一次完整 VACUUM 以开启增量 VACUUM（期间持有写锁，请先停止监控）")
+    args = parser.parse_args()
+
+    setup_logging()
+    if args.run:
+        run_maintenance({"archive_after_days": args.days}, full_vacuum=args.full_vacuum)
+    conn = open_connection()
+    try:
+        print_stats(db_stats(conn))
+    finally:
+        conn.close()
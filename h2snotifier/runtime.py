@@ -0,0 +1,409 @@
+"""
+基于 asyncio 的监控运行时。一轮检查由几个协作的任务完成，任务之间用有界队列连接：
+
+    抓取（并发的打包请求） -> 城市队列 -> 数据库写入（专用单线程） -> 消息队列 -> 推送
+
+某个城市的所有查询完成后立即进入数据库写入，新房源立即进入推送，不必等待整轮抓取结束；
+下游变慢时有界队列会让上游等待（背压）。一轮检查的耗时由最慢的单个请求决定，而不是所有请求耗时之和。
+"""
+import asyncio
+import logging
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import db
+import profiling
+import ratelimit
+import snapshot
+from events import ADDED, RELISTED, REMOVED, DiffEngine
+from logging_config import log_event
+from notifiers import Message
+from scoring import ListingScorer
+from scrape import get_session_cookies, house_to_msg, iter_scrape_batch, make_query, query_key, set_session_cookies
+
+QUEUE_SIZE = 64
+
+
+def restrict_queries(queries, cities):
+    """只保留 cities 中的城市，去掉因此变为空的查询；cities 为 None 时不限制"""
+    if cities is None:
+        return queries
+    restricted = []
+    for query in queries:
+        kept = [c for c in query["cities"] if c in cities]
+        if kept:
+            restricted.append(make_query(kept, query["only_direct_booking"], query["page_size"]))
+    return restricted
+
+
+class _CycleEnd:
+    """队列中的本轮结束标记，推送任务处理完之前的所有消息后完成 done"""
+
+    def __init__(self, done):
+        self.done = done
+
+
+class MonitorRuntime:
+    """
+    管理抓取、数据库写入和推送任务。SQLite 连接（包括协调存储的连接）只在专用的数据库线程中创建和使用。
+    用法: await start() -> 多次 await run_cycle(config) -> await stop()。
+    :param coordinator: coordination.Coordinator，多副本部署时用于分配城市和认领待推送的房源。
+    :param profiler: profiling.CycleProfiler，按需剖析检查轮次。
+    """
+
+    def __init__(self, delivery, fetch_concurrency=4, queue_size=QUEUE_SIZE, coordinator=None, profiler=None):
+        self.delivery = delivery
+        self.coordinator = coordinator
+        self.profiler = profiler
+        self.fetch_concurrency = fetch_concurrency
+        self.queue_size = queue_size
+        self.engine = None
+        # 评分只在数据库线程中计算（需要读取城市历史），排序和截断在事件循环中完成
+        self.scorer = ListingScorer()
+        self.metrics = {
+            "warm_start": 0,
+            "cycles_total": 0,
+            "cycle_running": 0,
+            "last_cycle_seconds": 0.0,
+            "last_cycle_timestamp": 0.0,
+            "fetch_failed_queries_total": 0,
+            "cities_synced_total": 0,
+            "listings": 0,
+            "events_total": {},
+            "unmatched_total": 0,
+            "below_score_total": 0,
+            "claimed_elsewhere_total": 0,
+            "assigned_cities": 0,
+            "messages_total": 0,
+            "notify_sent_total": {},
+        }
+        self._db_executor = profiling.instrument(ThreadPoolExecutor(max_workers=1, thread_name_prefix="db-writer"))
+        self._fetch_executor = profiling.instrument(
+            ThreadPoolExecutor(max_workers=fetch_concurrency, thread_name_prefix="fetch")
+        )
+        self._cities = None
+        self._messages = None
+        self._tasks = []
+        self._cycle = None
+        self.snapshot_settings = dict(snapshot.DEFAULT_SETTINGS)
+        # 从快照恢复的调度信息，例如 {"next_due": 时间戳}
+        self.restored_schedule = {}
+
+    async def run_db(self, func, *args):
+        """在数据库线程中执行 func(*args)"""
+        return await asyncio.get_running_loop().run_in_executor(self._db_executor, func, *args)
+
+    async def start(self, snapshot_settings=None):
+        """
+        :param snapshot_settings: config.json 中的 "snapshot" 设置；启用时优先从快照恢复房源、cookie 和调度信息。
+        """
+        self.snapshot_settings = {**snapshot.DEFAULT_SETTINGS, **(snapshot_settings or {})}
+        db_started = time.perf_counter()
+        await self.run_db(db.create_table)
+        self.engine = await self.run_db(self._open_engine)
+        logging.debug(f"数据库线程已就绪，耗时 {time.perf_counter() - db_started:.3f} 秒")
+        self._cities = asyncio.Queue(self.queue_size)
+        self._messages = asyncio.Queue(self.queue_size)
+        self._tasks = [
+            asyncio.create_task(self._writer(), name="db-writer"),
+            asyncio.create_task(self._notifier(), name="notifier"),
+        ]
+
+    def _open_engine(self):
+        engine = DiffEngine()
+        settings = self.snapshot_settings
+        if settings["enabled"]:
+            with db.get_connection() as conn:
+                warm = snapshot.load_snapshot(conn, settings["path"], settings["max_age_minutes"] * 60)
+            if warm is not None:
+                engine.warm = warm
+                set_session_cookies(warm.meta.get("cookies"))
+                self.restored_schedule = warm.meta.get("schedule") or {}
+                self.metrics["warm_start"] = 1
+        return engine
+
+    async def save_snapshot(self, schedule=None):
+        """在数据库线程中把当前房源快照、cookie 和调度信息写入快照文件，失败只记录警告"""
+        settings = self.snapshot_settings
+        if not settings["enabled"] or self.engine is None:
+            return
+        meta = {"cookies": get_session_cookies(), "schedule": schedule or {}}
+        try:
+            await self.run_db(self._write_snapshot, settings["path"], meta)
+        except (OSError, sqlite3.Error) as e:
+            logging.warning(f"写入快照失败: {e}")
+
+    def _write_snapshot(self, path, meta):
+        started = time.perf_counter()
+        with db.get_connection() as conn:
+            state = snapshot.db_state(conn)
+        data = snapshot.encode_snapshot(self.engine.snapshots, self.engine.fingerprints, meta, state)
+        snapshot.write_snapshot(path, data)
+        log_event("snapshot.written", f"快照已写入 {path} ({len(data)} 字节)", level=logging.DEBUG,
+                  stage="snapshot", bytes=len(data), cities=len(self.engine.snapshots),
+                  duration=round(time.perf_counter() - started, 3))
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        if self.coordinator is not None:
+            await self.run_db(self.coordinator.leave)
+        if self.engine is not None:
+            await self.run_db(self.engine.close)
+        await self.run_db(db.close_connection)
+        self._db_executor.shutdown(wait=True)
+        self._fetch_executor.shutdown(wait=False)
+
+    async def assignment(self, cities):
+        """
+        多副本部署时续期租约/心跳并返回本副本应抓取的城市集合（待命时为空集合）；未启用协调时返回 None。
+        """
+        if self.coordinator is None:
+            return None
+        assigned = await self.run_db(self.coordinator.assignment, cities)
+        self.metrics["assigned_cities"] = len(assigned)
+        return assigned
+
+    async def run_cycle(self, config, cities=None):
+        """
+        执行一轮检查：抓取、对比快照生成变化事件、匹配订阅者并推送新上架/重新上架的房源。
+        :param config: configuration.CompiledConfig。
+        :param cities: 只抓取这些城市，见 assignment()；None 表示抓取所有监控组的城市。
+        :return: 本轮统计信息。
+        """
+        cycle_started = time.perf_counter()
+        logging.info("开始处理房源通知...")
+        self._cycle = {"new": 0, "unmatched": 0, "messages": 0, "sent": {}, "index": config.index,
+                       "hot_cities": config.hot_cities}
+        self.metrics["cycle_running"] = 1
+        self.scorer.configure(config.raw.get("scoring"))
+        if self.profiler is not None:
+            self.profiler.begin_cycle()
+        # 一轮检查可能比租约有效期更长，期间在后台续期
+        keeper = asyncio.create_task(self._keep_lease(config.cities)) if self.coordinator is not None else None
+        try:
+            await self._fetch(restrict_queries(config.queries, cities), config.api_url, config.hot_cities)
+            done = asyncio.get_running_loop().create_future()
+            await self._cities.put(_CycleEnd(done))
+            await done
+        finally:
+            self.metrics["cycle_running"] = 0
+            if keeper is not None:
+                keeper.cancel()
+            if self.profiler is not None:
+                self.profiler.end_cycle(time.perf_counter() - cycle_started)
+        stats = self._cycle
+        duration = time.perf_counter() - cycle_started
+        self.metrics["cycles_total"] += 1
+        self.metrics["last_cycle_seconds"] = round(duration, 3)
+        self.metrics["last_cycle_timestamp"] = time.time()
+        log_event("cycle.done", f"本轮处理完成：新增房源 {stats['new']} 个，未匹配任何监控组 {stats['unmatched']} 个。",
+                  stage="cycle", new=stats["new"], unmatched=stats["unmatched"], messages=stats["messages"],
+                  sent=stats["sent"], duration=round(duration, 3))
+        return {key: value for key, value in stats.items() if key not in ("index", "hot_cities")}
+
+    async def _keep_lease(self, cities):
+        while True:
+            await asyncio.sleep(self.coordinator.lease_seconds / 3)
+            await self.assignment(cities)
+
+    async def _fetch(self, queries, api_url, hot_cities=()):
+        # 同一城市可能出现在多个查询中：等该城市的所有查询都完成后再合并、同步，
+        # 任一查询失败则本轮跳过该城市，避免不完整的数据被当作房源下架
+        remaining = {}
+        for query in {query_key(q): q for q in queries}.values():
+            for city_id in query["cities"]:
+                remaining[city_id] = remaining.get(city_id, 0) + 1
+        merged = {city_id: {} for city_id in remaining}
+        broken = set()
+        received = False
+
+        async for key, result in iter_scrape_batch(queries, api_url=api_url,
+                                                   concurrency=self.fetch_concurrency,
+                                                   executor=self._fetch_executor,
+                                                   hot_cities=hot_cities):
+            if result is None:
+                self.metrics["fetch_failed_queries_total"] += 1
+            else:
+                received = True
+            for city_id in key[0]:
+                if result is None:
+                    broken.add(city_id)
+                else:
+                    for house in result.get(city_id, []):
+                        merged[city_id].setdefault(house["url_key"], house)
+                remaining[city_id] -= 1
+                if remaining[city_id] == 0:
+                    houses = merged.pop(city_id)
+                    if city_id in broken:
+                        logging.warning(f"城市 {city_id} 的部分查询失败，本轮跳过该城市")
+                        continue
+                    await self._cities.put((city_id, list(houses.values())))
+        if not received:
+            logging.warning("未获取到任何房源数据，可能是爬取失败")
+
+    async def _writer(self):
+        while True:
+            item = await self._cities.get()
+            try:
+                if isinstance(item, _CycleEnd):
+                    await self._messages.put(item)
+                    continue
+                city_id, houses = item
+                sync_started = time.perf_counter()
+                events, claimed = await self.run_db(self._apply, city_id, houses)
+                self.metrics["cities_synced_total"] += 1
+                self.metrics["listings"] = sum(len(s) for s in self.engine.snapshots.values())
+                counts = {}
+                for event in events:
+                    counts[event.type] = counts.get(event.type, 0) + 1
+                    self.metrics["events_total"][event.type] = self.metrics["events_total"].get(event.type, 0) + 1
+                log_event("city.synced", f"城市 {city_id} 共 {len(houses)} 个房源，变化: {counts or '无'}",
+                          city=city_id, stage="sync", houses=len(houses), changes=counts,
+                          duration=round(time.perf_counter() - sync_started, 3))
+                new_events = [e for e in events if e.type in (ADDED, RELISTED)]
+                if claimed is not None:
+                    skipped = len(new_events)
+                    new_events = [e for e in new_events if e.url_key in claimed]
+                    skipped -= len(new_events)
+                    if skipped:
+                        self.metrics["claimed_elsewhere_total"] += skipped
+                        logging.info(f"城市 {city_id} 有 {skipped} 个新房源已由其他副本推送，跳过")
+                messages = self._build_messages(city_id, new_events)
+                if messages:
+                    await self._messages.put(messages)
+            except Exception as e:
+                logging.error(f"数据库写入任务处理失败: {e}", exc_info=True)
+            finally:
+                self._cities.task_done()
+
+    def _apply(self, city_id, houses):
+        """在数据库线程中同步城市房源并为新房源评分；多副本部署时释放下架房源的认领并认领新房源"""
+        max_id = None
+        if self.scorer.settings["enabled"]:
+            # 记录插入前的最大 id，评分时城市历史不包含本批新房源
+            try:
+                with db.get_connection() as conn:
+                    if conn is not None:
+                        max_id = conn.execute("SELECT COALESCE(MAX(id), 0) FROM houses").fetchone()[0]
+            except sqlite3.Error:
+                max_id = None
+        events = self.engine.apply(city_id, houses)
+        new_houses = [e.data["house"] for e in events if e.type in (ADDED, RELISTED)]
+        if new_houses and self.scorer.settings["enabled"]:
+            started = time.perf_counter()
+            try:
+                with db.get_connection() as conn:
+                    self.scorer.score(conn, new_houses, max_id=max_id)
+            except (sqlite3.Error, ValueError) as e:
+                logging.warning(f"城市 {city_id} 的新房源评分失败，按原顺序推送: {e}")
+            log_event("city.scored", level=logging.DEBUG, city=city_id, stage="score", houses=len(new_houses),
+                      duration=round(time.perf_counter() - started, 4))
+        if self.coordinator is None:
+            return events, None
+        removed = [e.url_key for e in events if e.type == REMOVED]
+        if removed:
+            self.coordinator.release(removed)
+        new_keys = [e.url_key for e in events if e.type in (ADDED, RELISTED)]
+        return events, self.coordinator.claim(new_keys) if new_keys else set()
+
+    def _build_messages(self, city_id, new_events):
+        stats = self._cycle
+        stats["new"] += len(new_events)
+        hot = city_id in stats["hot_cities"]
+        matched = []
+        for event in new_events:
+            h = event.data["house"]
+            if stats["index"].match(h):
+                matched.append(event)
+                continue
+            log_event("house.filtered", "不满足任何监控组的条件，不推送",
+                      level=logging.DEBUG, sample=True, city=city_id, url_key=h.get('url_key'),
+                      stage="filter", price=h.get('price_inc'))
+            stats["unmatched"] += 1
+            self.metrics["unmatched_total"] += 1
+
+        # 按评分从高到低推送，并按 scoring 设置截断
+        kept = self.scorer.select([e.data["house"] for e in matched])
+        if len(kept) < len(matched):
+            dropped = len(matched) - len(kept)
+            self.metrics["below_score_total"] += dropped
+            logging.info(f"城市 {city_id} 有 {dropped} 个新房源评分较低或超出每轮推送上限，不推送")
+
+        messages = []
+        for event in (matched[i] for i in kept):
+            h = event.data["house"]
+            try:
+                booking_status = "可直接预订" if h.get('direct_booking') else "需要抽签"
+                label = "重新上架" if event.type == RELISTED else "新房源"
+                title = f"{label}({booking_status}): {h.get('url_key', 'N/A')}"
+                # 限流时热门城市优先，其次是新上架的房源
+                if hot:
+                    priority = ratelimit.HIGH
+                else:
+                    priority = ratelimit.LOW if event.type == RELISTED else ratelimit.NORMAL
+                messages.append(Message(title, house_to_msg(h), h, priority))
+            except Exception as error:
+                log_event("house.notify_failed", "生成推送消息失败", level=logging.ERROR, sample=True,
+                          city=city_id, url_key=h.get('url_key'), stage="notify", error=repr(error), exc_info=True)
+        return messages
+
+    async def _notifier(self):
+        while True:
+            item = await self._messages.get()
+            end = None
+            batch = []
+            # 把队列中已经到达的消息合并成一批投递，遇到本轮结束标记时先投递再完成本轮
+            while True:
+                if isinstance(item, _CycleEnd):
+                    end = item
+                    break
+                batch.extend(item)
+                if self._messages.empty():
+                    break
+                item = self._messages.get_nowait()
+            try:
+                if batch:
+                    await self._deliver(batch)
+            except Exception as e:
+                logging.error(f"推送任务处理失败: {e}", exc_info=True)
+            finally:
+                if end is not None and not end.done.done():
+                    end.done.set_result(None)
+
+    async def _deliver(self, messages):
+        stats = self._cycle
+        stats["messages"] += len(messages)
+        self.metrics["messages_total"] += len(messages)
+        if not self.delivery:
+            logging.warning(f"未配置任何推送后端，跳过 {len(messages)} 条新房源通知")
+            return
+        notify_started = time.perf_counter()
+        sent = await self.delivery.deliver(messages)
+        for name, count in sent.items():
+            stats["sent"][name] = stats["sent"].get(name, 0) + count
+            self.metrics["notify_sent_total"][name] = self.metrics["notify_sent_total"].get(name, 0) + count
+        log_event("notify.done", f"推送 {len(messages)} 条新房源通知: {sent}", stage="notify",
+                  messages=len(messages), sent=sent, duration=round(time.perf_counter() - notify_started, 3))
+
+    def metrics_text(self):
+        """Prometheus 文本格式的运行指标"""
+        lines = []
+        for name, value in self.metrics.items():
+            metric = f"h2s_{name}"
+            if isinstance(value, dict):
+                label = "backend" if name == "notify_sent_total" else "type"
+                lines.extend(f'{metric}{{{label}="{key}"}} {count}' for key, count in sorted(value.items()))
+            else:
+                lines.append(f"{metric} {value}")
+        if self._cities is not None:
+            lines.append(f'h2s_queue_depth{{queue="cities"}} {self._cities.qsize()}')
+            lines.append(f'h2s_queue_depth{{queue="messages"}} {self._messages.qsize()}')
+        return "\n".join(lines) + "\n" + ratelimit.metrics_text()
+
+    def routes(self):
+        """健康检查服务的路由，见 web_server.start_web_server()"""
+        return {"/metrics": lambda: ("text/plain; version=0.0.4", self.metrics_text())}
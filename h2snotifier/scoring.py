@@ -0,0 +1,193 @@
+"""
+新房源评分：把一批新房源组成按列存储的表（NumPy 数组：价格、面积、每平米价格、房间数、距可入住天数、城市），
+向量化地计算可配置的综合评分（0-100），其中价格、每平米价格和面积按该城市在 houses.db 中的历史房源计算百分位。
+推送按评分从高到低排序（同一批推送中也按评分排序），可以设置每个城市每轮最多推送的房源数和最低评分。
+
+numpy 为延迟导入；未安装时记录一次警告，房源按原顺序推送、不截断。
+"""
+import logging
+import time
+from datetime import date
+
+# 各项评分的权重，每项的取值都在 [0, 1] 之间，越大越好
+DEFAULT_WEIGHTS = {
+    "price_per_m2": 0.4,    # 每平米价格在城市历史中的百分位，越便宜越好
+    "price": 0.2,           # 总价在城市历史中的百分位，越便宜越好
+    "area": 0.2,            # 面积在城市历史中的百分位，越大越好
+    "availability": 0.1,    # 越早可以入住越好
+    "rooms": 0.1,           # 房间越多越好
+    "direct_booking": 0.0,  # 可直接预定
+}
+
+DEFAULT_SETTINGS = {
+    "enabled": True,
+    "weights": DEFAULT_WEIGHTS,
+    "history_days": 365,               # 参与百分位计算的历史房源范围
+    "min_history": 20,                 # 历史房源少于该数量时，与本批房源合并计算百分位
+    "history_refresh_minutes": 60,     # 城市历史的缓存时间
+    "availability_horizon_days": 90,   # 超过该天数才能入住的房源 availability 评分为 0
+    "max_per_city": None,              # 每轮每个城市最多推送的房源数，None 表示不截断
+    "min_score": 0,                    # 低于该评分的房源不推送
+}
+
+# 房间类型 -> 房间数，Studio 视为半个房间
+ROOM_COUNTS = {"Studio": 0.5, "Loft (open bedroom area)": 1, "1": 1, "2": 2, "3": 3, "4": 4}
+MAX_ROOMS = 4
+
+_numpy_missing_logged = False
+
+
+def _numpy():
+    global _numpy_missing_logged
+    try:
+        import numpy
+    except ImportError:
+        if not _numpy_missing_logged:
+            logging.warning("未安装 numpy，新房源不评分，按原顺序推送")
+            _numpy_missing_logged = True
+        return None
+    return numpy
+
+
+def _number(value):
+    try:
+        return float(str(value).replace(",", "."))
+    except (TypeError, ValueError):
+        return float("nan")
+
+
+def _days_until(value, today):
+    try:
+        return (date.fromisoformat(str(value)[:10]) - today).days
+    except (TypeError, ValueError):
+        return float("nan")
+
+
+class ListingTable:
+    """一批房源的列式表，每列是一个长度相同的 NumPy 数组"""
+
+    def __init__(self, np, houses, today=None):
+        today = today or date.today()
+        self.size = len(houses)
+        self.city = np.array([str(h.get("city")) for h in houses])
+        self.cities, self.city_codes = np.unique(self.city, return_inverse=True)
+        self.price = np.array([_number(h.get("price_inc")) for h in houses], dtype=float)
+        self.area = np.array([_number(h.get("area")) for h in houses], dtype=float)
+        self.rooms = np.array([ROOM_COUNTS.get(h.get("rooms"), float("nan")) for h in houses], dtype=float)
+        self.available_days = np.array([_days_until(h.get("available_from"), today) for h in houses], dtype=float)
+        self.direct = np.array([bool(h.get("direct_booking")) for h in houses], dtype=float)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            self.price_per_m2 = np.where(self.area > 0, self.price / self.area, np.nan)
+
+
+class ListingScorer:
+    """
+    计算新房源的评分并排序。城市历史按城市缓存，只在数据库线程中使用。
+    """
+
+    def __init__(self, settings=None):
+        self.settings = dict(DEFAULT_SETTINGS)
+        self._history = {}
+        self.configure(settings)
+
+    def configure(self, settings):
+        settings = {**DEFAULT_SETTINGS, **(settings or {})}
+        settings["weights"] = {**DEFAULT_WEIGHTS, **(settings.get("weights") or {})}
+        if settings["history_days"] != self.settings["history_days"]:
+            self._history.clear()
+        self.settings = settings
+
+    def _city_history(self, np, conn, city, max_id=None):
+        """
+        :param max_id: 只使用 id 不大于该值的房源，用于排除本批刚插入的新房源
+        :return: (已排序的历史总价, 面积, 每平米价格)
+        """
+        cached = self._history.get(city)
+        if cached is not None and time.monotonic() - cached[0] < self.settings["history_refresh_minutes"] * 60:
+            return cached[1]
+        rows = conn.execute(
+            f"""SELECT CAST(price_inc AS REAL), CAST(area AS REAL) FROM houses
+               WHERE city = ? AND created_at >= datetime('now', ?){' AND id <= ?' if max_id is not None else ''}""",
+            (city, f"-{int(self.settings['history_days'])} days", *(() if max_id is None else (max_id,))),
+        ).fetchall()
+        data = np.array(rows, dtype=float).reshape(-1, 2)
+        price, area = data[:, 0], data[:, 1]
+        valid = (price > 0) & (area > 0)
+        history = (np.sort(price[valid]), np.sort(area[valid]), np.sort(price[valid] / area[valid]))
+        self._history[city] = (time.monotonic(), history)
+        return history
+
+    def _percentile(self, np, history, values):
+        """values 在 history 中的百分位（0-1，相同值取中间位置）；无法计算时为 0.5"""
+        if len(history) < self.settings["min_history"]:
+            history = np.sort(np.concatenate([history, values[~np.isnan(values)]]))
+        if len(history) < 2:
+            return np.full(len(values), 0.5)
+        left = np.searchsorted(history, values, side="left")
+        right = np.searchsorted(history, values, side="right")
+        return np.where(np.isnan(values), 0.5, (left + right) / (2.0 * len(history)))
+
+    def score(self, conn, houses, today=None, max_id=None):
+        """
+        计算每个房源的评分，并把 score、price_per_m2、price_per_m2_cheaper_than（比城市历史中百分之多少的房源便宜）
+        写入房源字典。
+        :param max_id: 新房源插入数据库前 houses 表的最大 id；加载城市历史时排除本批房源，避免与自己比较。
+        :return: 评分数组；未安装 numpy 或 houses 为空时返回 None。
+        """
+        np = _numpy()
+        if np is None or not houses:
+            return None
+        table = ListingTable(np, houses, today)
+        price_rank = np.empty(table.size)
+        area_rank = np.empty(table.size)
+        ppm2_rank = np.empty(table.size)
+        for code, city in enumerate(table.cities):
+            mask = table.city_codes == code
+            price_hist, area_hist, ppm2_hist = self._city_history(np, conn, str(city), max_id)
+            price_rank[mask] = self._percentile(np, price_hist, table.price[mask])
+            area_rank[mask] = self._percentile(np, area_hist, table.area[mask])
+            ppm2_rank[mask] = self._percentile(np, ppm2_hist, table.price_per_m2[mask])
+
+        horizon = max(self.settings["availability_horizon_days"], 1)
+        components = {
+            "price_per_m2": 1 - ppm2_rank,
+            "price": 1 - price_rank,
+            "area": area_rank,
+            "availability": np.nan_to_num(np.clip(1 - table.available_days / horizon, 0, 1), nan=0.5),
+            "rooms": np.nan_to_num(np.clip(table.rooms / MAX_ROOMS, 0, 1), nan=0.5),
+            "direct_booking": table.direct,
+        }
+        weights = self.settings["weights"]
+        total = sum(max(weights.get(name, 0), 0) for name in components) or 1.0
+        scores = sum(max(weights.get(name, 0), 0) * values for name, values in components.items()) * (100.0 / total)
+
+        for house, score, ppm2, rank in zip(houses, scores.tolist(), table.price_per_m2.tolist(), ppm2_rank.tolist()):
+            house["score"] = round(score, 1)
+            if ppm2 == ppm2:  # 非 NaN
+                house["price_per_m2"] = round(ppm2, 2)
+                house["price_per_m2_cheaper_than"] = round((1 - rank) * 100)
+        return scores
+
+    def select(self, houses):
+        """
+        按 score() 写入的评分从高到低排列房源，并按 max_per_city、min_score 截断；个别没有评分的房源排在最后且不会被
+        min_score 过滤。
+        :return: 保留的房源在 houses 中的下标列表；未启用评分或都没有评分时按原顺序返回全部下标。
+        """
+        if not self.settings["enabled"] or not any("score" in h for h in houses):
+            return list(range(len(houses)))
+        order = sorted(range(len(houses)), key=lambda i: -houses[i].get("score", -1))
+        min_score = self.settings["min_score"]
+        limit = self.settings["max_per_city"]
+        kept = []
+        per_city = {}
+        for i in order:
+            house = houses[i]
+            if house.get("score", min_score) < min_score:
+                continue
+            city = str(house.get("city"))
+            if limit is not None and per_city.get(city, 0) >= limit:
+                continue
+            per_city[city] = per_city.get(city, 0) + 1
+            kept.append(i)
+        return kept
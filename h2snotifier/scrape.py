@@ -1,15 +1,138 @@
 import logging
+import os
+import time
 
-import requests
-import cloudscraper  # 导入 cloudscraper
+import ratelimit
+from logging_config import log_event
 
-from dotenv import dotenv_values
+# cloudscraper 导入较慢，延迟到 scrape() 中首次使用时再导入
 
-env = dotenv_values(".env")
-TELEGRAM_API_KEY = env.get("TELEGRAM_API_KEY")
-DEBUGGING_CHAT_ID = env.get("DEBUGGING_CHAT_ID")
+API_URL = "https://api.holland2stay.com/graphql/"
 
 
+def get_api_url(api_url=None):
+    """GraphQL 接口地址：优先使用参数，其次环境变量 H2S_API_URL（可指向本地 mock_upstream.py），最后使用官方地址"""
+    return api_url or os.environ.get("H2S_API_URL") or API_URL
+
+# 添加请求头以模拟真实浏览器
+HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/121.0.0.0 Safari/537.36',
+    'Accept': 'application/json, text/plain, */*',
+    'Accept-Language': 'zh-CN,zh;q=0.9,en;q=0.8',
+    'Origin': 'https://holland2stay.com',
+    'Referer': 'https://holland2stay.com/residences.html',
+    'sec-ch-ua': '"Google Chrome";v="121", "Not A(Brand";v="99", "Chromium";v="121"',
+    'sec-ch-ua-mobile': '?0',
+    'sec-ch-ua-platform': '"macOS"',
+    'Connection': 'keep-alive'
+}
+
+PRODUCTS_FRAGMENT = """
+fragment ProductsFragment on Products {
+  items {
+    name
+    sku
+    city
+    url_key
+    available_to_book
+    available_startdate
+    building_name
+    finishing
+    living_area
+    no_of_rooms
+    resident_type
+    offer_text_two
+    offer_text
+    maximum_number_of_persons
+    type_of_contract
+    price_analysis_text
+    allowance_price
+    floor
+    basic_rent
+    lumpsum_service_charge
+    inventory
+    caretaker_costs
+    cleaning_common_areas
+    energy_common_areas
+    allowance_price
+    small_image {
+      url
+      label
+      position
+      disabled
+      __typename
+    }
+    thumbnail {
+      url
+      label
+      position
+      disabled
+      __typename
+    }
+    image {
+      url
+      label
+      position
+      disabled
+      __typename
+    }
+    media_gallery {
+      url
+      label
+      position
+      disabled
+      __typename
+    }
+    price_range {
+      minimum_price {
+        regular_price {
+          value
+          currency
+          __typename
+        }
+        final_price {
+          value
+          currency
+          __typename
+        }
+        discount {
+          amount_off
+          percent_off
+          __typename
+        }
+        __typename
+      }
+      maximum_price {
+        regular_price {
+          value
+          currency
+          __typename
+        }
+        final_price {
+          value
+          currency
+          __typename
+        }
+        discount {
+          amount_off
+          percent_off
+          __typename
+        }
+        __typename
+      }
+      __typename
+    }
+    __typename
+  }
+  page_info {
+    total_pages
+    __typename
+  }
+  total_count
+  __typename
+}
+"""
+
 def generate_payload(cities, page_size):
     payload = {
         "operationName": "GetCategories",
@@ -53,114 +176,113 @@ def generate_payload(cities, page_size):
               __typename
             }
 
-            fragment ProductsFragment on Products {
-              items {
-                name
-                sku
-                city
-                url_key
-                available_to_book
-                available_startdate
-                building_name
-                finishing
-                living_area
-                no_of_rooms
-                resident_type
-                offer_text_two
-                offer_text
-                maximum_number_of_persons
-                type_of_contract
-                price_analysis_text
-                allowance_price
-                floor
-                basic_rent
-                lumpsum_service_charge
-                inventory
-                caretaker_costs
-                cleaning_common_areas
-                energy_common_areas
-                allowance_price
-                small_image {
-                  url
-                  label
-                  position
-                  disabled
-                  __typename
-                }
-                thumbnail {
-                  url
-                  label
-                  position
-                  disabled
-                  __typename
-                }
-                image {
-                  url
-                  label
-                  position
-                  disabled
-                  __typename
-                }
-                media_gallery {
-                  url
-                  label
-                  position
-                  disabled
-                  __typename
-                }
-                price_range {
-                  minimum_price {
-                    regular_price {
-                      value
-                      currency
-                      __typename
-                    }
-                    final_price {
-                      value
-                      currency
-                      __typename
-                    }
-                    discount {
-                      amount_off
-                      percent_off
-                      __typename
-                    }
-                    __typename
-                  }
-                  maximum_price {
-                    regular_price {
-                      value
-                      currency
-                      __typename
-                    }
-                    final_price {
-                      value
-                      currency
-                      __typename
-                    }
-                    discount {
-                      amount_off
-                      percent_off
-                      __typename
-                    }
-                    __typename
-                  }
-                  __typename
-                }
-                __typename
-              }
-              page_info {
-                total_pages
-                __typename
-              }
-              total_count
-              __typename
-            }
-        """,
+        """ + PRODUCTS_FRAGMENT,
     }
     return payload
 
 
+def make_query(cities, only_direct_booking=True, page_size=100):
+    """
+    生成一个独立的房源查询描述，可与其他查询一起打包进同一个 GraphQL 请求。
+    :param cities: 城市ID列表。
+    :param only_direct_booking: 为 True 时只在服务端查询可直接预定的房源。
+    :param page_size: 每页数量，超过一页时会自动翻页。
+    """
+    booking_types = ["179"] if only_direct_booking else ["179", "336"]
+    return {
+        "cities": sorted(str(c) for c in cities),
+        "available_to_book": booking_types,
+        "only_direct_booking": only_direct_booking,
+        "page_size": page_size,
+    }
+
+
+def query_key(query):
+    """查询的去重键：城市和预订方式相同的查询只需发送一次"""
+    return tuple(query["cities"]), tuple(query["available_to_book"])
+
+
+def generate_batch_payload(entries):
+    """
+    用字段别名把多个 products 查询打包进一个 GraphQL 文档。
+    :param entries: (alias, query, page) 列表，alias 必须是合法的 GraphQL 名称。
+    :return: 可直接 POST 的请求体。
+    """
+    variable_defs = ["$sort: ProductAttributeSortInput"]
+    fields = []
+    variables = {"sort": {"available_startdate": "ASC"}}
+    for alias, query, page in entries:
+        variable_defs.append(
+            f"$filters_{alias}: ProductAttributeFilterInput!, $size_{alias}: Int!, $page_{alias}: Int!"
+        )
+        fields.append(
+            f"  {alias}: products(pageSize: $size_{alias}, currentPage: $page_{alias}, "
+            f"filter: $filters_{alias}, sort: $sort) {{\n    ...ProductsFragment\n    __typename\n  }}"
+        )
+        variables[f"filters_{alias}"] = {
+            "available_to_book": {"in": query["available_to_book"]},
+            "city": {"in": query["cities"]},
+            "category_uid": {"eq": "Nw=="},
+        }
+        variables[f"size_{alias}"] = query["page_size"]
+        variables[f"page_{alias}"] = page
+
+    document = (
+        f"query GetCategories({', '.join(variable_defs)}) {{\n"
+        + "\n".join(fields)
+        + "\n}\n"
+        + PRODUCTS_FRAGMENT
+    )
+    return {"operationName": "GetCategories", "variables": variables, "query": document}
+
+
+# 打包请求失败时，其中每个查询最多随拆小的请求重试几次；重试前等待的秒数（每次重试翻倍）
+MAX_BATCH_SPLITS = 1
+RETRY_BACKOFF_SECONDS = 2.0
+
+
+class BatchSizer:
+    """
+    根据响应耗时和响应大小自适应调整每个请求打包的查询数（加性增、乘性减）。
+    模块级的默认实例会在多轮检查之间保留调整结果。
+    """
+
+    def __init__(self, initial=8, max_size=16, target_latency=5.0, max_response_bytes=2 * 1024 * 1024):
+        self.size = initial
+        self.max_size = max_size
+        self.target_latency = target_latency
+        self.max_response_bytes = max_response_bytes
+
+    def record(self, queries, latency, response_bytes):
+        """记录一次成功请求的耗时和大小，并据此调整批大小"""
+        per_query_bytes = response_bytes / max(queries, 1)
+        if latency > self.target_latency or response_bytes > self.max_response_bytes:
+            self.size = max(1, min(self.size, queries) // 2)
+        elif latency < self.target_latency / 2 and response_bytes + per_query_bytes <= self.max_response_bytes:
+            self.size = min(self.max_size, self.size + 1)
+        if per_query_bytes:
+            self.size = max(1, min(self.size, int(self.max_response_bytes // per_query_bytes)))
+
+    def shrink(self, queries):
+        """请求失败时把批大小减半"""
+        self.size = max(1, min(self.size, queries) // 2)
+
+
+_default_sizer = BatchSizer()
+
+# 在多轮检查之间（以及通过 snapshot.py 在重启之间）保留的会话 cookie，例如 Cloudflare 的 cf_clearance
+_session_cookies = {}
+
+
+def get_session_cookies():
+    return dict(_session_cookies)
+
+
+def set_session_cookies(cookies):
+    _session_cookies.clear()
+    _session_cookies.update(cookies or {})
+
+
 CITY_IDS = {
     "24": "Amsterdam",
     "320": "Arnhem",
@@ -262,20 +384,41 @@ def clean_img(url):
         ci = parts.index('cache')
         return '/'.join(parts[:ci] + parts[ci + 2:])
     except Exception as error:
-        logging.error("Error in cleaning image URL")
-        logging.error(url)
-        logging.error(str(error))
+        log_event("image.clean_failed", "Error in cleaning image URL", level=logging.ERROR, sample=True,
+                  url=url, error=repr(error))
+
+
+def to_number(value):
+    """把接口返回的数字（可能是字符串，可能用逗号作小数点）转换为 float，无法转换时返回 None"""
+    try:
+        return float(str(value).replace(",", "."))
+    except (TypeError, ValueError):
+        return None
+
+
+def _format_euro(value):
+    return f"{value:,}€" if value is not None else "N/A"
 
 
 def house_to_msg(house):
     booking_type = "可直接预定" if house.get('direct_booking') else "需要抽签"
+    price_inc = to_number(house.get('price_inc'))
+    area = to_number(house.get('area'))
+    # scoring.py 已计算每平米价格时直接使用，否则在这里计算；面积缺失或为 0 时不显示
+    per_m2 = house.get('price_per_m2')
+    if per_m2 is None and price_inc is not None and area:
+        per_m2 = price_inc / area
+    per_m2_text = f"{per_m2:.2f} €/m²" if per_m2 is not None else "N/A"
+    if house.get('price_per_m2_cheaper_than') is not None:
+        per_m2_text += f" (cheaper than {house['price_per_m2_cheaper_than']}% of recent listings in this city)"
+    score_line = f"\nScore: {house['score']:.1f}/100" if house.get('score') is not None else ""
     return f"""
 New house in #{city_id_to_city(house['city'])}!
 {url_key_to_link(house['url_key'])}
 
 Living area: {house['area']}m²
-Price: {float(house['price_inc'].replace(',', '.')):,}€ (excl. {float(house['price_exc'].replace(',', '.')):,}€ basic rent)
-Price per meter: {float(float(house['price_inc']) / float(house['area'])):.2f} €\\m²
+Price: {_format_euro(price_inc)} (excl. {_format_euro(to_number(house.get('price_exc')))} basic rent)
+Price per meter: {per_m2_text}{score_line}
 
 Available from: {house['available_from']}
 Bedrooms: {house['rooms']}
@@ -286,130 +429,314 @@ Contract type: {house['contract_type']}
 # See details and apply on Holland2Stay website."""
 
 
-# Define the GraphQL query payload
-def scrape(cities=[], page_size=30, only_direct_booking=True):
-    logging.info(f"开始爬取网页，城市IDs: {cities}, 每页数量: {page_size}, 仅显示可直接预定: {only_direct_booking}")
-
-    payload = generate_payload(cities, page_size)
-    try:
-        # 添加请求头以模拟真实浏览器
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/121.0.0.0 Safari/537.36',
-            'Accept': 'application/json, text/plain, */*',
-            'Accept-Language': 'zh-CN,zh;q=0.9,en;q=0.8',
-            'Origin': 'https://holland2stay.com',
-            'Referer': 'https://holland2stay.com/residences.html',
-            'sec-ch-ua': '"Google Chrome";v="121", "Not A(Brand";v="99", "Chromium";v="121"',
-            'sec-ch-ua-mobile': '?0',
-            'sec-ch-ua-platform': '"macOS"',
-            'Connection': 'keep-alive'
-        }
-
-        logging.info("创建 cloudscraper 实例...")
-        scraper = cloudscraper.create_scraper()  # 使用 cloudscraper 创建 scraper
+def parse_products(items, cities, only_direct_booking=True, cities_dict=None):
+    """
+    把 API 返回的 products.items 转换为按城市分组的房源字典。
+    :return: (cities_dict, 可直接预定数量, 需要抽签数量)
+    """
+    if cities_dict is None:
+        cities_dict = {c: [] for c in cities}
 
-        logging.info("开始发送 POST 请求到 Holland2Stay API...")
-        response = scraper.post(
-            "https://api.holland2stay.com/graphql/",
-            json=payload,
-            headers=headers,
-            timeout=30  # 增加超时时间
-        )
+    direct_booking_count = 0
+    lottery_count = 0
 
-        # 检查响应状态码
-        if response.status_code != 200:
-            logging.error(f"API请求失败，状态码: {response.status_code}")
-            logging.error(f"响应内容: {response.text[:500]}")  # 只打印前500个字符
-            return {}
+    for house in items:
+        city_id = str(house.get("city"))
+        try:
+            # 判断房源是否可以直接预定
+            booking_type_id = house.get("available_to_book")
+            direct_booking = is_direct_booking(booking_type_id)
+
+            # 记录统计信息
+            if direct_booking:
+                direct_booking_count += 1
+            else:
+                lottery_count += 1
+
+            # 如果设置了only_direct_booking且不是直接预定的房源，则跳过
+            if only_direct_booking and not direct_booking:
+                continue
+
+            cleaned_images = [clean_img(img['url']) for img in house.get('media_gallery') or []]
+
+            # For now, this image is making an issue. Maybe we need to add similar images later
+            cleaned_images = list(filter(lambda x: x is not None and "logo-blue-1.jpg" not in x, cleaned_images))
+
+            cities_dict[city_id].append(
+                {
+                    "url_key": house["url_key"],
+                    "city": str(house["city"]),
+                    "area": str(house["living_area"]).replace(",", "."),
+                    "price_exc": str(house["basic_rent"]),
+                    "price_inc": str(
+                        house["price_range"]["maximum_price"]["final_price"]["value"]
+                    ),
+                    "available_from": house["available_startdate"],
+                    "max_register": str(
+                        max_register_id_to_str(str(house["maximum_number_of_persons"])),
+                    ),
+                    "contract_type": contract_type_id_to_str(
+                        str(house["type_of_contract"])
+                    ),
+                    "rooms": room_id_to_room(str(house["no_of_rooms"])),
+                    "images": cleaned_images,
+                    "booking_type": booking_type_id_to_str(booking_type_id),
+                    "direct_booking": direct_booking
+                }
+            )
+            log_event("house.parsed", level=logging.DEBUG, sample=True,
+                      city=city_id, url_key=house["url_key"], stage="parse")
+        except Exception as err:
+            # 只记录定位所需的字段，不再输出整个房源字典
+            log_event("house.parse_failed", "Error in parsing house", level=logging.ERROR, sample=True,
+                      city=city_id, url_key=house.get("url_key"), sku=house.get("sku"),
+                      stage="parse", error=repr(err), exc_info=True)
+
+    return cities_dict, direct_booking_count, lottery_count
+
+
+def _post_batch(scraper, entries, api_url):
+    """
+    发送一个打包请求。
+    :return: (别名 -> products 数据的字典, 响应字节数, None)；请求整体失败时返回 (None, 0, 失败原因)，
+             失败原因为 HTTP 状态码或 "exception"、"bad_json"、"bad_response"。
+    """
+    payload = generate_batch_payload(entries)
+    fetch_started = time.perf_counter()
+    try:
+        response = scraper.post(api_url, json=payload, headers=HEADERS, timeout=30)
+    except Exception as request_err:
+        log_event("scrape.request_failed", f"请求异常: {request_err}", level=logging.ERROR,
+                  stage="fetch", queries=len(entries), error=repr(request_err),
+                  duration=round(time.perf_counter() - fetch_started, 3))
+        return None, 0, "exception"
+    fetch_duration = round(time.perf_counter() - fetch_started, 3)
+
+    # 检查响应状态码
+    if response.status_code != 200:
+        log_event("scrape.http_error", f"API请求失败，状态码: {response.status_code}", level=logging.ERROR,
+                  stage="fetch", status=response.status_code, queries=len(entries), duration=fetch_duration,
+                  body=response.text[:500])  # 只记录前500个字符
+        return None, 0, response.status_code
+
+    response_bytes = len(response.content)
+    log_event("scrape.fetched", f"成功获取API响应，包含 {len(entries)} 个查询", stage="fetch",
+              status=response.status_code, queries=len(entries), bytes=response_bytes, duration=fetch_duration)
 
-        logging.info("成功获取API响应，开始解析数据...")
+    try:
+        json_data = response.json()
+    except ValueError as json_err:
+        log_event("scrape.bad_json", f"JSON解析错误: {json_err}", level=logging.ERROR,
+                  stage="parse", body=response.text[:500])  # 只记录前500个字符
+        return None, 0, "bad_json"
+
+    if not isinstance(json_data, dict) or not json_data.get("data"):
+        log_event("scrape.bad_response", "API响应中没有'data'字段", level=logging.ERROR,
+                  stage="parse", errors=json_data.get("errors") if isinstance(json_data, dict) else None)
+        return None, 0, "bad_response"
+
+    if json_data.get("errors"):
+        # 部分别名出错时其余别名的数据仍然可用
+        log_event("scrape.partial_errors", "API响应中包含部分错误", level=logging.WARNING,
+                  stage="parse", errors=json_data["errors"][:5])
+
+    return json_data["data"], response_bytes, None
+
+
+async def iter_scrape_batch(queries, sizer=None, api_url=None, concurrency=1, executor=None, hot_cities=()):
+    """
+    把多个独立查询打包成尽量少的 HTTP 请求，最多 concurrency 个请求同时进行（在 executor 的线程中发送），
+    每个查询的所有分页获取完成后立即产出结果，不必等待其他查询。
+    每个请求包含的查询数由 BatchSizer 根据耗时和响应大小自适应调整，
+    需要翻页的查询在第一页返回总页数后，其余分页会在后续请求中并发获取。
+    每个请求发送前都要从上游主机的令牌桶（ratelimit.host_bucket）中取得令牌；包含热门城市的查询排在前面，
+    并在限流器中使用高优先级通道。
+    打包请求失败时拆小后重试：每个查询最多重试 MAX_BATCH_SPLITS 次，重试前按 RETRY_BACKOFF_SECONDS 退避；
+    只包含一个查询的请求同样退避重试；重试后仍以相同原因失败时，说明问题与打包大小无关（上游故障或验证页面），
+    该原因的请求不再拆分重试。
+    :param queries: make_query() 生成的查询列表，重复的查询只会发送一次。
+    :param sizer: BatchSizer 实例，默认使用模块级共享实例。
+    :param api_url: GraphQL 接口地址，默认见 get_api_url()。
+    :param executor: 发送请求的线程池，默认使用事件循环的默认线程池。
+    :param hot_cities: 热门城市ID集合。
+    :return: 异步生成器，产出 (query_key(query), 按城市分组的房源字典)。获取失败（含翻页不完整）的查询
+             产出 (key, None)，避免不完整的数据被当作房源下架。
+    """
+    import asyncio
+    import threading
+
+    sizer = sizer or _default_sizer
+    api_url = get_api_url(api_url)
+    started = time.perf_counter()
+
+    unique = {}
+    for query in queries:
+        unique.setdefault(query_key(query), query)
+    if not unique:
+        return
+
+    import cloudscraper
+
+    limiter = ratelimit.host_bucket(api_url)
+    hot_cities = {str(c) for c in hot_cities}
+    lanes = {key: ratelimit.HIGH if hot_cities.intersection(key[0]) else ratelimit.NORMAL for key in unique}
+
+    # cloudscraper 会话不保证线程安全：每个线程在本轮检查中复用自己的会话，cookie 通过 _session_cookies 共享
+    sessions = threading.local()
+
+    def post(entries, lane):
+        scraper = getattr(sessions, "scraper", None)
+        if scraper is None:
+            session_started = time.perf_counter()
+            scraper = sessions.scraper = cloudscraper.create_scraper()
+            jar = getattr(scraper, "cookies", None)
+            if jar is not None and _session_cookies:
+                jar.update(_session_cookies)
+            log_event("scrape.session_ready", "cloudscraper 实例已创建", level=logging.DEBUG,
+                      stage="session", duration=round(time.perf_counter() - session_started, 3))
+        limiter.acquire(lane)
+        request_started = time.perf_counter()
+        data, response_bytes, failure = _post_batch(scraper, entries, api_url)
+        jar = getattr(scraper, "cookies", None)
+        if jar is not None:
+            _session_cookies.update(jar.get_dict())
+        return data, response_bytes, failure, time.perf_counter() - request_started
+
+    loop = asyncio.get_running_loop()
+    results = {key: {c: [] for c in query["cities"]} for key, query in unique.items()}
+    pending = sorted(((key, 1) for key in unique), key=lambda item: lanes[item[0]])
+    outstanding = {key: 1 for key in unique}  # 每个查询尚未完成的分页数
+    inflight = {}
+    delayed = []       # 等待退避后重试的 (重试时间, chunk, 失败原因)
+    retries = {}       # 查询 -> 已重试次数
+    fatal = set()      # 单个查询的请求也失败的原因，以这些原因失败的请求不再重试
+    requests_sent = 0
+    failed = 0
+    direct_total = 0
+    lottery_total = 0
+
+    def give_up(chunk, reason):
+        """:return: 本次新标记为失败的查询"""
+        keys = [key for key in dict.fromkeys(key for key, _ in chunk) if results.pop(key, None) is not None]
+        if keys:
+            log_event("scrape.retry_exhausted", f"{len(keys)} 个查询获取失败，不再重试", level=logging.WARNING,
+                      stage="fetch", queries=len(keys), reason=reason)
+        return keys
+
+    while pending or inflight or delayed:
+        now = loop.time()
+        for item in [item for item in delayed if item[0] <= now]:
+            delayed.remove(item)
+            _, chunk, reason = item
+            if reason in fatal:
+                for key in give_up(chunk, reason):
+                    failed += 1
+                    yield key, None
+            else:
+                pending = chunk + pending
+
+        while pending and len(inflight) < concurrency:
+            # 已失败查询的剩余分页不再发送
+            chunk = [(key, page) for key, page in pending[:sizer.size] if key in results]
+            pending = pending[sizer.size:]
+            if not chunk:
+                continue
+            entries = [(f"q{i}", unique[key], page) for i, (key, page) in enumerate(chunk)]
+            lane = min(lanes[key] for key, _ in chunk)
+            inflight[loop.run_in_executor(executor, post, entries, lane)] = (chunk, entries)
+            requests_sent += 1
+
+        if not inflight:
+            if delayed:
+                await asyncio.sleep(max(min(item[0] for item in delayed) - loop.time(), 0))
+            continue
+        timeout = max(min(item[0] for item in delayed) - loop.time(), 0) if delayed else None
+        done, _ = await asyncio.wait(inflight, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+        for future in done:
+            chunk, entries = inflight.pop(future)
+            data, response_bytes, failure, latency = future.result()
+
+            if data is None:
+                if failure in fatal:
+                    exhausted, retry = chunk, []
+                else:
+                    # 拆小后退避重试，避免一个过大的请求拖垮整批；每个查询最多重试 MAX_BATCH_SPLITS 次。
+                    # 单个查询的请求同样退避重试一次，避免一次偶发的 502 让本轮所有以相同原因失败的请求都放弃
+                    if len(chunk) > 1:
+                        sizer.shrink(len(chunk))
+                    exhausted = [item for item in chunk if retries.get(item[0], 0) >= MAX_BATCH_SPLITS]
+                    retry = [item for item in chunk if retries.get(item[0], 0) < MAX_BATCH_SPLITS]
+                    if len(chunk) == 1 and exhausted:
+                        # 重试过的单个查询请求仍然失败，说明问题与打包大小无关
+                        fatal.add(failure)
+                for key in give_up(exhausted, failure):
+                    failed += 1
+                    yield key, None
+                if retry:
+                    attempt = max(retries.get(key, 0) for key, _ in retry)
+                    for key, _ in retry:
+                        retries[key] = retries.get(key, 0) + 1
+                    delayed.append((loop.time() + RETRY_BACKOFF_SECONDS * 2 ** attempt, retry, failure))
+                continue
+            sizer.record(len(chunk), latency, response_bytes)
+
+            for alias, query, page in entries:
+                key = query_key(query)
+                products = data.get(alias)
+                if not products or "items" not in products:
+                    log_event("scrape.bad_response", "API响应格式不符合预期", level=logging.ERROR,
+                              stage="parse", alias=alias, cities=query["cities"])
+                    if results.pop(key, None) is not None:
+                        failed += 1
+                        yield key, None
+                    continue
+                if key not in results:
+                    continue  # 该查询的其他分页已失败
+                _, direct, lottery = parse_products(
+                    products["items"], query["cities"], query["only_direct_booking"], results[key]
+                )
+                direct_total += direct
+                lottery_total += lottery
+                outstanding[key] -= 1
+                if page == 1:
+                    # 知道总页数后一次性排入剩余分页，分页之间可以并发获取
+                    total_pages = (products.get("page_info") or {}).get("total_pages") or 1
+                    pending.extend((key, p) for p in range(2, total_pages + 1))
+                    pending.sort(key=lambda item: lanes[item[0]])
+                    outstanding[key] += total_pages - 1
+                if outstanding[key] == 0:
+                    yield key, results.pop(key)
+
+    log_event("scrape.done",
+              f"{len(unique)} 个查询共发送 {requests_sent} 个请求，可直接预定: {direct_total}，需要抽签: {lottery_total}",
+              stage="scrape", queries=len(unique), requests=requests_sent, failed=failed,
+              batch_size=sizer.size, concurrency=concurrency, direct=direct_total, lottery=lottery_total,
+              duration=round(time.perf_counter() - started, 3))
+
+
+def scrape_batch(queries, sizer=None, api_url=None):
+    """
+    同步版本的 iter_scrape_batch()：请求依次发送，全部完成后一起返回。
+    :return: query_key(query) -> 按城市分组的房源字典。获取失败（含翻页不完整）的查询不会出现在结果中。
+    """
+    import asyncio
+
+    async def collect():
+        return {key: result async for key, result in iter_scrape_batch(queries, sizer, api_url)
+                if result is not None}
+
+    return asyncio.run(collect())
 
-        # 尝试解析JSON并添加错误处理
-        try:
-            json_data = response.json()
-            if "data" not in json_data:
-                logging.error(f"API响应中没有'data'字段: {json_data}")
-                return {}
-
-            data = json_data["data"]
-            cities_dict = {}
-            for c in cities:
-                cities_dict[c] = []
-
-            # 检查products是否存在
-            if "products" not in data or "items" not in data["products"]:
-                logging.error(f"API响应格式不符合预期: {data}")
-                return cities_dict
-
-            total_houses = len(data["products"]["items"])
-            logging.info(f"获取到 {total_houses} 个房源")
-
-            direct_booking_count = 0
-            lottery_count = 0
-
-            for house in data["products"]["items"]:
-                city_id = str(house["city"])
-                try:
-                    # 判断房源是否可以直接预定
-                    booking_type_id = house.get("available_to_book")
-                    direct_booking = is_direct_booking(booking_type_id)
-
-                    # 记录统计信息
-                    if direct_booking:
-                        direct_booking_count += 1
-                    else:
-                        lottery_count += 1
-
-                    # 如果设置了only_direct_booking且不是直接预定的房源，则跳过
-                    if only_direct_booking and not direct_booking:
-                        continue
-
-                    cleaned_images = [clean_img(img['url']) for img in house.get('media_gallery', [])]
-
-                    # For now, this image is making an issue. Maybe we need to add similar images later
-                    cleaned_images = list(filter(lambda x: x is not None and "logo-blue-1.jpg" not in x, cleaned_images))
-
-                    cities_dict[city_id].append(
-                        {
-                            "url_key": house["url_key"],
-                            "city": str(house["city"]),
-                            "area": str(house["living_area"]).replace(",", "."),
-                            "price_exc": str(house["basic_rent"]),
-                            "price_inc": str(
-                                house["price_range"]["maximum_price"]["final_price"]["value"]
-                            ),
-                            "available_from": house["available_startdate"],
-                            "max_register": str(
-                                max_register_id_to_str(str(house["maximum_number_of_persons"])),
-                            ),
-                            "contract_type": contract_type_id_to_str(
-                                str(house["type_of_contract"])
-                            ),
-                            "rooms": room_id_to_room(str(house["no_of_rooms"])),
-                            "images": cleaned_images,
-                            "booking_type": booking_type_id_to_str(booking_type_id),
-                            "direct_booking": direct_booking
-                        }
-                    )
-                except Exception as err:
-                    logging.error("Error in parsing house")
-                    logging.error(str(err))
-                    logging.error(str(house))
-
-            # 记录每个城市的房源数量和预订类型统计
-            logging.info(f"预订方式统计：可直接预定: {direct_booking_count}，需要抽签: {lottery_count}")
-
-            for city_id, houses in cities_dict.items():
-                city_name = city_id_to_city(city_id) or city_id
-                logging.info(f"城市 {city_name}({city_id}) 找到 {len(houses)} 个满足条件的房源")
-
-            return cities_dict
-
-        except ValueError as json_err:
-            logging.error(f"JSON解析错误: {json_err}")
-            logging.error(f"响应内容: {response.text[:500]}")  # 只打印前500个字符
-            return {}
 
+# Define the GraphQL query payload
+def scrape(cities=[], page_size=30, only_direct_booking=True):
+    """抓取一组城市的房源，返回按城市分组的房源字典，失败时返回空字典"""
+    log_event("scrape.start", f"开始爬取网页，城市IDs: {cities}, 每页数量: {page_size}, 仅显示可直接预定: {only_direct_booking}",
+              cities=cities, page_size=page_size, only_direct_booking=only_direct_booking)
+    query = make_query(cities, only_direct_booking=only_direct_booking, page_size=page_size)
+    try:
+        return scrape_batch([query]).get(query_key(query), {})
     except Exception as request_err:
-        logging.error(f"请求异常: {request_err}")
+        log_event("scrape.request_failed", f"请求异常: {request_err}", level=logging.ERROR,
+                  stage="fetch", error=repr(request_err))
         return {}
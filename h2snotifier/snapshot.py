@@ -0,0 +1,270 @@
+"""
+快照缓存：把每个城市的在架房源、房源集合指纹、会话 cookie 和下次检查时间写入一个紧凑的二进制文件，
+重启后直接加载，第一轮检查不必再全表扫描 houses.db，也能沿用上次的 Cloudflare cookie。
+
+文件格式（小端，版本号不同或任何校验失败时回退到数据库）:
+
+    头部    magic(8) version(u16) reserved(u16) created_at(f64) last_event_id(i64)
+            last_house_id(i64) live_rows(i64) section_count(u32)
+    段表    section_count 个 (tag(4) offset(u64) length(u64) crc32(u32))
+    头部校验 crc32(u32)，覆盖头部和段表
+    STRS    字符串表: count(u32)，以 \\0 分隔的 UTF-8 字符串；所有字符串只存一份
+    CITY    每个城市一条定长记录: city(u32 字符串序号) first_row(u32) rows(u32) fingerprint(20)
+    ROWS    每个房源一条定长记录: url_key(u32) price_inc(u32) booking_type(u32)，0xFFFFFFFF 表示 None
+    META    JSON: cookies、schedule 等少量数据（包含 Cloudflare 会话 cookie，文件权限为 0600）
+
+定长记录可以在 mmap 上按偏移直接读取，加载时只解码实际用到的城市。
+"""
+import json
+import logging
+import mmap
+import os
+import struct
+import sys
+import time
+import zlib
+from array import array
+
+SNAPSHOT_PATH = "snapshot.bin"
+MAGIC = b"H2SSNAP\x00"
+VERSION = 1
+
+DEFAULT_SETTINGS = {
+    "enabled": True,
+    "path": SNAPSHOT_PATH,
+    "max_age_minutes": 180,  # 超过该时间的快照视为过期，回退到数据库
+}
+
+_HEADER = struct.Struct("<8sHHdqqqI")
+_SECTION = struct.Struct("<4sQQI")
+_CRC = struct.Struct("<I")
+_U32 = struct.Struct("<I")
+_CITY = struct.Struct("<III20s")
+_ROW = struct.Struct("<III")
+_NONE = 0xFFFFFFFF
+_NO_FINGERPRINT = b"\x00" * 20
+
+
+class SnapshotError(Exception):
+    """快照文件损坏、版本不符或与数据库不一致"""
+
+
+def db_state(conn):
+    """
+    用于判断快照是否与数据库一致的几个值：最后一个事件 id、最后一条房源 id、在架房源数。
+    三个查询都可以直接走主键或索引。
+    """
+    last_event_id = conn.execute("SELECT COALESCE(MAX(id), 0) FROM events").fetchone()[0]
+    last_house_id = conn.execute("SELECT COALESCE(MAX(id), 0) FROM houses").fetchone()[0]
+    live_rows = conn.execute("SELECT COUNT(*) FROM houses WHERE occupied_at IS NULL").fetchone()[0]
+    return last_event_id, last_house_id, live_rows
+
+
+class _StringTable:
+    def __init__(self):
+        self.index = {}
+        self.values = []
+
+    def add(self, value):
+        if value is None:
+            return _NONE
+        value = str(value)
+        i = self.index.get(value)
+        if i is None:
+            i = self.index[value] = len(self.values)
+            self.values.append(value)
+        return i
+
+    def encode(self):
+        return _U32.pack(len(self.values)) + "\0".join(self.values).encode("utf-8")
+
+
+def _pack_u32(values):
+    data = array("I", values)
+    if sys.byteorder != "little":
+        data.byteswap()
+    return data.tobytes()
+
+
+def encode_snapshot(listings, fingerprints, meta, state, created_at=None):
+    """
+    :param listings: city -> {url_key: (price_inc, booking_type)}，即 DiffEngine.snapshots。
+    :param fingerprints: city -> 20 字节的房源集合指纹。
+    :param meta: 可 JSON 序列化的附加数据（cookie、调度时间等）。
+    :param state: db_state(conn) 的结果。
+    :return: 快照文件内容。
+    """
+    strings = _StringTable()
+    cities = []
+    rows = []
+    for city in sorted(listings):
+        houses = listings[city]
+        add = strings.add
+        for url_key, (price, booking) in houses.items():
+            rows += (add(url_key), add(price), add(booking))
+        cities.append(_CITY.pack(add(city), len(rows) // 3 - len(houses), len(houses),
+                                 fingerprints.get(city) or _NO_FINGERPRINT))
+
+    sections = [
+        (b"STRS", strings.encode()),
+        (b"CITY", b"".join(cities)),
+        (b"ROWS", _pack_u32(rows)),
+        (b"META", json.dumps(meta, ensure_ascii=False, sort_keys=True).encode("utf-8")),
+    ]
+    offset = _HEADER.size + _SECTION.size * len(sections) + _CRC.size
+    table = []
+    for tag, data in sections:
+        table.append(_SECTION.pack(tag, offset, len(data), zlib.crc32(data)))
+        offset += len(data)
+    head = _HEADER.pack(MAGIC, VERSION, 0, created_at or time.time(), *state, len(sections)) + b"".join(table)
+    return b"".join([head, _CRC.pack(zlib.crc32(head)), *(data for _, data in sections)])
+
+
+def write_snapshot(path, data):
+    """
+    原子写入：先写临时文件并 fsync，再用 os.replace 替换，读取方不会看到写了一半的文件。
+    快照中有会话 cookie，临时文件以 0600 权限创建，替换后的快照文件只有当前用户可读。
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    tmp = f"{path}.tmp"
+    fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    # 临时文件可能是旧版本留下的，权限不受 os.open 的 mode 影响
+    os.fchmod(fd, 0o600)
+    with os.fdopen(fd, "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+    try:
+        fd = os.open(directory, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+class Snapshot:
+    """以 mmap 方式打开的快照文件，构造时校验头部和所有段的 CRC，房源按城市按需解码"""
+
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            if size < _HEADER.size:
+                raise SnapshotError("文件过短")
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            self._parse()
+        except (struct.error, UnicodeDecodeError, ValueError) as e:
+            self.close()
+            raise SnapshotError(f"格式错误: {e}") from e
+        except SnapshotError:
+            self.close()
+            raise
+
+    def _parse(self):
+        view = memoryview(self._mmap)
+        magic, version, _, self.created_at, *state, count = _HEADER.unpack_from(view, 0)
+        if magic != MAGIC:
+            raise SnapshotError("不是快照文件")
+        if version != VERSION:
+            raise SnapshotError(f"版本 {version} 与当前版本 {VERSION} 不符")
+        self.state = tuple(state)
+        table_end = _HEADER.size + _SECTION.size * count
+        (crc,) = _CRC.unpack_from(view, table_end)
+        if zlib.crc32(view[:table_end]) != crc:
+            raise SnapshotError("头部校验失败")
+
+        sections = {}
+        for i in range(count):
+            tag, offset, length, crc = _SECTION.unpack_from(view, _HEADER.size + i * _SECTION.size)
+            if offset + length > len(view):
+                raise SnapshotError(f"段 {tag!r} 超出文件范围")
+            data = view[offset:offset + length]
+            if zlib.crc32(data) != crc:
+                raise SnapshotError(f"段 {tag!r} 校验失败")
+            sections[tag] = data
+        missing = {b"STRS", b"CITY", b"ROWS", b"META"} - sections.keys()
+        if missing:
+            raise SnapshotError(f"缺少段 {sorted(missing)}")
+
+        strs = sections[b"STRS"]
+        (n,) = _U32.unpack_from(strs, 0)
+        # 字符串表一次性解码（一次 C 层的 decode + split），行数据仍按城市按需解码
+        self._strings = bytes(strs[4:]).decode("utf-8").split("\0") if n else []
+        if len(self._strings) != n:
+            raise SnapshotError("字符串表长度不符")
+        self._rows = sections[b"ROWS"]
+
+        self.cities = {}
+        for city_idx, first, rows, fingerprint in _CITY.iter_unpack(sections[b"CITY"]):
+            if (first + rows) * _ROW.size > len(self._rows):
+                raise SnapshotError("城市记录超出范围")
+            self.cities[self._string(city_idx)] = (first, rows, fingerprint if fingerprint != _NO_FINGERPRINT else None)
+        self.meta = json.loads(bytes(sections[b"META"]).decode("utf-8"))
+
+    def _string(self, i):
+        return None if i == _NONE else self._strings[i]
+
+    def listings(self, city):
+        """返回城市的 {url_key: (price_inc, booking_type)}；快照中没有该城市时返回 None"""
+        entry = self.cities.get(city)
+        if entry is None:
+            return None
+        first, rows, _ = entry
+        strings = self._strings
+        result = {}
+        for url_key, price, booking in _ROW.iter_unpack(self._rows[first * _ROW.size:(first + rows) * _ROW.size]):
+            result[strings[url_key]] = (strings[price] if price != _NONE else None,
+                                        strings[booking] if booking != _NONE else None)
+        return result
+
+    def fingerprint(self, city):
+        entry = self.cities.get(city)
+        return entry[2] if entry else None
+
+    @property
+    def age_seconds(self):
+        return time.time() - self.created_at
+
+    def close(self):
+        if self._mmap is None:
+            return
+        # 释放 memoryview 之后才能关闭 mmap
+        self._rows = None
+        try:
+            self._mmap.close()
+        except BufferError:
+            pass
+        self._mmap = None
+
+
+def load_snapshot(conn, path, max_age_seconds):
+    """
+    打开快照并检查是否可用：文件完整、版本相同、未过期，且数据库自快照写入后没有被其他程序修改。
+    :return: Snapshot；不可用时记录原因并返回 None，调用方回退到从数据库加载。
+    """
+    if not os.path.exists(path):
+        logging.info("未找到快照文件，从数据库加载房源")
+        return None
+    started = time.perf_counter()
+    try:
+        snapshot = Snapshot(path)
+    except (OSError, SnapshotError) as e:
+        logging.warning(f"快照文件不可用，从数据库加载房源: {e}")
+        return None
+    if snapshot.age_seconds > max_age_seconds:
+        logging.info(f"快照已过期（{snapshot.age_seconds / 60:.0f} 分钟前写入），从数据库加载房源")
+        snapshot.close()
+        return None
+    state = db_state(conn)
+    if snapshot.state != state:
+        logging.warning(f"快照与数据库不一致（快照 {snapshot.state}，数据库 {state}），从数据库加载房源")
+        snapshot.close()
+        return None
+    logging.info(f"已加载快照：{len(snapshot.cities)} 个城市，{snapshot.age_seconds:.0f} 秒前写入，"
+                 f"耗时 {(time.perf_counter() - started) * 1000:.1f} 毫秒")
+    return snapshot
@@ -0,0 +1,252 @@
+import logging
+from bisect import bisect_left, bisect_right
+
+
+def _to_float(value):
+    try:
+        return float(str(value).replace(",", "."))
+    except (TypeError, ValueError):
+        return None
+
+
+def _to_date(value):
+    # available_from 为 ISO 日期字符串，只取日期部分即可直接按字符串比较
+    return str(value)[:10] if value else None
+
+
+class Subscription:
+    """
+    一个订阅者（监控组）的筛选条件。未设置的条件表示不限制。
+    """
+
+    def __init__(self, name, cities, min_price=None, max_price=None, min_area=None, rooms=None,
+                 contract_types=None, max_register=None, available_from=None, available_to=None,
+                 only_direct_booking=False):
+        self.name = name
+        self.cities = {str(c) for c in cities}
+        self.min_price = min_price
+        self.max_price = max_price
+        self.min_area = min_area
+        self.rooms = set(rooms) if rooms else None
+        self.contract_types = set(contract_types) if contract_types else None
+        self.max_register = set(max_register) if max_register else None
+        self.available_from = _to_date(available_from)
+        self.available_to = _to_date(available_to)
+        self.only_direct_booking = only_direct_booking
+
+    @classmethod
+    def from_config(cls, group, only_direct_booking=True, max_price=None):
+        """
+        从 config.json 中的监控组创建订阅，全局的 only_direct_booking 和 max_price 作为默认值。
+        组内可选的 "filters" 支持: min_price, max_price, min_area, rooms, contract_type,
+        max_register, available_from, available_to。
+        """
+        filters = group.get("filters", {})
+        return cls(
+            name=group.get("name", "未命名组"),
+            cities=group.get("cities", []),
+            min_price=filters.get("min_price"),
+            max_price=filters.get("max_price", group.get("max_price", max_price)),
+            min_area=filters.get("min_area"),
+            rooms=filters.get("rooms"),
+            contract_types=filters.get("contract_type"),
+            max_register=filters.get("max_register"),
+            available_from=filters.get("available_from"),
+            available_to=filters.get("available_to"),
+            only_direct_booking=group.get("only_direct_booking", only_direct_booking),
+        )
+
+    def matches(self, house):
+        """逐条件判断房源是否满足订阅，作为索引的参照实现"""
+        if str(house.get("city")) not in self.cities:
+            return False
+        if self.only_direct_booking and not house.get("direct_booking"):
+            return False
+        price = _to_float(house.get("price_inc"))
+        if self.min_price is not None and (price is None or price < self.min_price):
+            return False
+        if self.max_price is not None and (price is None or price > self.max_price):
+            return False
+        area = _to_float(house.get("area"))
+        if self.min_area is not None and (area is None or area < self.min_area):
+            return False
+        if self.rooms is not None and house.get("rooms") not in self.rooms:
+            return False
+        if self.contract_types is not None and house.get("contract_type") not in self.contract_types:
+            return False
+        if self.max_register is not None and house.get("max_register") not in self.max_register:
+            return False
+        available = _to_date(house.get("available_from"))
+        if self.available_from is not None and (available is None or available < self.available_from):
+            return False
+        if self.available_to is not None and (available is None or available > self.available_to):
+            return False
+        return True
+
+    def __repr__(self):
+        return f"Subscription({self.name!r})"
+
+
+class _LowerBound:
+    """
+    "value >= bound" 条件的位图索引：按下界排序，预先计算前缀并集，
+    查询时二分定位即可得到所有下界 <= value 的订阅者位图。
+    """
+
+    def __init__(self, bounds):
+        # bounds: [(bound, bit)]，bound 为 None 表示不限制
+        constrained = sorted((b, bit) for b, bit in bounds if b is not None)
+        unconstrained = 0
+        for b, bit in bounds:
+            if b is None:
+                unconstrained |= bit
+        self.keys = []
+        self.bits = []
+        acc = unconstrained
+        for b, bit in constrained:
+            acc |= bit
+            if self.keys and self.keys[-1] == b:
+                self.bits[-1] = acc
+            else:
+                self.keys.append(b)
+                self.bits.append(acc)
+        self.unconstrained = unconstrained
+        self.active = bool(constrained)
+
+    def query(self, value):
+        if value is None:
+            return self.unconstrained
+        i = bisect_right(self.keys, value) - 1
+        return self.bits[i] if i >= 0 else self.unconstrained
+
+
+class _UpperBound:
+    """"value <= bound" 条件的位图索引：按上界排序，预先计算后缀并集"""
+
+    def __init__(self, bounds):
+        constrained = sorted(((b, bit) for b, bit in bounds if b is not None), reverse=True)
+        unconstrained = 0
+        for b, bit in bounds:
+            if b is None:
+                unconstrained |= bit
+        keys = []
+        bits = []
+        acc = unconstrained
+        for b, bit in constrained:
+            acc |= bit
+            if keys and keys[-1] == b:
+                bits[-1] = acc
+            else:
+                keys.append(b)
+                bits.append(acc)
+        keys.reverse()
+        bits.reverse()
+        self.keys = keys
+        self.bits = bits
+        self.unconstrained = unconstrained
+        self.active = bool(constrained)
+
+    def query(self, value):
+        if value is None:
+            return self.unconstrained
+        i = bisect_left(self.keys, value)
+        return self.bits[i] if i < len(self.keys) else self.unconstrained
+
+
+class _Categorical:
+    """离散字段（房间数、合同类型、入住人数）的位图索引：取值 -> 位图，外加不限制的订阅者位图"""
+
+    def __init__(self, values):
+        self.by_value = {}
+        self.unconstrained = 0
+        for allowed, bit in values:
+            if allowed is None:
+                self.unconstrained |= bit
+                continue
+            for v in allowed:
+                self.by_value[v] = self.by_value.get(v, 0) | bit
+        self.active = bool(self.by_value)
+
+    def query(self, value):
+        return self.by_value.get(value, 0) | self.unconstrained
+
+
+class _CityBucket:
+    """单个城市的订阅索引，订阅者在桶内按位编号"""
+
+    def __init__(self, subscriptions):
+        self.subscriptions = subscriptions
+        bits = [1 << i for i in range(len(subscriptions))]
+        self.all_bits = (1 << len(subscriptions)) - 1
+        pairs = list(zip(subscriptions, bits))
+
+        self.direct_only = 0
+        for s, bit in pairs:
+            if s.only_direct_booking:
+                self.direct_only |= bit
+
+        self.min_price = _LowerBound([(s.min_price, bit) for s, bit in pairs])
+        self.max_price = _UpperBound([(s.max_price, bit) for s, bit in pairs])
+        self.min_area = _LowerBound([(s.min_area, bit) for s, bit in pairs])
+        self.available_from = _LowerBound([(s.available_from, bit) for s, bit in pairs])
+        self.available_to = _UpperBound([(s.available_to, bit) for s, bit in pairs])
+        self.rooms = _Categorical([(s.rooms, bit) for s, bit in pairs])
+        self.contract_types = _Categorical([(s.contract_types, bit) for s, bit in pairs])
+        self.max_register = _Categorical([(s.max_register, bit) for s, bit in pairs])
+
+    def match(self, house):
+        bits = self.all_bits
+        if not house.get("direct_booking"):
+            bits &= ~self.direct_only
+        price = _to_float(house.get("price_inc"))
+        area = _to_float(house.get("area"))
+        available = _to_date(house.get("available_from"))
+        # 只对有订阅者设置了的条件做位运算，位图为空时提前结束
+        for index, value in (
+            (self.max_price, price),
+            (self.min_price, price),
+            (self.min_area, area),
+            (self.rooms, house.get("rooms")),
+            (self.contract_types, house.get("contract_type")),
+            (self.max_register, house.get("max_register")),
+            (self.available_from, available),
+            (self.available_to, available),
+        ):
+            if not bits:
+                return []
+            if index.active:
+                bits &= index.query(value)
+
+        matched = []
+        while bits:
+            low = bits & -bits
+            matched.append(self.subscriptions[low.bit_length() - 1])
+            bits ^= low
+        return matched
+
+
+class SubscriptionIndex:
+    """
+    订阅者索引：按城市分桶，桶内用排序后的价格/面积/日期区间和离散字段位图组合筛选，
+    为新房源查找匹配的订阅者时只需几次二分查找和位运算，而不必逐个检查所有订阅者。
+    """
+
+    def __init__(self, subscriptions):
+        self.subscriptions = list(subscriptions)
+        by_city = {}
+        for s in self.subscriptions:
+            for city in s.cities:
+                by_city.setdefault(city, []).append(s)
+        self._buckets = {city: _CityBucket(subs) for city, subs in by_city.items()}
+        logging.debug(f"订阅索引已建立: {len(self.subscriptions)} 个订阅者, {len(self._buckets)} 个城市")
+
+    @property
+    def cities(self):
+        return set(self._buckets)
+
+    def match(self, house):
+        """返回与房源匹配的订阅者列表"""
+        bucket = self._buckets.get(str(house.get("city")))
+        if bucket is None:
+            return []
+        return bucket.match(house)
@@ -1,127 +1,365 @@
+"""
+houses.db 查看与导出工具。
+
+按 (created_at, id) 游标分页（keyset pagination），不使用 OFFSET，翻到第几页都只读取一页数据；
+按城市、状态、价格筛选时使用 db.create_table 创建的索引。行数统计读取由触发器维护的 house_counts 汇总表，
+不对 houses 做 COUNT(*) 全表扫描。CSV/JSON 导出按批次流式写出，内存占用与总行数无关。
+数据库以只读方式打开，不修改表结构；索引或汇总表还不存在时（监控程序尚未用新版本启动过）退回不使用它们的查询。
+
+用法:
+    python view_db.py                                    # 行数统计和最新的一页房源
+    python view_db.py list --city 24 --status available  # 翻页时加上输出的 --after 游标
+    python view_db.py list --min-price 800 --max-price 1200 --limit 50 --after '2026-01-01 12:00:00|1234'
+    python view_db.py export --format csv --output houses.csv
+    python view_db.py export --format jsonl --status occupied > occupied.jsonl
+    python view_db.py counts [--city 24]
+    python view_db.py schema
+    python view_db.py explain --city 24 --min-price 800  # 查看查询计划，确认使用了索引
+"""
+import argparse
+import csv
+import json
+import os
+import pathlib
 import sqlite3
 import sys
 
-def view_table_schema(cursor, table_name):
-    """显示表结构"""
-    print(f"\n--- {table_name} 表结构 ---")
-    cursor.execute(f"PRAGMA table_info({table_name})")
-    columns = cursor.fetchall()
-    for col in columns:
-        print(f"{col[0]}: {col[1]} ({col[2]}) {'PRIMARY KEY' if col[5] else ''}")
-
-def view_table_data(cursor, table_name, limit=10):
-    """显示表数据"""
-    print(f"\n--- {table_name} 数据 (最多 {limit} 条) ---")
-    cursor.execute(f"SELECT * FROM {table_name} LIMIT {limit}")
-    rows = cursor.fetchall()
-
-    # 获取列名
-    cursor.execute(f"PRAGMA table_info({table_name})")
-    columns = cursor.fetchall()
-    header = [col[1] for col in columns]
-
-    # 打印表头
-    print("  ".join([f"{col:<15}" for col in header]))
-    print("-" * (17 * len(header)))
-
-    # 打印数据
-    for row in rows:
-        print("  ".join([f"{str(val):<15}" for val in row]))
-
-    # 显示总记录数
-    cursor.execute(f"SELECT COUNT(*) FROM {table_name}")
-    count = cursor.fetchone()[0]
-    print(f"\n总记录数: {count}")
-
-def view_unoccupied_houses(cursor, limit=10):
-    """显示未被占用的房源"""
-    print(f"\n--- 当前可用房源 (最多 {limit} 条) ---")
-    query = """
-    SELECT url_key, city, area, price_inc, available_from, rooms, contract_type, created_at 
-    FROM houses 
-    WHERE occupied_at IS NULL 
-    ORDER BY created_at DESC
-    LIMIT ?
+import db
+
+COLUMNS = ("id", "url_key", "city", "area", "price_inc", "price_exc", "rooms", "available_from",
+           "contract_type", "booking_type", "max_register", "created_at", "occupied_at")
+
+# 表格输出的列和列宽
+TABLE_COLUMNS = (("id", 8), ("url_key", 28), ("city", 6), ("area", 6), ("price_inc", 10), ("rooms", 8),
+                 ("available_from", 12), ("created_at", 19), ("occupied_at", 19))
+
+# db.create_table 创建的分页索引，缺少时不指定索引，由 SQLite 自行选择
+INSPECTOR_INDEXES = ("idx_created_id", "idx_city_created_id", "idx_available_created_id", "idx_price_real")
+
+EXPORT_BATCH = 1000
+STATUSES = ("available", "occupied")
+
+# 价格区间内的房源少于该数量时按价格索引查询再排序（最多排序这么多行），否则按时间索引顺序扫描并逐行过滤价格
+SELECTIVE_PRICE_ROWS = 5000
+
+
+class Filters:
+    """列表、导出和统计共用的筛选条件"""
+
+    def __init__(self, city=None, status=None, min_price=None, max_price=None):
+        self.city = city
+        self.status = status
+        self.min_price = min_price
+        self.max_price = max_price
+
+    @classmethod
+    def from_args(cls, args):
+        return cls(args.city, args.status, args.min_price, args.max_price)
+
+    @property
+    def has_price(self):
+        return self.min_price is not None or self.max_price is not None
+
+    def where(self, price_index=True):
+        """
+        :param price_index: 为 False 时价格条件前加一元 +，使其不能使用价格索引，只作为逐行过滤条件
+        :return: (条件列表, 参数列表)
+        """
+        clauses, params = [], []
+        if self.city is not None:
+            clauses.append("city = ?")
+            params.append(self.city)
+        if self.status == "available":
+            clauses.append("occupied_at IS NULL")
+        elif self.status == "occupied":
+            clauses.append("occupied_at IS NOT NULL")
+        # 与索引 idx_price_real 的表达式一致，才能使用该索引
+        price = "CAST(price_inc AS REAL)" if price_index else "+CAST(price_inc AS REAL)"
+        if self.min_price is not None:
+            clauses.append(f"{price} >= ?")
+            params.append(self.min_price)
+        if self.max_price is not None:
+            clauses.append(f"{price} <= ?")
+            params.append(self.max_price)
+        return clauses, params
+
+
+def parse_cursor(value):
+    """游标格式为 '<created_at>|<id>'"""
+    created_at, sep, row_id = value.rpartition("|")
+    if not sep or not row_id.isdigit():
+        raise argparse.ArgumentTypeError(f"无效的游标: {value}，格式应为 '<created_at>|<id>'")
+    return created_at, int(row_id)
+
+
+def format_cursor(row):
+    return f"{row['created_at']}|{row['id']}"
+
+
+def schema_objects(conn):
+    """:return: 数据库中的表和索引名"""
+    return {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type IN ('table', 'index')")}
+
+
+def capped_count(conn, clauses, params, limit=SELECTIVE_PRICE_ROWS):
+    """满足条件的行数，最多数到 limit 行就停止，不会扫描整个表"""
+    where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+    return conn.execute(f"SELECT COUNT(*) FROM (SELECT 1 FROM houses {where} LIMIT ?)", params + [limit]).fetchone()[0]
+
+
+def price_is_selective(conn, filters):
+    """通过价格索引数一数区间内的房源（最多数到 SELECTIVE_PRICE_ROWS），判断是否应该使用价格索引"""
+    if not filters.has_price or "idx_price_real" not in schema_objects(conn):
+        return False
+    clauses, params = Filters(min_price=filters.min_price, max_price=filters.max_price).where()
+    return capped_count(conn, clauses, params) < SELECTIVE_PRICE_ROWS
+
+
+def page_query(filters, after=None, limit=20, ascending=False, price_index=False, objects=frozenset()):
+    """
+    生成一页查询：按 (created_at, id) 排序，从游标之后开始。
+    没有统计信息（ANALYZE）时 SQLite 可能选错索引，所以在这里直接指定：价格区间较窄时用价格索引，
+    只筛选可用房源时用可用房源的部分索引，其余情况由 SQLite 在时间索引和城市索引之间选择。
+    :param objects: schema_objects() 的结果，只指定其中存在的索引。
     """
-    cursor.execute(query, (limit,))
-    rows = cursor.fetchall()
+    clauses, params = filters.where(price_index)
+    if after is not None:
+        clauses.append(f"(created_at, id) {'>' if ascending else '<'} (?, ?)")
+        params.extend(after)
+    where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+    if price_index:
+        hint = "INDEXED BY idx_price_real"
+    elif filters.status == "available" and filters.city is None and "idx_available_created_id" in objects:
+        hint = "INDEXED BY idx_available_created_id"
+    else:
+        hint = ""
+    order = "ASC" if ascending else "DESC"
+    sql = f"SELECT {', '.join(COLUMNS)} FROM houses {hint} {where} ORDER BY created_at {order}, id {order} LIMIT ?"
+    return sql, params + [limit]
 
-    # 表头
-    header = ["URL Key", "城市ID", "面积", "价格", "可用日期", "房间数", "合同类型", "创建时间"]
-    print("  ".join([f"{col:<15}" for col in header]))
-    print("-" * (17 * len(header)))
 
-    # 打印数据
-    for row in rows:
-        print("  ".join([f"{str(val):<15}" for val in row]))
-
-    # 显示总记录数
-    cursor.execute("SELECT COUNT(*) FROM houses WHERE occupied_at IS NULL")
-    count = cursor.fetchone()[0]
-    print(f"\n当前可用房源数: {count}")
-
-def view_recent_occupied(cursor, limit=10):
-    """显示最近被占用的房源"""
-    print(f"\n--- 最近被占用的房源 (最多 {limit} 条) ---")
-    query = """
-    SELECT url_key, city, area, price_inc, available_from, rooms, contract_type, created_at, occupied_at 
-    FROM houses 
-    WHERE occupied_at IS NOT NULL 
-    ORDER BY occupied_at DESC
-    LIMIT ?
+def fetch_page(conn, filters, after=None, limit=20, ascending=False):
+    """:return: (本页的行, 下一页的游标；没有下一页时为 None)"""
+    sql, params = page_query(filters, after, limit + 1, ascending, price_is_selective(conn, filters),
+                             schema_objects(conn))
+    rows = conn.execute(sql, params).fetchall()
+    if len(rows) > limit:
+        rows = rows[:limit]
+        return rows, format_cursor(rows[-1])
+    return rows, None
+
+
+def iter_rows(conn, filters, after=None, ascending=False, batch=EXPORT_BATCH):
+    """逐批按游标读取所有匹配的行，每批单独查询，内存中最多只有一批"""
+    price_index = price_is_selective(conn, filters)
+    objects = schema_objects(conn)
+    while True:
+        sql, params = page_query(filters, after, batch, ascending, price_index, objects)
+        rows = conn.execute(sql, params).fetchall()
+        yield from rows
+        if len(rows) < batch:
+            return
+        after = (rows[-1]["created_at"], rows[-1]["id"])
+
+
+def count_rows(conn, filters):
+    """
+    统计匹配的行数。只按城市和状态筛选时读取汇总表；有价格条件或没有汇总表时最多数到 SELECTIVE_PRICE_ROWS 行。
+    :return: (行数, 是否为精确值)；不是精确值时实际行数不少于返回的行数。
     """
-    cursor.execute(query, (limit,))
-    rows = cursor.fetchall()
+    if not filters.has_price and db.SUMMARY_TABLE in schema_objects(conn):
+        clauses, params = [], []
+        if filters.city is not None:
+            clauses.append("city = ?")
+            params.append(filters.city)
+        if filters.status is not None:
+            clauses.append("status = ?")
+            params.append(filters.status)
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        return conn.execute(f"SELECT COALESCE(SUM(count), 0) FROM {db.SUMMARY_TABLE} {where}", params).fetchone()[0], True
+    clauses, params = filters.where(price_is_selective(conn, filters))
+    count = capped_count(conn, clauses, params)
+    return count, count < SELECTIVE_PRICE_ROWS
 
-    # 表头
-    header = ["URL Key", "城市ID", "面积", "价格", "可用日期", "房间数", "合同类型", "创建时间", "占用时间"]
-    print("  ".join([f"{col:<15}" for col in header]))
-    print("-" * (17 * len(header)))
 
-    # 打印数据
+def _cell(value, width):
+    text = "" if value is None else str(value)
+    return text[:width].ljust(width)
+
+
+def print_table(rows, out=sys.stdout):
+    out.write("  ".join(_cell(name, width) for name, width in TABLE_COLUMNS) + "\n")
+    out.write("-" * (sum(width + 2 for _, width in TABLE_COLUMNS) - 2) + "\n")
     for row in rows:
-        print("  ".join([f"{str(val):<15}" for val in row]))
+        out.write("  ".join(_cell(row[name], width) for name, width in TABLE_COLUMNS) + "\n")
 
-    # 显示总记录数
-    cursor.execute("SELECT COUNT(*) FROM houses WHERE occupied_at IS NOT NULL")
-    count = cursor.fetchone()[0]
-    print(f"\n已占用房源数: {count}")
 
-def main():
-    # 连接数据库
-    try:
-        conn = sqlite3.connect("houses.db")
-        cursor = conn.cursor()
+def write_rows(rows, fmt, out):
+    """流式写出行：csv、jsonl（每行一个 JSON 对象）或 json（一个 JSON 数组）"""
+    count = 0
+    if fmt == "csv":
+        writer = csv.writer(out)
+        writer.writerow(COLUMNS)
+        for row in rows:
+            writer.writerow(tuple(row))
+            count += 1
+    elif fmt == "jsonl":
+        for row in rows:
+            out.write(json.dumps(dict(zip(COLUMNS, row)), ensure_ascii=False) + "\n")
+            count += 1
+    elif fmt == "json":
+        out.write("[")
+        for row in rows:
+            out.write(("\n" if count == 0 else ",\n") + json.dumps(dict(zip(COLUMNS, row)), ensure_ascii=False))
+            count += 1
+        out.write("\n]\n")
+    else:
+        print_table(rows, out)
+    return count
 
-        # 获取所有表
-        cursor.execute("SELECT name FROM sqlite_master WHERE type='table';")
-        tables = cursor.fetchall()
 
-        if not tables:
-            print("数据库中没有表！")
-            return
+def print_counts(conn, city=None):
+    """按城市列出可用、已占用房源数；没有汇总表时按城市分组计数（扫描 idx_city_occupied_at 索引）"""
+    params = (city,) if city is not None else ()
+    if db.SUMMARY_TABLE in schema_objects(conn):
+        source = db.SUMMARY_TABLE
+    else:
+        source = """(SELECT city, CASE WHEN occupied_at IS NULL THEN 'available' ELSE 'occupied' END AS status,
+                             COUNT(*) AS count FROM houses GROUP BY city, status)"""
+    rows = conn.execute(
+        f"""SELECT city, status, count FROM {source}
+            {'WHERE city = ?' if city is not None else ''} ORDER BY city""",
+        params,
+    ).fetchall()
+    per_city = {}
+    for row in rows:
+        per_city.setdefault(row["city"], dict.fromkeys(STATUSES, 0))[row["status"]] = row["count"]
+    print(f"{'城市ID':<8}{'可用':>10}{'已占用':>10}{'合计':>10}")
+    totals = dict.fromkeys(STATUSES, 0)
+    for city_id, counts in sorted(per_city.items(), key=lambda item: str(item[0])):
+        print(f"{str(city_id):<8}{counts['available']:>10}{counts['occupied']:>10}{sum(counts.values()):>10}")
+        for status in STATUSES:
+            totals[status] += counts[status]
+    print(f"{'合计':<8}{totals['available']:>10}{totals['occupied']:>10}{sum(totals.values()):>10}")
+
 
-        print("数据库中的表:")
-        for i, table in enumerate(tables):
-            print(f"{i+1}. {table[0]}")
+def print_schema(conn):
+    """显示表结构和索引（只读取 sqlite_master 和 PRAGMA，不扫描数据）"""
+    tables = conn.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%' ORDER BY name"
+    ).fetchall()
+    for table in tables:
+        name = table["name"]
+        print(f"\n--- {name} 表结构 ---")
+        for col in conn.execute(f"PRAGMA table_info({name})"):
+            print(f"{col[1]}: {col[2]} {'PRIMARY KEY' if col[5] else ''}")
+        for index in conn.execute(
+            "SELECT name, sql FROM sqlite_master WHERE type = 'index' AND tbl_name = ? AND sql IS NOT NULL", (name,)
+        ):
+            print(f"索引 {index['name']}: {' '.join(index['sql'].split())}")
 
-        # 显示表结构
-        for table in tables:
-            view_table_schema(cursor, table[0])
 
-        # 显示具体数据
-        for table in tables:
-            view_table_data(cursor, table[0])
+def explain(conn, filters, after=None, ascending=False):
+    price_index = price_is_selective(conn, filters)
+    sql, params = page_query(filters, after, 20, ascending, price_index, schema_objects(conn))
+    print(" ".join(sql.split()))
+    for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}", params):
+        print(f"  {row[-1]}")
+    if price_index:
+        print(f"  价格区间内少于 {SELECTIVE_PRICE_ROWS} 行，按价格索引取出后排序，排序的行数有上限")
 
-        # 显示特定查询
-        view_unoccupied_houses(cursor)
-        view_recent_occupied(cursor)
 
+def open_db(path):
+    if not os.path.exists(path):
+        print(f"数据库不存在: {path}")
+        sys.exit(1)
+    # 只读打开：不修改正在运行的监控程序的数据库，也不与它争用写锁
+    conn = sqlite3.connect(f"{pathlib.Path(path).resolve().as_uri()}?mode=ro", uri=True, timeout=30)
+    conn.row_factory = sqlite3.Row
+    objects = schema_objects(conn)
+    missing = [name for name in (*INSPECTOR_INDEXES, db.SUMMARY_TABLE) if name not in objects]
+    if missing:
+        print(f"提示: 数据库中缺少 {', '.join(missing)}，查询和统计会较慢；"
+              f"用当前版本启动一次监控程序（python main.py）即可创建", file=sys.stderr)
+    return conn
+
+
+def add_filter_arguments(parser):
+    parser.add_argument("--city", help="城市ID")
+    parser.add_argument("--status", choices=STATUSES, help="available: 当前可用；occupied: 已被占用")
+    parser.add_argument("--min-price", type=float, help="最低价格（price_inc）")
+    parser.add_argument("--max-price", type=float, help="最高价格（price_inc）")
+    parser.add_argument("--after", type=parse_cursor, help="从该游标之后开始，游标由上一页输出")
+    parser.add_argument("--asc", action="store_true", help="从最早的房源开始（默认从最新的开始）")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="houses.db 查看与导出工具")
+    parser.add_argument("--db", default=db.DB_PATH, help="数据库文件")
+    commands = parser.add_subparsers(dest="command")
+
+    list_parser = commands.add_parser("list", help="分页列出房源")
+    add_filter_arguments(list_parser)
+    list_parser.add_argument("--limit", type=int, default=20, help="每页行数")
+    list_parser.add_argument("--format", choices=("table", "csv", "jsonl", "json"), default="table")
+
+    export_parser = commands.add_parser("export", help="流式导出所有匹配的房源")
+    add_filter_arguments(export_parser)
+    export_parser.add_argument("--format", choices=("csv", "jsonl", "json"), default="csv")
+    export_parser.add_argument("--output", help="输出文件，默认写到标准输出")
+
+    counts_parser = commands.add_parser("counts", help="按城市统计房源数（读取汇总表）")
+    counts_parser.add_argument("--city", help="城市ID")
+
+    commands.add_parser("schema", help="显示表结构和索引")
+
+    explain_parser = commands.add_parser("explain", help="显示分页查询的查询计划")
+    add_filter_arguments(explain_parser)
+
+    args = parser.parse_args()
+    conn = open_db(args.db)
+    try:
+        if args.command == "list":
+            filters = Filters.from_args(args)
+            rows, cursor = fetch_page(conn, filters, args.after, args.limit, args.asc)
+            write_rows(rows, args.format, sys.stdout)
+            # 行数和游标写到标准错误，csv/json 输出可以直接重定向
+            count, exact = count_rows(conn, filters)
+            print(f"\n匹配 {'' if exact else '≥'}{count} 条房源", file=sys.stderr)
+            if cursor:
+                print(f"下一页: --after '{cursor}'", file=sys.stderr)
+            else:
+                print("已是最后一页", file=sys.stderr)
+        elif args.command == "export":
+            filters = Filters.from_args(args)
+            out = open(args.output, "w", newline="", encoding="utf-8") if args.output else sys.stdout
+            try:
+                count = write_rows(iter_rows(conn, filters, args.after, args.asc), args.format, out)
+            finally:
+                if args.output:
+                    out.close()
+            print(f"已导出 {count} 条房源", file=sys.stderr)
+        elif args.command == "counts":
+            print_counts(conn, args.city)
+        elif args.command == "schema":
+            print_schema(conn)
+        elif args.command == "explain":
+            explain(conn, Filters.from_args(args), args.after, args.asc)
+        else:
+            print_counts(conn)
+            print("\n--- 最新房源 ---")
+            rows, cursor = fetch_page(conn, Filters())
+            print_table(rows)
+            if cursor:
+                print(f"\n下一页: python view_db.py list --after '{cursor}'")
     except sqlite3.Error as e:
         print(f"数据库错误: {e}")
+    except BrokenPipeError:
+        # 输出被管道截断（如 | head），直接退出
+        sys.stderr.close()
     finally:
-        if conn:
-            conn.close()
+        conn.close()
+
 
 if __name__ == "__main__":
     main()
@@ -1,19 +1,76 @@
-from http.server import BaseHTTPRequestHandler, HTTPServer
-import threading
-
-class HealthCheckHandler(BaseHTTPRequestHandler):
-    def do_GET(self):
-        self.send_response(200)
-        self.send_header('Content-type', 'text/html')
-        self.end_headers()
-        self.wfile.write(b'ok')
-
-def run_server():
-    server_address = ('', 80)
-    httpd = HTTPServer(server_address, HealthCheckHandler)
-    httpd.serve_forever()
-
-def start_web_server():
-    server_thread = threading.Thread(target=run_server)
-    server_thread.daemon = True
-    server_thread.start()
\ No newline at end of file
+import asyncio
+import functools
+import logging
+
+HEALTH_PORT = 80
+
+# 请求行和请求头的最大长度，健康检查不需要请求体
+MAX_REQUEST_BYTES = 8192
+
+_REASONS = {200: "OK", 404: "Not Found", 405: "Method Not Allowed", 500: "Internal Server Error"}
+
+
+def _health():
+    return "text/html", b"ok"
+
+
+async def _handle(reader, writer, routes):
+    status, content_type, body = 200, "text/html", b"ok"
+    try:
+        head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), timeout=10)
+        request_line = head[:MAX_REQUEST_BYTES].split(b"\r\n", 1)[0].decode("latin-1")
+        method, target = request_line.split(" ")[:2]
+        path = target.split("?", 1)[0]
+        if method not in ("GET", "HEAD"):
+            status, content_type, body = 405, "text/plain", b"method not allowed"
+        else:
+            handler = routes.get(path)
+            if handler is None:
+                # 以 / 结尾的路由匹配该前缀下的所有路径，剩余部分作为参数传给处理函数
+                prefix = max((p for p in routes if p.endswith("/") and p != "/" and path.startswith(p)),
+                             key=len, default=None)
+                # 未注册的路径也返回 ok，兼容只探测 / 的健康检查
+                handler = functools.partial(routes[prefix], path[len(prefix):]) if prefix else _health
+            try:
+                result = handler()
+                if asyncio.iscoroutine(result):
+                    result = await result
+                if len(result) == 3:
+                    status, content_type, body = result
+                else:
+                    content_type, body = result
+                if isinstance(body, str):
+                    body = body.encode()
+            except Exception as e:
+                logging.error(f"健康检查接口 {path} 处理失败: {e}", exc_info=True)
+                status, content_type, body = 500, "text/plain", b"internal error"
+        writer.write(
+            f"HTTP/1.1 {status} {_REASONS.get(status, '')}\r\n"
+            f"Content-Type: {content_type}\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            "Connection: close\r\n\r\n".encode("latin-1")
+        )
+        if method != "HEAD":
+            writer.write(body)
+        await writer.drain()
+    except (asyncio.TimeoutError, asyncio.IncompleteReadError, asyncio.LimitOverrunError, ValueError,
+            ConnectionError):
+        pass
+    finally:
+        writer.close()
+
+
+async def start_web_server(routes=None, host="", port=HEALTH_PORT):
+    """
+    在当前事件循环中启动健康检查/指标服务。
+    :param routes: 路径 -> 处理函数，处理函数返回 (Content-Type, 响应体) 或 (状态码, Content-Type, 响应体)，
+                   可以是协程。以 / 结尾的路径为前缀路由，处理函数以路径的剩余部分为参数。
+    :return: asyncio.Server，调用 close() 停止服务。
+    """
+    routes = dict(routes or {})
+    routes.setdefault("/health", _health)
+    server = await asyncio.start_server(
+        lambda r, w: _handle(r, w, routes), host or None, port, limit=MAX_REQUEST_BYTES
+    )
+    logging.info(f"健康检查服务已启动，端口 {port}，路径: {', '.join(sorted(routes))}")
+    return server